@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""Benchmark the Markdown parsing and conversion hot paths of confluence_publish.py."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import timeit
+from collections.abc import Callable
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import confluence_publish as cp
+
+DEFAULT_SIZES = "1k,64k,1m,10m,50m"
+SIZE_UNITS = {"k": 1024, "m": 1024 * 1024}
+WORDS = (
+    "publish page storage markup confluence space parent label attachment diagram render version "
+    "request cache ledger title heading table fence macro body token stream batch retry"
+).split()
+
+
+def parse_size(raw: str) -> int:
+    value = raw.strip().lower()
+    unit = SIZE_UNITS.get(value[-1:], 1)
+    number = value[:-1] if value[-1:] in SIZE_UNITS else value
+    try:
+        size = int(float(number) * unit)
+    except ValueError:
+        raise ValueError(f"invalid size: {raw!r}") from None
+    if size <= 0:
+        raise ValueError(f"invalid size: {raw!r}")
+    return size
+
+
+def format_size(size: int) -> str:
+    for suffix, unit in (("m", SIZE_UNITS["m"]), ("k", SIZE_UNITS["k"])):
+        if size >= unit and size % unit == 0:
+            return f"{size // unit}{suffix}"
+    return str(size)
+
+
+def _sentence(rnd: random.Random, words: int) -> str:
+    out = []
+    for _ in range(words):
+        word = rnd.choice(WORDS)
+        roll = rnd.random()
+        if roll < 0.05:
+            word = f"**{word}**"
+        elif roll < 0.1:
+            word = f"*{word}*"
+        elif roll < 0.15:
+            word = f"`{word}()`"
+        elif roll < 0.17:
+            word = f"<{word}> & {word}"
+        out.append(word)
+    return " ".join(out).capitalize() + "."
+
+
+def _table(rnd: random.Random, rows: int) -> str:
+    cols = rnd.randint(2, 6)
+    aligns = [rnd.choice(["---", ":---", "---:", ":---:"]) for _ in range(cols)]
+    lines = [
+        "| " + " | ".join(rnd.choice(WORDS).title() for _ in range(cols)) + " |",
+        "| " + " | ".join(aligns) + " |",
+    ]
+    for _ in range(rows):
+        cells = []
+        for _ in range(cols):
+            cell = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 4)))
+            if rnd.random() < 0.1:
+                cell += " \\| escaped"
+            if rnd.random() < 0.1:
+                cell = f"`{cell}`"
+            cells.append(cell)
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def _code_fence(rnd: random.Random) -> str:
+    lang = rnd.choice(["python", "bash", "json", ""])
+    body = "\n".join(
+        f"    {rnd.choice(WORDS)}_{i} = {rnd.randint(0, 999)}  # ]]> {rnd.choice(WORDS)}" for i in range(8)
+    )
+    return f"```{lang}\n{body}\n```"
+
+
+def _mermaid_fence(rnd: random.Random) -> str:
+    nodes = [rnd.choice(WORDS).title() for _ in range(5)]
+    edges = "\n".join(f"  {a}{i} --> {b}{i + 1}" for i, (a, b) in enumerate(zip(nodes, nodes[1:])))
+    return f"```mermaid\ngraph TD\n{edges}\n```"
+
+
+def _bullets(rnd: random.Random) -> str:
+    return "\n".join(f"{rnd.choice('-*')} {_sentence(rnd, rnd.randint(3, 10))}" for _ in range(rnd.randint(2, 6)))
+
+
+def generate_corpus(size: int, *, seed: int = 0, tables_only: bool = False) -> str:
+    """Deterministic Markdown document of about `size` bytes with front matter, tables, fences and Mermaid blocks."""
+    rnd = random.Random(seed)
+    parts = ["---", "labels: docs, generated, benchmark", "parent_id: 123456", "---", ""]
+    total = sum(len(part) + 1 for part in parts)
+    title_at = size // 2  # first H1 halfway through, so derive_title has to scan for it
+    while total < size:
+        if tables_only:
+            block = _table(rnd, rnd.randint(5, 40))
+        else:
+            roll = rnd.random()
+            if total >= title_at:
+                block, title_at = "# Generated Benchmark Corpus", size + 1
+            elif roll < 0.15:
+                block = f"{'#' * rnd.randint(2, 4)} {_sentence(rnd, rnd.randint(2, 6))}"
+            elif roll < 0.45:
+                block = " ".join(_sentence(rnd, rnd.randint(6, 18)) for _ in range(rnd.randint(1, 4)))
+            elif roll < 0.6:
+                block = _bullets(rnd)
+            elif roll < 0.75:
+                block = _table(rnd, rnd.randint(2, 12))
+            elif roll < 0.9:
+                block = _code_fence(rnd)
+            else:
+                block = _mermaid_fence(rnd)
+        parts.append(block)
+        parts.append("")
+        total += len(block.encode("utf-8")) + 2
+    return "\n".join(parts)
+
+
+def generate_labels(size: int, *, seed: int = 0) -> tuple[list[str], list[str]]:
+    """Two label lists totalling about `size` bytes, with case-insensitive duplicates between and within them."""
+    rnd = random.Random(seed)
+    count = max(2, size // 12)
+    pool = [f"{rnd.choice(WORDS)}-{i}" for i in range(count // 2)]
+    base = [rnd.choice(pool) for _ in range(count // 2)]
+    extra = [rnd.choice(pool).upper() if rnd.random() < 0.3 else rnd.choice(pool) for _ in range(count // 2)]
+    return base, extra
+
+
+def build_cases(size: int) -> list[tuple[str, Callable[[], Any]]]:
+    corpus = generate_corpus(size)
+    tables = generate_corpus(size, seed=1, tables_only=True)
+    metadata, body = cp.parse_front_matter(corpus)
+    table_rows = [line for line in tables.splitlines() if line.startswith("|")]
+    base_labels, extra_labels = generate_labels(size)
+    path = Path("generated-benchmark-corpus.md")
+
+    def convert(text: str, mode: str) -> Callable[[], Any]:
+        return lambda: cp.simple_markdown_to_html(
+            text, mermaid_mode=mode, mermaid_image_prefix="Bench", mermaid_image_plans=[]
+        )
+
+    return [
+        ("parse_front_matter", lambda: cp.parse_front_matter(corpus)),
+        ("derive_title", lambda: cp.derive_title(path, body, metadata)),
+        ("simple_markdown_to_html[code]", convert(body, "code")),
+        ("simple_markdown_to_html[macro]", convert(body, "macro")),
+        ("simple_markdown_to_html[attachment]", convert(body, "attachment")),
+        ("simple_markdown_to_html[tables]", convert(tables, "code")),
+        ("split_table_row", lambda: [cp._split_table_row(row) for row in table_rows]),
+        ("merge_labels", lambda: cp.merge_labels(base_labels, extra_labels)),
+    ]
+
+
+def run_benchmarks(sizes: list[int], *, repeat: int, only: set[str] | None, verbose: bool) -> list[dict[str, Any]]:
+    results: list[dict[str, Any]] = []
+    for size in sizes:
+        for name, func in build_cases(size):
+            if only and name not in only:
+                continue
+            timer = timeit.Timer(func)
+            number, _ = timer.autorange()
+            samples = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+            best = min(samples)
+            result = {
+                "benchmark": name,
+                "size": format_size(size),
+                "size_bytes": size,
+                "loops": number,
+                "repeat": repeat,
+                "best_s": best,
+                "median_s": statistics.median(samples),
+                "mb_per_s": size / best / (1024 * 1024) if best else None,
+            }
+            results.append(result)
+            if verbose:
+                print(f"{name:38} {format_size(size):>5}  best {best * 1000:10.3f} ms", file=sys.stderr)
+    return results
+
+
+def compare_results(
+    results: list[dict[str, Any]], baseline: dict[str, Any], *, max_regression: float
+) -> list[str]:
+    previous = {(r["benchmark"], r["size_bytes"]): r["best_s"] for r in baseline.get("results", [])}
+    regressions: list[str] = []
+    for result in results:
+        before = previous.get((result["benchmark"], result["size_bytes"]))
+        if not before:
+            continue
+        ratio = result["best_s"] / before
+        if ratio > 1 + max_regression:
+            regressions.append(
+                f"{result['benchmark']} @ {result['size']}: {before * 1000:.3f} ms -> "
+                f"{result['best_s'] * 1000:.3f} ms ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark confluence_publish.py conversion hot paths")
+    parser.add_argument(
+        "--sizes",
+        default=DEFAULT_SIZES,
+        help=f"Comma-separated corpus sizes, e.g. 1k,64k,1m (default: {DEFAULT_SIZES})",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Timing samples per benchmark (default: 5)")
+    parser.add_argument("--only", default=None, help="Comma-separated benchmark names to run")
+    parser.add_argument("--output", default="-", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", default=None, help="Baseline JSON from an earlier run to check against")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="With --compare, fail when a benchmark is this much slower than the baseline (default: 0.2 = 20%%)",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Print each result to stderr as it completes")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    try:
+        sizes = [parse_size(raw) for raw in args.sizes.split(",") if raw.strip()]
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+    only = {name.strip() for name in args.only.split(",") if name.strip()} if args.only else None
+
+    results = run_benchmarks(sizes, repeat=max(1, args.repeat), only=only, verbose=args.verbose)
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "engine": cp.engine_fingerprint(),
+        "results": results,
+    }
+    payload = json.dumps(report, indent=2) + "\n"
+    if args.output == "-":
+        sys.stdout.write(payload)
+    else:
+        Path(args.output).write_text(payload, encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare_results(results, baseline, max_regression=args.max_regression)
+        for line in regressions:
+            print(f"[regression] {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""Publish N synthetic documents through confluence_publish.main() against the local stand-in and report throughput."""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+from urllib.request import Request, urlopen
+
+import confluence_publish as cp
+from benchmark_conversion import format_size, generate_corpus, parse_size
+
+STANDIN_SCRIPT = Path(__file__).with_name("confluence_standin.py")
+SPACE_KEY = "BENCH"
+
+
+def write_documents(directory: Path, count: int, size: int, *, revision: int) -> None:
+    """`count` Markdown files with unique titles; a new `revision` changes every body so each pass really writes."""
+    for index in range(count):
+        corpus = generate_corpus(size, seed=index)
+        _, body = cp.parse_front_matter(corpus)
+        front_matter = f"---\ntitle: Benchmark Document {index:05d}\nlabels: benchmark, generated\n---\n"
+        marker = f"\n_Revision {revision}._\n" if revision else ""
+        (directory / f"doc-{index:05d}.md").write_text(front_matter + body + marker, encoding="utf-8")
+
+
+def start_standin(args: argparse.Namespace) -> tuple[subprocess.Popen[str], str]:
+    command = [
+        sys.executable,
+        str(STANDIN_SCRIPT),
+        "--port",
+        "0",
+        "--latency-ms",
+        str(args.latency_ms),
+        "--jitter-ms",
+        str(args.jitter_ms),
+        "--rate-limit",
+        str(args.server_rate_limit),
+        "--throttle-rate",
+        str(args.throttle_rate),
+        "--error-rate",
+        str(args.error_rate),
+        "--lost-response-rate",
+        str(args.lost_response_rate),
+        "--seed",
+        str(args.seed),
+    ]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    assert proc.stdout is not None
+    line = proc.stdout.readline().strip()
+    if not line.startswith("Listening on "):
+        proc.kill()
+        raise RuntimeError(f"stand-in did not start: {line!r}")
+    return proc, line.removeprefix("Listening on ")
+
+
+def standin_call(url: str, path: str, *, method: str = "GET") -> dict[str, Any]:
+    with urlopen(Request(f"{url}{path}", method=method, data=b"" if method == "POST" else None), timeout=10) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def publish_pass(directory: Path, args: argparse.Namespace) -> tuple[int, float, str]:
+    """Run main() once over the documents; returns (exit code, seconds, captured output)."""
+    argv = [
+        "confluence_publish.py",
+        "--dotenv",
+        os.devnull,
+        "--glob",
+        str(directory / "*.md"),
+        "--space-key",
+        SPACE_KEY,
+        "--engine",
+        args.engine,
+        "--concurrency",
+        str(args.concurrency),
+        "--rate-limit",
+        str(args.rate_limit),
+        "--retries",
+        str(args.retries),
+        "--mermaid-mode",
+        args.mermaid_mode,
+        "--no-ledger",
+        "--conversion-cache-dir",
+        "off",
+    ]
+    output = io.StringIO()
+    saved_argv = sys.argv
+    sys.argv = argv
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output):
+            code = cp.main()
+    finally:
+        sys.argv = saved_argv
+    return code, time.perf_counter() - started, output.getvalue()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="End-to-end publish throughput against a local Confluence stand-in")
+    parser.add_argument("--docs", type=int, default=200, help="Number of synthetic documents (default: 200)")
+    parser.add_argument("--doc-size", default="8k", help="Approximate size of each document (default: 8k)")
+    parser.add_argument(
+        "--passes",
+        type=int,
+        default=2,
+        help="Publish passes; the first creates, later ones update (default: 2)",
+    )
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync", help="Publisher engine (default: sync)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Publisher concurrency (default: 4)")
+    parser.add_argument("--rate-limit", type=int, default=1000, help="Publisher request rate limit (default: 1000)")
+    parser.add_argument("--retries", type=int, default=3, help="Publisher retries (default: 3)")
+    parser.add_argument(
+        "--mermaid-mode",
+        choices=["code", "macro", "attachment"],
+        default="macro",
+        help="Mermaid mode; attachment renders diagrams via mmdc or mermaid.ink (default: macro)",
+    )
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Stand-in latency per request (default: 20)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Stand-in random extra latency (default: 0)")
+    parser.add_argument(
+        "--server-rate-limit",
+        type=float,
+        default=0.0,
+        help="Stand-in answers 429 above this many requests/second, 0 for unlimited (default: 0)",
+    )
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests the stand-in throttles")
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests the stand-in fails with 5xx",
+    )
+    parser.add_argument(
+        "--lost-response-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of writes the stand-in applies but answers with 504",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the stand-in's fault injection (default: 0)")
+    parser.add_argument("--server", default=None, help="Use an already running stand-in at this URL")
+    parser.add_argument("--output", default="-", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--verbose", action="store_true", help="Echo the publisher output to stderr")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    try:
+        doc_size = parse_size(args.doc_size)
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+    if args.docs < 1 or args.passes < 1:
+        print("--docs and --passes must be at least 1", file=sys.stderr)
+        return 2
+
+    proc: subprocess.Popen[str] | None = None
+    if args.server:
+        url = args.server.rstrip("/")
+    else:
+        proc, url = start_standin(args)
+    os.environ.update(
+        ATLASSIAN_SITE=url,
+        ATLASSIAN_EMAIL="benchmark@example.com",
+        ATLASSIAN_API_TOKEN="benchmark",
+    )
+
+    passes: list[dict[str, Any]] = []
+    failed = 0
+    try:
+        standin_call(url, "/__standin/reset", method="POST")
+        with tempfile.TemporaryDirectory(prefix="confluence-publish-bench-") as tmp:
+            directory = Path(tmp)
+            for revision in range(args.passes):
+                write_documents(directory, args.docs, doc_size, revision=revision)
+                before = standin_call(url, "/__standin/stats")
+                code, elapsed, output = publish_pass(directory, args)
+                after = standin_call(url, "/__standin/stats")
+                if args.verbose:
+                    sys.stderr.write(output)
+                failed += code
+                requests = after["requests"] - before["requests"]
+                by_route = {
+                    route: count - before["by_route"].get(route, 0)
+                    for route, count in after["by_route"].items()
+                    if count - before["by_route"].get(route, 0)
+                }
+                injected = {
+                    status: count - before["injected"].get(status, 0)
+                    for status, count in after["injected"].items()
+                    if count - before["injected"].get(status, 0)
+                }
+                passes.append(
+                    {
+                        "pass": revision + 1,
+                        "kind": "create" if revision == 0 else "update",
+                        "exit_code": code,
+                        "elapsed_s": elapsed,
+                        "docs_per_s": args.docs / elapsed if elapsed else None,
+                        "requests": requests,
+                        "requests_per_doc": requests / args.docs,
+                        "injected": injected,
+                        "by_route": by_route,
+                    }
+                )
+                print(
+                    f"pass {revision + 1}: {args.docs / elapsed:8.1f} docs/s, "
+                    f"{requests / args.docs:5.2f} requests/doc, exit={code}",
+                    file=sys.stderr,
+                )
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "engine": cp.engine_fingerprint(),
+        "settings": {
+            "docs": args.docs,
+            "doc_size": format_size(doc_size),
+            "publisher_engine": args.engine,
+            "concurrency": args.concurrency,
+            "rate_limit": args.rate_limit,
+            "retries": args.retries,
+            "mermaid_mode": args.mermaid_mode,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "server_rate_limit": args.server_rate_limit,
+            "throttle_rate": args.throttle_rate,
+            "error_rate": args.error_rate,
+            "lost_response_rate": args.lost_response_rate,
+        },
+        "passes": passes,
+    }
+    payload = json.dumps(report, indent=2) + "\n"
+    if args.output == "-":
+        sys.stdout.write(payload)
+    else:
+        Path(args.output).write_text(payload, encoding="utf-8")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Check that publishing a file above --stream-threshold-mb keeps memory flat as the file grows.
+
+For each size a Markdown file is written to a temporary directory, parsed and converted the way
+confluence_publish.py does for streamed files, and its page update request body is encoded in full.
+The tracemalloc peak of that work must not grow with the file size.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import confluence_publish as cp
+from benchmark_conversion import format_size, generate_corpus, parse_size
+
+DEFAULT_SIZES = "40m,160m"
+CORPUS_CHUNK = 4 * 1024 * 1024
+
+
+def write_corpus(path: Path, size: int, *, seed: int = 0) -> None:
+    """Write about `size` bytes of generated Markdown without holding more than one chunk of it in memory."""
+    chunk = generate_corpus(min(size, CORPUS_CHUNK), seed=seed)
+    body = chunk.split("---\n", 2)[2]
+    written = 0
+    with path.open("w", encoding="utf-8") as fh:
+        fh.write(chunk)
+        written += len(chunk.encode("utf-8"))
+        while written < size:
+            fh.write(body)
+            written += len(body.encode("utf-8"))
+
+
+def measure(path: Path, *, mermaid_mode: str) -> dict[str, Any]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        doc = cp.parse_document(path)
+        if not doc.streamed:
+            raise RuntimeError(f"{path.name} is below the streaming threshold ({cp.STREAM_MIN_BYTES} bytes)")
+        prepared = cp.prepare_document(
+            doc,
+            default_parent_id=None,
+            default_labels=[],
+            mermaid_mode=mermaid_mode,
+            mermaid_image_width=1000,
+        )
+        payload = cp._ConfluenceApi._update_page_payload(
+            page_id="1",
+            title=doc.title,
+            body_html=prepared.body_html,
+            next_version=2,
+            parent_id=prepared.target_parent,
+        )
+        body = cp.encode_json_body(payload)
+        if not isinstance(body, cp.StreamedJSONBody):
+            raise RuntimeError("the update request body was not streamed")
+        sent = sum(len(chunk) for chunk in body)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"body_bytes": sent, "peak_bytes": peak, "seconds": elapsed}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Check that streamed publishing keeps memory flat")
+    parser.add_argument(
+        "--sizes",
+        default=DEFAULT_SIZES,
+        help=f"Comma-separated file sizes, each above the streaming threshold (default: {DEFAULT_SIZES})",
+    )
+    parser.add_argument(
+        "--mermaid-mode",
+        choices=["code", "macro", "attachment"],
+        default="code",
+        help="Mermaid mode; attachment keeps every diagram source for upload, so it grows with the diagram count "
+        "(default: code)",
+    )
+    parser.add_argument(
+        "--max-growth",
+        type=float,
+        default=0.25,
+        help="Fail when the largest size peaks this much higher than the smallest (default: 0.25 = 25%%)",
+    )
+    parser.add_argument("--output", default="-", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--verbose", action="store_true", help="Print each result to stderr as it completes")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    try:
+        sizes = sorted(parse_size(raw) for raw in args.sizes.split(",") if raw.strip())
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+    if len(sizes) < 2:
+        print("--sizes needs at least two sizes to compare", file=sys.stderr)
+        return 2
+
+    results: list[dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="confluence-stream-bench-") as td:
+        for size in sizes:
+            path = Path(td) / f"stream-{format_size(size)}.md"
+            write_corpus(path, size)
+            try:
+                result = measure(path, mermaid_mode=args.mermaid_mode)
+            except RuntimeError as exc:
+                print(str(exc), file=sys.stderr)
+                return 2
+            finally:
+                file_size = path.stat().st_size
+                path.unlink()
+            result = {"size": format_size(size), "file_bytes": file_size, **result}
+            results.append(result)
+            if args.verbose:
+                print(
+                    f"{result['size']}: peak {result['peak_bytes'] / 1024 / 1024:.1f} MiB "
+                    f"in {result['seconds']:.2f}s",
+                    file=sys.stderr,
+                )
+
+    smallest, largest = results[0]["peak_bytes"], results[-1]["peak_bytes"]
+    growth = largest / smallest - 1 if smallest else 0.0
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "engine": cp.engine_fingerprint(),
+        "mermaid_mode": args.mermaid_mode,
+        "stream_threshold_bytes": cp.STREAM_MIN_BYTES,
+        "peak_growth": growth,
+        "results": results,
+    }
+    payload = json.dumps(report, indent=2) + "\n"
+    if args.output == "-":
+        sys.stdout.write(payload)
+    else:
+        Path(args.output).write_text(payload, encoding="utf-8")
+
+    if growth > args.max_growth:
+        print(
+            f"[regression] tracemalloc peak grew {growth:.0%} from {results[0]['size']} to {results[-1]['size']} "
+            f"({smallest / 1024 / 1024:.1f} MiB -> {largest / 1024 / 1024:.1f} MiB)",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
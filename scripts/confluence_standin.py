@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+"""In-memory stand-in for the Confluence Cloud endpoints confluence_publish.py talks to.
+
+Serves spaces, pages and page labels (REST v2), label edits and attachment child/data (REST v1) over plain HTTP,
+with optional latency, 429 and 5xx injection so publishing throughput can be measured locally.
+Point the publisher at it with ATLASSIAN_SITE=http://127.0.0.1:<port>.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+STATS_PATH = "/__standin/stats"
+RESET_PATH = "/__standin/reset"
+INJECTED_ERROR_STATUSES = (500, 502, 503, 504)
+
+_PAGE_RE = re.compile(r"^/wiki/api/v2/pages/(\d+)$")
+_LABEL_RE = re.compile(r"^/wiki/rest/api/content/(\d+)/label$")
+_PAGE_LABELS_RE = re.compile(r"^/wiki/api/v2/pages/(\d+)/labels$")
+_ATTACHMENTS_RE = re.compile(r"^/wiki/rest/api/content/(\d+)/child/attachment$")
+_ATTACHMENT_DATA_RE = re.compile(r"^/wiki/rest/api/content/(\d+)/child/attachment/([\w-]+)/data$")
+_ROUTE_ID_RE = re.compile(r"/(?:\d+|att\d+)(?=/|$)")
+
+
+@dataclass
+class Faults:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+    lost_response_rate: float = 0.0
+    rate_limit: float = 0.0
+    retry_after: int = 1
+    seed: int | None = None
+
+
+class HTTPFailure(Exception):
+    def __init__(self, status: int, message: str, headers: dict[str, str] | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class StandinState:
+    """Spaces, pages, labels and attachments plus request counters, guarded by one lock."""
+
+    def __init__(self, faults: Faults) -> None:
+        self.faults = faults
+        self._random = random.Random(faults.seed)
+        self._lock = threading.Lock()
+        self._bucket_tokens = max(1.0, faults.rate_limit)
+        self._bucket_updated = time.monotonic()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._next_id = 100000
+            self.spaces: dict[str, str] = {}
+            self.pages: dict[str, dict[str, Any]] = {}
+            self.labels: dict[str, dict[str, dict[str, str]]] = {}
+            self.attachments: dict[str, dict[str, dict[str, Any]]] = {}
+            self.requests: Counter[str] = Counter()
+            self.injected: Counter[str] = Counter()
+            self.bytes_received = 0
+
+    def _new_id(self) -> str:
+        self._next_id += 1
+        return str(self._next_id)
+
+    # --- faults ---------------------------------------------------------------------------------
+
+    def record_request(self, route: str, body_bytes: int) -> None:
+        with self._lock:
+            self.requests[route] += 1
+            self.bytes_received += body_bytes
+
+    def delay(self) -> float:
+        faults = self.faults
+        if not (faults.latency_ms or faults.jitter_ms):
+            return 0.0
+        with self._lock:
+            jitter = self._random.uniform(0, faults.jitter_ms) if faults.jitter_ms else 0.0
+        return (faults.latency_ms + jitter) / 1000
+
+    def check_faults(self) -> None:
+        """Raise the 429 or 5xx this request should get instead of being served."""
+        faults = self.faults
+        with self._lock:
+            if faults.rate_limit:
+                now = time.monotonic()
+                self._bucket_tokens = min(
+                    max(1.0, faults.rate_limit),
+                    self._bucket_tokens + (now - self._bucket_updated) * faults.rate_limit,
+                )
+                self._bucket_updated = now
+                if self._bucket_tokens < 1:
+                    self.injected["429"] += 1
+                    raise HTTPFailure(429, "Rate limit exceeded", self._throttle_headers())
+                self._bucket_tokens -= 1
+            if faults.throttle_rate and self._random.random() < faults.throttle_rate:
+                self.injected["429"] += 1
+                raise HTTPFailure(429, "Rate limit exceeded (injected)", self._throttle_headers())
+            if faults.error_rate and self._random.random() < faults.error_rate:
+                status = self._random.choice(INJECTED_ERROR_STATUSES)
+                self.injected[str(status)] += 1
+                raise HTTPFailure(status, "Injected server error")
+
+    def lose_response(self) -> bool:
+        """Whether to drop the response of a write that was just applied."""
+        faults = self.faults
+        with self._lock:
+            if faults.lost_response_rate and self._random.random() < faults.lost_response_rate:
+                self.injected["504 after write"] += 1
+                return True
+            return False
+
+    def _throttle_headers(self) -> dict[str, str]:
+        return {"Retry-After": str(self.faults.retry_after), "X-RateLimit-Remaining": "0"}
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": sum(self.requests.values()),
+                "by_route": dict(sorted(self.requests.items())),
+                "injected": dict(sorted(self.injected.items())),
+                "bytes_received": self.bytes_received,
+                "pages": len(self.pages),
+                "attachments": sum(len(items) for items in self.attachments.values()),
+            }
+
+    # --- spaces and pages -----------------------------------------------------------------------
+
+    def spaces_by_keys(self, keys: list[str]) -> dict[str, Any]:
+        # Any requested key exists, so a benchmark never needs a setup step.
+        with self._lock:
+            results = []
+            for key in keys:
+                if key not in self.spaces:
+                    self.spaces[key] = self._new_id()
+                results.append({"id": self.spaces[key], "key": key, "name": key, "status": "current"})
+        return {"results": results, "_links": {}}
+
+    @staticmethod
+    def _page_view(page: dict[str, Any], *, with_body: bool) -> dict[str, Any]:
+        view = {key: value for key, value in page.items() if key != "body"}
+        view["version"] = dict(page["version"])
+        if with_body:
+            view["body"] = {"storage": {"representation": "storage", "value": page["body"]}}
+        return view
+
+    def list_pages(self, query: dict[str, list[str]]) -> dict[str, Any]:
+        space_ids = set(query.get("space-id", []))
+        title = query.get("title", [None])[0]
+        limit = max(1, min(250, int(query.get("limit", ["25"])[0])))
+        start = int(query.get("cursor", ["0"])[0] or 0)
+        with self._lock:
+            matching = [
+                self._page_view(page, with_body=False)
+                for page in self.pages.values()
+                if (not space_ids or page["spaceId"] in space_ids) and (title is None or page["title"] == title)
+            ]
+        batch = matching[start : start + limit]
+        links: dict[str, str] = {}
+        if start + limit < len(matching):
+            next_query = {key: values for key, values in query.items() if key != "cursor"}
+            next_query["cursor"] = [str(start + limit)]
+            links["next"] = f"/wiki/api/v2/pages?{urlencode(next_query, doseq=True)}"
+        return {"results": batch, "_links": links}
+
+    def get_page(self, page_id: str, *, with_body: bool, with_labels: bool = False) -> dict[str, Any]:
+        with self._lock:
+            page = self.pages.get(page_id)
+            if page is None:
+                raise HTTPFailure(404, f"No page with id {page_id}")
+            view = self._page_view(page, with_body=with_body)
+            if with_labels:
+                # Like Confluence, at most 50 labels are embedded; the rest need the labels endpoint.
+                labels = list(self.labels.get(page_id, {}).values())
+                view["labels"] = {"results": labels[:50], "meta": {"hasMore": len(labels) > 50}, "_links": {}}
+            return view
+
+    def _title_taken(self, space_id: str, title: str, *, ignore: str | None = None) -> bool:
+        return any(
+            page["spaceId"] == space_id and page["title"] == title and page_id != ignore
+            for page_id, page in self.pages.items()
+        )
+
+    def create_page(self, payload: dict[str, Any]) -> dict[str, Any]:
+        space_id = str(payload.get("spaceId") or "")
+        title = str(payload.get("title") or "")
+        if not space_id or not title:
+            raise HTTPFailure(400, "spaceId and title are required")
+        with self._lock:
+            if self._title_taken(space_id, title):
+                raise HTTPFailure(400, "A page with this title already exists")
+            page_id = self._new_id()
+            self.pages[page_id] = {
+                "id": page_id,
+                "status": "current",
+                "title": title,
+                "spaceId": space_id,
+                "parentId": payload.get("parentId"),
+                "version": {"number": 1},
+                "body": payload.get("body", {}).get("value", ""),
+            }
+            return self._page_view(self.pages[page_id], with_body=False)
+
+    def update_page(self, page_id: str, payload: dict[str, Any]) -> dict[str, Any]:
+        number = int((payload.get("version") or {}).get("number") or 0)
+        with self._lock:
+            page = self.pages.get(page_id)
+            if page is None:
+                raise HTTPFailure(404, f"No page with id {page_id}")
+            current = page["version"]["number"]
+            if number != current + 1:
+                raise HTTPFailure(409, f"Version must be incremented: current {current}, got {number}")
+            title = str(payload.get("title") or page["title"])
+            if self._title_taken(page["spaceId"], title, ignore=page_id):
+                raise HTTPFailure(400, "A page with this title already exists")
+            page.update(
+                title=title,
+                parentId=payload.get("parentId") or page["parentId"],
+                version={"number": number, "message": (payload.get("version") or {}).get("message", "")},
+                body=payload.get("body", {}).get("value", ""),
+            )
+            return self._page_view(page, with_body=False)
+
+    # --- labels and attachments -----------------------------------------------------------------
+
+    def _require_page(self, page_id: str) -> None:
+        if page_id not in self.pages:
+            raise HTTPFailure(404, f"No content with id {page_id}")
+
+    def add_labels(self, page_id: str, payload: list[dict[str, str]]) -> dict[str, Any]:
+        with self._lock:
+            self._require_page(page_id)
+            labels = self.labels.setdefault(page_id, {})
+            for item in payload:
+                name = str(item.get("name", "")).lower()
+                if name:
+                    labels[name] = {"prefix": item.get("prefix", "global"), "name": name, "id": name}
+            results = list(labels.values())
+        return {"results": results, "size": len(results)}
+
+    def remove_label(self, page_id: str, query: dict[str, list[str]]) -> dict[str, Any]:
+        name = query.get("name", [""])[0].lower()
+        with self._lock:
+            self._require_page(page_id)
+            if self.labels.get(page_id, {}).pop(name, None) is None:
+                raise HTTPFailure(404, f"Label {name!r} not found")
+        return {}
+
+    def list_labels(self, page_id: str, query: dict[str, list[str]]) -> dict[str, Any]:
+        limit = max(1, min(250, int(query.get("limit", ["25"])[0])))
+        start = int(query.get("cursor", ["0"])[0] or 0)
+        with self._lock:
+            self._require_page(page_id)
+            labels = list(self.labels.get(page_id, {}).values())
+        links: dict[str, str] = {}
+        if start + limit < len(labels):
+            next_query = urlencode({"limit": limit, "cursor": start + limit})
+            links["next"] = f"/wiki/api/v2/pages/{page_id}/labels?{next_query}"
+        return {"results": labels[start : start + limit], "_links": links}
+
+    def list_attachments(self, page_id: str, query: dict[str, list[str]]) -> dict[str, Any]:
+        filename = query.get("filename", [None])[0]
+        limit = max(1, min(200, int(query.get("limit", ["25"])[0])))
+        start = int(query.get("start", ["0"])[0] or 0)
+        with self._lock:
+            self._require_page(page_id)
+            matching = [
+                dict(item)
+                for item in self.attachments.get(page_id, {}).values()
+                if filename is None or item["title"] == filename
+            ]
+        batch = matching[start : start + limit]
+        links: dict[str, str] = {}
+        if start + limit < len(matching):
+            next_query = {key: values for key, values in query.items() if key != "start"}
+            next_query["start"] = [str(start + limit)]
+            # v1 hands back links relative to the context path, without /wiki.
+            links["next"] = f"/rest/api/content/{page_id}/child/attachment?{urlencode(next_query, doseq=True)}"
+        return {"results": batch, "start": start, "limit": limit, "size": len(batch), "_links": links}
+
+    def _attachment(self, attachment_id: str, filename: str, fields: dict[str, Any], version: int) -> dict[str, Any]:
+        data = fields["file"]["data"]
+        return {
+            "id": attachment_id,
+            "type": "attachment",
+            "status": "current",
+            "title": filename,
+            "version": {"number": version},
+            "extensions": {
+                "fileSize": len(data),
+                "mediaType": fields["file"]["content_type"],
+                "comment": fields.get("comment", {}).get("text", ""),
+            },
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+
+    def add_attachment(self, page_id: str, fields: dict[str, Any]) -> dict[str, Any]:
+        filename = fields["file"]["filename"]
+        with self._lock:
+            self._require_page(page_id)
+            items = self.attachments.setdefault(page_id, {})
+            if filename in items:
+                raise HTTPFailure(
+                    400, f"Cannot add a new attachment with same file name as an existing one: {filename}"
+                )
+            item = self._attachment(f"att{self._new_id()}", filename, fields, 1)
+            items[filename] = item
+        return {"results": [dict(item)], "size": 1}
+
+    def update_attachment(self, page_id: str, attachment_id: str, fields: dict[str, Any]) -> dict[str, Any]:
+        with self._lock:
+            self._require_page(page_id)
+            items = self.attachments.get(page_id, {})
+            existing = next((item for item in items.values() if item["id"] == attachment_id), None)
+            if existing is None:
+                raise HTTPFailure(404, f"No attachment with id {attachment_id}")
+            item = self._attachment(attachment_id, existing["title"], fields, existing["version"]["number"] + 1)
+            items[existing["title"]] = item
+        return dict(item)
+
+
+def parse_multipart(body: bytes, content_type: str) -> dict[str, Any]:
+    """Form fields of a multipart/form-data body: {"file": {filename, content_type, data}, "comment": {text}}."""
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        raise HTTPFailure(400, "multipart body without boundary")
+    delimiter = b"--" + match.group(1).encode("latin-1")
+    fields: dict[str, Any] = {}
+    for part in body.split(delimiter)[1:]:
+        if part.startswith(b"--"):
+            break
+        head, _, data = part.partition(b"\r\n\r\n")
+        data = data[:-2] if data.endswith(b"\r\n") else data
+        headers = head.decode("utf-8", errors="replace")
+        name = re.search(r'name="([^"]*)"', headers)
+        if not name:
+            continue
+        filename = re.search(r'filename="([^"]*)"', headers)
+        if filename:
+            part_type = re.search(r"Content-Type:\s*([^\r\n]+)", headers, re.IGNORECASE)
+            fields[name.group(1)] = {
+                "filename": filename.group(1),
+                "content_type": part_type.group(1).strip() if part_type else "application/octet-stream",
+                "data": data,
+            }
+        else:
+            fields[name.group(1)] = {"text": data.decode("utf-8", errors="replace")}
+    if "file" not in fields:
+        raise HTTPFailure(400, "multipart body without a file field")
+    return fields
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; without this each response waits on a delayed ACK.
+    disable_nagle_algorithm = True
+    server: StandinServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            out = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    # Trailer section ends with an empty line.
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return bytes(out)
+                out += self.rfile.read(size)
+                self.rfile.readline()
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status: int, obj: Any, headers: dict[str, str] | None = None) -> None:
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self) -> None:
+        parts = urlsplit(self.path)
+        path = parts.path
+        query = parse_qs(parts.query, keep_blank_values=True)
+        body = self._read_body()
+        state = self.server.state
+
+        if path == STATS_PATH:
+            self._send_json(200, state.stats())
+            return
+        if path == RESET_PATH and self.command == "POST":
+            state.reset()
+            self._send_json(200, {"reset": True})
+            return
+
+        state.record_request(f"{self.command} {_ROUTE_ID_RE.sub('/{id}', path)}", len(body))
+        delay = state.delay()
+        if delay:
+            time.sleep(delay)
+        try:
+            if not self.headers.get("Authorization", "").startswith("Basic "):
+                raise HTTPFailure(401, "Basic authentication required")
+            state.check_faults()
+            result = self._dispatch(path, query, body)
+        except HTTPFailure as exc:
+            self._send_json(exc.status, {"statusCode": exc.status, "message": exc.message}, exc.headers)
+            return
+        if self.command in {"POST", "PUT"} and state.lose_response():
+            # Applied, but the caller sees a gateway timeout, as when a proxy gives up on a slow response.
+            self._send_json(504, {"statusCode": 504, "message": "Response lost after the write (injected)"})
+            return
+        self._send_json(200, result)
+
+    def _dispatch(self, path: str, query: dict[str, list[str]], body: bytes) -> Any:
+        state = self.server.state
+        method = self.command
+        if path == "/wiki/api/v2/spaces" and method == "GET":
+            return state.spaces_by_keys(query.get("keys", []))
+        if path == "/wiki/api/v2/pages":
+            if method == "GET":
+                return state.list_pages(query)
+            if method == "POST":
+                return state.create_page(_json_body(body))
+        if match := _PAGE_RE.match(path):
+            if method == "GET":
+                return state.get_page(
+                    match.group(1),
+                    with_body=query.get("body-format") == ["storage"],
+                    with_labels=query.get("include-labels") == ["true"],
+                )
+            if method == "PUT":
+                return state.update_page(match.group(1), _json_body(body))
+        if match := _LABEL_RE.match(path):
+            if method == "POST":
+                return state.add_labels(match.group(1), _json_body(body))
+            if method == "DELETE":
+                return state.remove_label(match.group(1), query)
+        if (match := _PAGE_LABELS_RE.match(path)) and method == "GET":
+            return state.list_labels(match.group(1), query)
+        if match := _ATTACHMENTS_RE.match(path):
+            if method == "GET":
+                return state.list_attachments(match.group(1), query)
+            if method == "POST":
+                return state.add_attachment(match.group(1), self._multipart(body))
+        if (match := _ATTACHMENT_DATA_RE.match(path)) and method == "POST":
+            return state.update_attachment(match.group(1), match.group(2), self._multipart(body))
+        raise HTTPFailure(404, f"No stand-in route for {method} {path}")
+
+    def _multipart(self, body: bytes) -> dict[str, Any]:
+        if self.headers.get("X-Atlassian-Token", "").lower() != "nocheck":
+            raise HTTPFailure(403, "XSRF check failed")
+        return parse_multipart(body, self.headers.get("Content-Type", ""))
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+def _json_body(body: bytes) -> Any:
+    try:
+        return json.loads(body.decode("utf-8"))
+    except ValueError:
+        raise HTTPFailure(400, "Request body is not valid JSON") from None
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], faults: Faults, *, verbose: bool = False) -> None:
+        super().__init__(address, StandinHandler)
+        self.state = StandinState(faults)
+        self.verbose = verbose
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Local Confluence stand-in for end-to-end publisher testing")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to bind, 0 for any free port (default: 8765)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added delay per request in milliseconds")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Extra random delay of up to this many ms")
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0.0,
+        help="Answer 429 above this many requests/second, 0 for unlimited (default: 0)",
+    )
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 5xx")
+    parser.add_argument(
+        "--lost-response-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of POST/PUT writes that are applied but answered with 504",
+    )
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429 (default: 1)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for jitter and fault injection")
+    parser.add_argument("--verbose", action="store_true", help="Log every request to stderr")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    for name in ("throttle_rate", "error_rate", "lost_response_rate"):
+        if not 0 <= getattr(args, name) <= 1:
+            print(f"--{name.replace('_', '-')} must be between 0 and 1", file=sys.stderr)
+            return 2
+    faults = Faults(
+        latency_ms=max(0.0, args.latency_ms),
+        jitter_ms=max(0.0, args.jitter_ms),
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        lost_response_rate=args.lost_response_rate,
+        rate_limit=max(0.0, args.rate_limit),
+        retry_after=max(0, args.retry_after),
+        seed=args.seed,
+    )
+    server = StandinServer((args.host, args.port), faults, verbose=args.verbose)
+    # The first line is read by benchmark_publish.py to find the port.
+    print(f"Listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
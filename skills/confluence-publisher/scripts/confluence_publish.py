@@ -4,23 +4,49 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import base64
+import bisect
+import contextlib
+import contextvars
+import cProfile
+import ctypes
+import ctypes.util
+import email.parser
+import email.utils
+import fnmatch
+import functools
 import glob
+import hashlib
 import html
+import http.client
+import itertools
 import json
 import os
+import random
 import re
+import select
 import shutil
+import signal
+import socket
+import ssl
+import stat
+import struct
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import uuid
-from dataclasses import dataclass
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Any
-from urllib.error import HTTPError
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
+from typing import Any, TypeVar
+from urllib.parse import urlencode, urlsplit
+from urllib.request import Request, getproxies, proxy_bypass, urlopen
 
 
 @dataclass
@@ -31,6 +57,10 @@ class Document:
     parent_id: str | None
     page_id: str | None
     labels: list[str]
+    # Large files are not held in memory: body_markdown stays empty and the body is re-read from `path`,
+    # starting at physical line `body_start_line`, each time it is converted.
+    streamed: bool = False
+    body_start_line: int = 0
 
 
 @dataclass
@@ -40,6 +70,9 @@ class PublishResult:
     title: str
     path: Path
     message: str = ""
+    version: int | None = None
+    # Labels the publisher has put on the page, recorded in the ledger so --prune-labels touches only those.
+    labels: list[str] | None = None
 
 
 @dataclass
@@ -48,12 +81,33 @@ class MermaidImagePlan:
     mermaid_source: str
 
 
+# Process-wide caps shared by every page being published: mmdc runs a headless browser per launch,
+# mermaid.ink is a shared public service. Adjusted from main() via configure_mermaid_concurrency().
+_MERMAID_LOCAL_SLOTS = threading.BoundedSemaphore(2)
+_MERMAID_REMOTE_SLOTS = threading.BoundedSemaphore(4)
+ATTACHMENT_UPLOAD_CONCURRENCY = 4
+# Files at least this large are converted and sent as a stream instead of being read whole; 0 disables streaming.
+STREAM_MIN_BYTES = 32 * 1024 * 1024
+
+
+def configure_streaming(*, min_bytes: int) -> None:
+    global STREAM_MIN_BYTES
+    STREAM_MIN_BYTES = max(0, min_bytes)
+
+
+def configure_mermaid_concurrency(*, local_renders: int, remote_renders: int, uploads: int) -> None:
+    global _MERMAID_LOCAL_SLOTS, _MERMAID_REMOTE_SLOTS, ATTACHMENT_UPLOAD_CONCURRENCY
+    _MERMAID_LOCAL_SLOTS = threading.BoundedSemaphore(max(1, local_renders))
+    _MERMAID_REMOTE_SLOTS = threading.BoundedSemaphore(max(1, remote_renders))
+    ATTACHMENT_UPLOAD_CONCURRENCY = max(1, uploads)
+
+
 def render_mermaid_svg(mermaid_source: str) -> str | None:
     encoded = base64.urlsafe_b64encode(mermaid_source.encode("utf-8")).decode("ascii").rstrip("=")
     url = f"https://mermaid.ink/svg/{encoded}"
     req = Request(url, headers={"User-Agent": "Mozilla/5.0", "Accept": "image/svg+xml"})
     try:
-        with urlopen(req, timeout=30) as resp:
+        with _MERMAID_REMOTE_SLOTS, urlopen(req, timeout=30) as resp:
             svg = resp.read().decode("utf-8", errors="replace")
     except Exception:
         return None
@@ -119,7 +173,10 @@ def parse_front_matter(text: str) -> tuple[dict[str, str], str]:
 
     front = "".join(lines[1:end_idx])
     body = "".join(lines[end_idx + 1 :])
+    return parse_front_matter_fields(front), body
 
+
+def parse_front_matter_fields(front: str) -> dict[str, str]:
     metadata: dict[str, str] = {}
     for raw in front.splitlines():
         line = raw.strip()
@@ -127,18 +184,23 @@ def parse_front_matter(text: str) -> tuple[dict[str, str], str]:
             continue
         key, value = line.split(":", 1)
         metadata[key.strip()] = value.strip()
+    return metadata
+
 
-    return metadata, body
+_TITLE_HEADING_RE = re.compile(r"^#\s+(.+?)\s*$", re.MULTILINE)
 
 
-def derive_title(path: Path, body: str, metadata: dict[str, str]) -> str:
+def derive_title(path: Path, body: str | Iterable[str], metadata: dict[str, str]) -> str:
+    """Title from front matter, else the first H1, else the file name; `body` may be text or an iterable of lines."""
     title = metadata.get("title")
     if title:
         return title
 
-    match = re.search(r"^#\s+(.+?)\s*$", body, flags=re.MULTILINE)
-    if match:
-        return match.group(1).strip().rstrip("#").strip()
+    chunks = [body] if isinstance(body, str) else body
+    for chunk in chunks:
+        match = _TITLE_HEADING_RE.search(chunk)
+        if match:
+            return match.group(1).strip().rstrip("#").strip()
 
     return re.sub(r"[-_]+", " ", path.stem).strip().title()
 
@@ -159,12 +221,13 @@ def render_mermaid_svg_local(mermaid_source: str) -> bytes | None:
             in_path = Path(td) / "diagram.mmd"
             out_path = Path(td) / "diagram.svg"
             in_path.write_text(mermaid_source, encoding="utf-8")
-            proc = subprocess.run(
-                [mmdc, "-i", str(in_path), "-o", str(out_path)],
-                capture_output=True,
-                text=True,
-                timeout=45,
-            )
+            with _MERMAID_LOCAL_SLOTS:
+                proc = subprocess.run(
+                    [mmdc, "-i", str(in_path), "-o", str(out_path)],
+                    capture_output=True,
+                    text=True,
+                    timeout=45,
+                )
             if proc.returncode != 0 or not out_path.exists():
                 return None
             return out_path.read_bytes()
@@ -172,235 +235,463 @@ def render_mermaid_svg_local(mermaid_source: str) -> bytes | None:
         return None
 
 
-def simple_markdown_to_html(
-    markdown_text: str,
+_FENCE_PREFIX = "```"
+_HEADING_RE = re.compile(r"(#{1,6})\s+(.*)")
+_BULLET_RE = re.compile(r"[-*]\s+(.*)")
+_TABLE_SEPARATOR_CELL_RE = re.compile(r":?-{3,}:?")
+_INLINE_CODE_RE = re.compile(r"`([^`]+)`")
+_STRONG_RE = re.compile(r"\*\*(.+?)\*\*")
+_EMPHASIS_RE = re.compile(r"\*(.+?)\*")
+_MERMAID_FENCE_LANGS = frozenset({"mermaid", "mmd"})
+
+
+def _split_table_row(line: str) -> list[str]:
+    raw = line.strip()
+    if raw.startswith("|"):
+        raw = raw[1:]
+    if raw.endswith("|"):
+        raw = raw[:-1]
+    if "\\" not in raw:
+        return [cell.strip() for cell in raw.split("|")]
+
+    # A backslash keeps the next character literally (so "\|" is not a cell boundary) and is itself dropped.
+    cells: list[str] = []
+    buf: list[str] = []
+    escaped = False
+    for ch in raw:
+        if escaped:
+            buf.append(ch)
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == "|":
+            cells.append("".join(buf).strip())
+            buf = []
+        else:
+            buf.append(ch)
+    cells.append("".join(buf).strip())
+    return cells
+
+
+def _table_header_cells(row: str, next_line: str) -> tuple[list[str], list[str]] | None:
+    """Header and separator cells when `row` (already stripped) opens a pipe table, else None."""
+    sep = next_line.strip()
+    if not sep.startswith("|"):
+        return None
+    header_cells = _split_table_row(row)
+    sep_cells = _split_table_row(sep)
+    if len(header_cells) < 2 or len(sep_cells) != len(header_cells):
+        return None
+    if not all(_TABLE_SEPARATOR_CELL_RE.fullmatch(cell) for cell in sep_cells):
+        return None
+    return header_cells, sep_cells
+
+
+def _table_alignment(cell: str) -> str | None:
+    if cell.startswith(":"):
+        return "center" if cell.endswith(":") else "left"
+    if cell.endswith(":"):
+        return "right"
+    return None
+
+
+def _render_plain_inline(text: str) -> str:
+    escaped = html.escape(text)
+    if "*" in escaped:
+        escaped = _STRONG_RE.sub(r"<strong>\1</strong>", escaped)
+        escaped = _EMPHASIS_RE.sub(r"<em>\1</em>", escaped)
+    return escaped
+
+
+def _render_inline(text: str) -> str:
+    if "`" not in text:
+        return _render_plain_inline(text)
+    out: list[str] = []
+    last = 0
+    for match in _INLINE_CODE_RE.finditer(text):
+        out.append(_render_plain_inline(text[last : match.start()]))
+        out.append(f"<code>{html.escape(match.group(1))}</code>")
+        last = match.end()
+    out.append(_render_plain_inline(text[last:]))
+    return "".join(out)
+
+
+def _render_table_cells(out: list[str], tag: str, cells: list[str], alignments: list[str | None]) -> None:
+    for cell, align in zip(cells, alignments):
+        body = _render_inline(cell)
+        if align:
+            out.append(f'<{tag} style="text-align:{align};">{body}</{tag}>')
+        else:
+            out.append(f"<{tag}>{body}</{tag}>")
+
+
+def _render_table_head(header_cells: list[str], alignments: list[str | None]) -> str:
+    out: list[str] = ["<table><thead><tr>"]
+    _render_table_cells(out, "th", header_cells, alignments)
+    out.append("</tr></thead><tbody>")
+    return "".join(out)
+
+
+def _render_table_row(row_line: str, alignments: list[str | None], width: int) -> str:
+    row_cells = _split_table_row(row_line)
+    if len(row_cells) < width:
+        row_cells.extend([""] * (width - len(row_cells)))
+    out: list[str] = ["<tr>"]
+    _render_table_cells(out, "td", row_cells, alignments)
+    out.append("</tr>")
+    return "".join(out)
+
+
+def _cdata_safe(code_text: str) -> str:
+    # Keep XML CDATA valid even if source contains ']]>'.
+    return code_text.replace("]]>", "]]]]><![CDATA[>")
+
+
+_CODE_MACRO_CLOSE = "]]></ac:plain-text-body></ac:structured-macro>"
+
+
+def _code_macro_open(lang: str) -> str:
+    return (
+        '<ac:structured-macro ac:name="code">'
+        f'<ac:parameter ac:name="language">{html.escape(lang or "none")}</ac:parameter>'
+        "<ac:plain-text-body><![CDATA["
+    )
+
+
+def _code_macro(lang: str, code_text: str) -> str:
+    return f"{_code_macro_open(lang)}{_cdata_safe(code_text)}{_CODE_MACRO_CLOSE}"
+
+
+def _mermaid_macro(code_text: str) -> str:
+    return (
+        '<ac:structured-macro ac:name="mermaid">'
+        f"<ac:plain-text-body><![CDATA[{_cdata_safe(code_text)}]]></ac:plain-text-body>"
+        "</ac:structured-macro>"
+    )
+
+
+def _mermaid_image_macro(filename: str, width: int) -> str:
+    return (
+        f'<ac:image ac:align="center" ac:width="{max(240, width)}">'
+        f'<ri:attachment ri:filename="{html.escape(filename)}" />'
+        "</ac:image>"
+    )
+
+
+def _render_fenced_block(
+    lang: str,
+    code_text: str,
+    *,
+    mermaid_mode: str,
+    image_prefix: str | None,
+    image_index: int,
+    image_width: int,
+) -> tuple[str, MermaidImagePlan | None]:
+    """Storage markup for a fenced block, plus the attachment plan when it becomes a Mermaid image."""
+    if mermaid_mode in {"macro", "attachment"} and lang.strip().lower() in _MERMAID_FENCE_LANGS:
+        if mermaid_mode == "macro":
+            return _mermaid_macro(code_text), None
+        filename = build_mermaid_image_name(image_prefix or "Codex Diagram", image_index)
+        return (
+            _mermaid_image_macro(filename, image_width),
+            MermaidImagePlan(filename=filename, mermaid_source=code_text),
+        )
+    return _code_macro(lang, code_text), None
+
+
+def iter_simple_markdown_html(
+    lines: Iterable[str],
     *,
     mermaid_mode: str = "code",
     mermaid_image_prefix: str | None = None,
     mermaid_image_width: int = 1000,
     mermaid_image_plans: list[MermaidImagePlan] | None = None,
-) -> str:
-    lines = markdown_text.splitlines()
-    parts: list[str] = []
+) -> Iterator[str]:
+    """Yield the built-in converter's output in pieces, consuming `lines` lazily.
+
+    Each line is classified by its first character before any pattern runs. Only the current line, one line of
+    lookahead and the source of a Mermaid block being turned into a macro or image are held; code blocks and table
+    rows are emitted as they are read. Concatenating the pieces gives simple_markdown_to_html's output.
+    """
+    source = iter(lines)
+    held: str | None = None  # a line read ahead that still has to be classified
+    sep = ""
     in_ul = False
-    in_code_block = False
-    code_lang = ""
+    code_lang: str | None = None  # None outside a fenced block
+    code_streamed = False  # the open block's macro prefix was already emitted
+    code_first = True
     code_lines: list[str] = []
     mermaid_image_count = 0
 
-    def split_table_row(line: str) -> list[str]:
-        raw = line.strip()
-        if raw.startswith("|"):
-            raw = raw[1:]
-        if raw.endswith("|"):
-            raw = raw[:-1]
-        cells: list[str] = []
-        buf: list[str] = []
-        escaped = False
-        for ch in raw:
-            if escaped:
-                buf.append(ch)
-                escaped = False
-                continue
-            if ch == "\\":
-                escaped = True
-                continue
-            if ch == "|":
-                cells.append("".join(buf).strip())
-                buf = []
+    while True:
+        if held is not None:
+            raw_line, held = held, None
+        else:
+            next_line = next(source, None)
+            if next_line is None:
+                if code_lang is None:
+                    break
+                # An unterminated fence runs to the end of the document: close it as if a fence line followed.
+                next_line = _FENCE_PREFIX
+            raw_line = next_line
+        stripped = raw_line.strip()
+
+        if stripped.startswith(_FENCE_PREFIX):
+            if in_ul:
+                yield "\n</ul>"
+                in_ul = False
+            if code_lang is None:
+                code_lang = stripped[3:].strip()
+                code_streamed = not (
+                    mermaid_mode in {"macro", "attachment"} and code_lang.lower() in _MERMAID_FENCE_LANGS
+                )
+                if code_streamed:
+                    yield f"{sep}{_code_macro_open(code_lang)}"
+                    sep = "\n"
+                    code_first = True
+                else:
+                    code_lines = []
+            elif code_streamed:
+                yield _CODE_MACRO_CLOSE
+                code_lang = None
             else:
-                buf.append(ch)
-        cells.append("".join(buf).strip())
-        return cells
-
-    def is_table_separator_cell(cell: str) -> bool:
-        return bool(re.fullmatch(r":?-{3,}:?", cell.strip()))
-
-    def parse_table_alignment(cell: str) -> str | None:
-        c = cell.strip()
-        if c.startswith(":") and c.endswith(":"):
-            return "center"
-        if c.endswith(":"):
-            return "right"
-        if c.startswith(":"):
-            return "left"
-        return None
+                block, plan = _render_fenced_block(
+                    code_lang,
+                    "\n".join(code_lines),
+                    mermaid_mode=mermaid_mode,
+                    image_prefix=mermaid_image_prefix,
+                    image_index=mermaid_image_count + 1,
+                    image_width=mermaid_image_width,
+                )
+                if plan is not None:
+                    mermaid_image_count += 1
+                    if mermaid_image_plans is not None:
+                        mermaid_image_plans.append(plan)
+                yield f"{sep}{block}"
+                sep = "\n"
+                code_lang = None
+                code_lines = []
+            continue
 
-    def looks_like_table_header(line: str, next_line: str) -> bool:
-        row = line.strip()
-        sep = next_line.strip()
-        if not (row.startswith("|") and sep.startswith("|")):
-            return False
-        header_cells = split_table_row(row)
-        sep_cells = split_table_row(sep)
-        if len(header_cells) < 2 or len(sep_cells) != len(header_cells):
-            return False
-        return all(is_table_separator_cell(c) for c in sep_cells)
-
-    def looks_like_table_row(line: str) -> bool:
-        row = line.strip()
-        return row.startswith("|") and "|" in row[1:]
-
-    def render_markdown_table(table_lines: list[str]) -> str:
-        header_cells = split_table_row(table_lines[0])
-        sep_cells = split_table_row(table_lines[1])
-        alignments = [parse_table_alignment(c) for c in sep_cells]
-
-        def render_cell(tag: str, content: str, align: str | None) -> str:
-            body = render_inline(content)
-            if align:
-                return f'<{tag} style="text-align:{align};">{body}</{tag}>'
-            return f"<{tag}>{body}</{tag}>"
-
-        out: list[str] = ["<table><thead><tr>"]
-        for idx, cell in enumerate(header_cells):
-            out.append(render_cell("th", cell, alignments[idx]))
-        out.append("</tr></thead><tbody>")
-
-        for row_line in table_lines[2:]:
-            row_cells = split_table_row(row_line)
-            if len(row_cells) < len(header_cells):
-                row_cells.extend([""] * (len(header_cells) - len(row_cells)))
-            if len(row_cells) > len(header_cells):
-                row_cells = row_cells[: len(header_cells)]
-            out.append("<tr>")
-            for idx, cell in enumerate(row_cells):
-                out.append(render_cell("td", cell, alignments[idx]))
-            out.append("</tr>")
-
-        out.append("</tbody></table>")
-        return "".join(out)
-
-    def render_plain_inline(text: str) -> str:
-        escaped = html.escape(text)
-        escaped = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", escaped)
-        escaped = re.sub(r"\*(.+?)\*", r"<em>\1</em>", escaped)
-        return escaped
-
-    def render_inline(text: str) -> str:
-        out: list[str] = []
-        last = 0
-        for match in re.finditer(r"`([^`]+)`", text):
-            out.append(render_plain_inline(text[last : match.start()]))
-            out.append(f"<code>{html.escape(match.group(1))}</code>")
-            last = match.end()
-        out.append(render_plain_inline(text[last:]))
-        return "".join(out)
-
-    def emit_code_macro(lang: str, code_text: str) -> str:
-        # Keep XML CDATA valid even if source contains ']]>'.
-        safe_code = code_text.replace("]]>", "]]]]><![CDATA[>")
-        safe_lang = html.escape(lang or "none")
-        return (
-            '<ac:structured-macro ac:name="code">'
-            f'<ac:parameter ac:name="language">{safe_lang}</ac:parameter>'
-            f"<ac:plain-text-body><![CDATA[{safe_code}]]></ac:plain-text-body>"
-            "</ac:structured-macro>"
-        )
+        if code_lang is not None:
+            if not code_streamed:
+                code_lines.append(raw_line)
+            elif code_first:
+                yield _cdata_safe(raw_line)
+                code_first = False
+            else:
+                yield f"\n{_cdata_safe(raw_line)}"
+            continue
 
-    def emit_mermaid_macro(code_text: str) -> str:
-        safe_code = code_text.replace("]]>", "]]]]><![CDATA[>")
-        return (
-            '<ac:structured-macro ac:name="mermaid">'
-            f"<ac:plain-text-body><![CDATA[{safe_code}]]></ac:plain-text-body>"
-            "</ac:structured-macro>"
-        )
+        if not stripped:
+            if in_ul:
+                yield "\n</ul>"
+                in_ul = False
+            continue
+
+        lead = stripped[0]
+        if lead == "|":
+            held = next(source, None)
+            table = _table_header_cells(stripped, held) if held is not None else None
+            if table is not None:
+                if in_ul:
+                    yield "\n</ul>"
+                    in_ul = False
+                header_cells, sep_cells = table
+                alignments = [_table_alignment(cell) for cell in sep_cells]
+                yield f"{sep}{_render_table_head(header_cells, alignments)}"
+                sep = "\n"
+                held = None
+                for row_line in source:
+                    row = row_line.strip()
+                    if not (row.startswith("|") and "|" in row[1:]):
+                        held = row_line
+                        break
+                    yield _render_table_row(row_line, alignments, len(header_cells))
+                yield "</tbody></table>"
+                continue
+
+        if lead == "#":
+            heading = _HEADING_RE.fullmatch(stripped)
+            if heading:
+                if in_ul:
+                    yield "\n</ul>"
+                    in_ul = False
+                level = len(heading.group(1))
+                yield f"{sep}<h{level}>{_render_inline(heading.group(2).strip())}</h{level}>"
+                sep = "\n"
+                continue
+        elif lead == "-" or lead == "*":
+            bullet = _BULLET_RE.fullmatch(stripped)
+            if bullet:
+                if not in_ul:
+                    yield f"{sep}<ul>"
+                    sep = "\n"
+                    in_ul = True
+                yield f"\n<li>{_render_inline(bullet.group(1).strip())}</li>"
+                continue
 
-    def emit_mermaid_image_macro(filename: str, width: int) -> str:
-        safe_filename = html.escape(filename)
-        safe_width = max(240, width)
-        return (
-            f'<ac:image ac:align="center" ac:width="{safe_width}">'
-            f'<ri:attachment ri:filename="{safe_filename}" />'
-            "</ac:image>"
-        )
-
-    def emit_fenced_block(lang: str, code_text: str) -> str:
-        nonlocal mermaid_image_count
-        lang_norm = lang.strip().lower()
-        if mermaid_mode == "macro" and lang_norm in {"mermaid", "mmd"}:
-            return emit_mermaid_macro(code_text)
-        if mermaid_mode == "attachment" and lang_norm in {"mermaid", "mmd"}:
-            mermaid_image_count += 1
-            filename = build_mermaid_image_name(mermaid_image_prefix or "Codex Diagram", mermaid_image_count)
-            if mermaid_image_plans is not None:
-                mermaid_image_plans.append(MermaidImagePlan(filename=filename, mermaid_source=code_text))
-            return emit_mermaid_image_macro(filename, mermaid_image_width)
-        return emit_code_macro(lang, code_text)
-
-    def close_list() -> None:
-        nonlocal in_ul
         if in_ul:
-            parts.append("</ul>")
+            yield "\n</ul>"
             in_ul = False
+        yield f"{sep}<p>{_render_inline(stripped)}</p>"
+        sep = "\n"
 
-    i = 0
-    while i < len(lines):
-        raw_line = lines[i]
-        line = raw_line.rstrip()
-        stripped = line.strip()
-
-        fence = re.match(r"^```(.*)$", stripped)
-        if fence:
-            close_list()
-            if not in_code_block:
-                in_code_block = True
-                code_lang = fence.group(1).strip()
-                code_lines = []
-            else:
-                parts.append(emit_fenced_block(code_lang, "\n".join(code_lines)))
-                in_code_block = False
-                code_lang = ""
-                code_lines = []
-            i += 1
-            continue
+    if in_ul:
+        yield "\n</ul>"
 
-        if in_code_block:
-            code_lines.append(raw_line)
-            i += 1
-            continue
 
-        if not stripped:
-            close_list()
-            i += 1
-            continue
+def simple_markdown_to_html(
+    markdown_text: str,
+    *,
+    mermaid_mode: str = "code",
+    mermaid_image_prefix: str | None = None,
+    mermaid_image_width: int = 1000,
+    mermaid_image_plans: list[MermaidImagePlan] | None = None,
+) -> str:
+    rendered = "".join(
+        iter_simple_markdown_html(
+            markdown_text.splitlines(),
+            mermaid_mode=mermaid_mode,
+            mermaid_image_prefix=mermaid_image_prefix,
+            mermaid_image_width=mermaid_image_width,
+            mermaid_image_plans=mermaid_image_plans,
+        )
+    )
+    return rendered or "<p></p>"
+
+
+# Runs inside `pandoc lua`: converts a JSON list of gfm documents independently, in one process.
+PANDOC_BATCH_SCRIPT = """
+local json = require("pandoc.json")
+local out = {}
+for i, text in ipairs(json.decode(io.read("a"), false)) do
+  local ok, rendered = pcall(function() return pandoc.write(pandoc.read(text, "gfm"), "html5") end)
+  out[i] = ok and rendered or json.null
+end
+io.write(json.encode(out))
+"""
+
+
+def pandoc_cli_input(text: str) -> str:
+    """Apply the input handling of the pandoc CLI (4-column tab stops, final newline) so pandoc.read matches it."""
+    text = text.expandtabs(4)
+    if not text.endswith("\n"):
+        text += "\n"
+    return f"{text}\n"
+
+
+class PandocConverter:
+    """gfm -> html5 through pandoc; the backend is probed once and many documents share one pandoc launch."""
+
+    def __init__(self) -> None:
+        self.launches = 0
+        self.batched = 0
+        self._probed = False
+        self._pandoc: str | None = None
+        self._version = "unknown"
+        self._batch = False
+        self._rendered: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _probe(self) -> None:
+        with self._lock:
+            if self._probed:
+                return
+            self._pandoc = shutil.which("pandoc")
+            if self._pandoc:
+                try:
+                    proc = subprocess.run([self._pandoc, "--version"], capture_output=True, text=True, timeout=30)
+                    self._version = (proc.stdout.split() or ["", "unknown"])[1]
+                except (OSError, subprocess.SubprocessError, IndexError):
+                    pass
+                # `pandoc lua` and pandoc.json need pandoc >= 3.1.1; older builds convert one document per launch.
+                try:
+                    proc = subprocess.run(
+                        [self._pandoc, "lua", "-e", PANDOC_BATCH_SCRIPT],
+                        input="[]",
+                        text=True,
+                        capture_output=True,
+                        timeout=30,
+                    )
+                    self._batch = proc.returncode == 0
+                except (OSError, subprocess.SubprocessError):
+                    self._batch = False
+            self._probed = True
+
+    @property
+    def available(self) -> bool:
+        self._probe()
+        return self._pandoc is not None
+
+    @property
+    def version(self) -> str:
+        self._probe()
+        return self._version
+
+    @property
+    def batch_available(self) -> bool:
+        self._probe()
+        return self._batch
+
+    def prime(self, markdown_texts: Iterable[str]) -> None:
+        """Convert documents in a single pandoc launch and keep their HTML for the next convert() of each."""
+        texts = [text for text in dict.fromkeys(markdown_texts) if text not in self._rendered]
+        if len(texts) < 2 or not self.batch_available:
+            return
+        assert self._pandoc is not None
+        with self._lock:
+            self.launches += 1
+        proc = subprocess.run(
+            [self._pandoc, "lua", "-e", PANDOC_BATCH_SCRIPT],
+            input=json.dumps([pandoc_cli_input(text) for text in texts]),
+            text=True,
+            capture_output=True,
+        )
+        if proc.returncode != 0:
+            return
+        try:
+            rendered = json.loads(proc.stdout)
+        except ValueError:
+            return
+        if not isinstance(rendered, list) or len(rendered) != len(texts):
+            return
+        with self._lock:
+            for text, html_out in zip(texts, rendered):
+                if isinstance(html_out, str) and html_out.strip():
+                    # Match the trailing newline of a standalone `pandoc` run.
+                    self._rendered[text] = html_out.rstrip("\n") + "\n"
+                    self.batched += 1
+
+    def convert(self, markdown_text: str) -> str | None:
+        with self._lock:
+            rendered = self._rendered.pop(markdown_text, None)
+        if rendered is not None:
+            return rendered
+        if not self.available:
+            return None
+        assert self._pandoc is not None
+        with self._lock:
+            self.launches += 1
+        proc = subprocess.run(
+            [self._pandoc, "--from", "gfm", "--to", "html5"],
+            input=markdown_text,
+            text=True,
+            capture_output=True,
+        )
+        if proc.returncode == 0 and proc.stdout.strip():
+            return proc.stdout
+        return None
 
-        if i + 1 < len(lines) and looks_like_table_header(lines[i], lines[i + 1]):
-            close_list()
-            table_block = [lines[i], lines[i + 1]]
-            i += 2
-            while i < len(lines) and looks_like_table_row(lines[i]):
-                table_block.append(lines[i])
-                i += 1
-            parts.append(render_markdown_table(table_block))
-            continue
+    def summary(self) -> str:
+        return f"Pandoc: {self.batched} document(s) batch-converted, {self.launches} pandoc launch(es)"
 
-        heading = re.match(r"^(#{1,6})\s+(.*)$", stripped)
-        if heading:
-            close_list()
-            level = len(heading.group(1))
-            content = render_inline(heading.group(2).strip())
-            parts.append(f"<h{level}>{content}</h{level}>")
-            i += 1
-            continue
 
-        bullet = re.match(r"^[-*]\s+(.*)$", stripped)
-        if bullet:
-            if not in_ul:
-                parts.append("<ul>")
-                in_ul = True
-            parts.append(f"<li>{render_inline(bullet.group(1).strip())}</li>")
-            i += 1
-            continue
+_PANDOC = PandocConverter()
 
-        close_list()
-        parts.append(f"<p>{render_inline(stripped)}</p>")
-        i += 1
 
-    close_list()
-    if in_code_block:
-        parts.append(emit_fenced_block(code_lang, "\n".join(code_lines)))
-    return "\n".join(parts) if parts else "<p></p>"
+def uses_pandoc(mermaid_mode: str) -> bool:
+    return (mermaid_mode.lower().strip() or "code") not in {"macro", "attachment"}
 
 
 def markdown_to_html(
@@ -411,27 +702,40 @@ def markdown_to_html(
     mermaid_image_width: int = 1000,
     mermaid_image_plans: list[MermaidImagePlan] | None = None,
 ) -> str:
+    return convert_markdown(
+        markdown_text,
+        mermaid_mode=mermaid_mode,
+        mermaid_image_prefix=mermaid_image_prefix,
+        mermaid_image_width=mermaid_image_width,
+        mermaid_image_plans=mermaid_image_plans,
+    )[0]
+
+
+def convert_markdown(
+    markdown_text: str,
+    *,
+    mermaid_mode: str = "code",
+    mermaid_image_prefix: str | None = None,
+    mermaid_image_width: int = 1000,
+    mermaid_image_plans: list[MermaidImagePlan] | None = None,
+) -> tuple[str, str]:
+    """markdown_to_html() plus the id (as in conversion_backend_id()) of the converter that actually ran."""
     mermaid_mode = mermaid_mode.lower().strip() or "code"
+    builtin_id = f"builtin:{engine_fingerprint()}"
     if mermaid_mode in {"macro", "attachment"}:
         # Use the internal converter to map ```mermaid fences into macro storage markup.
-        return simple_markdown_to_html(
+        html_out = simple_markdown_to_html(
             markdown_text,
             mermaid_mode=mermaid_mode,
             mermaid_image_prefix=mermaid_image_prefix,
             mermaid_image_width=mermaid_image_width,
             mermaid_image_plans=mermaid_image_plans,
         )
+        return html_out, builtin_id
 
-    pandoc = shutil.which("pandoc")
-    if pandoc:
-        proc = subprocess.run(
-            [pandoc, "--from", "gfm", "--to", "html5"],
-            input=markdown_text,
-            text=True,
-            capture_output=True,
-        )
-        if proc.returncode == 0 and proc.stdout.strip():
-            return proc.stdout
+    rendered_html = _PANDOC.convert(markdown_text)
+    if rendered_html is not None:
+        return rendered_html, f"pandoc:{_PANDOC.version}"
 
     try:
         import markdown as markdown_lib  # type: ignore
@@ -442,17 +746,18 @@ def markdown_to_html(
             output_format="xhtml",
         )
         if rendered.strip():
-            return rendered
+            return rendered, f"python-markdown:{python_markdown_version()}"
     except Exception:
         pass
 
-    return simple_markdown_to_html(
+    html_out = simple_markdown_to_html(
         markdown_text,
         mermaid_mode=mermaid_mode,
         mermaid_image_prefix=mermaid_image_prefix,
         mermaid_image_width=mermaid_image_width,
         mermaid_image_plans=mermaid_image_plans,
     )
+    return html_out, builtin_id
 
 
 def merge_labels(base: list[str], extra: list[str]) -> list[str]:
@@ -467,181 +772,1064 @@ def merge_labels(base: list[str], extra: list[str]) -> list[str]:
     return result
 
 
-class ConfluenceClient:
-    def __init__(self, site: str, email: str, api_token: str, *, verbose: bool = False) -> None:
-        self.site = site.strip()
-        self.verbose = verbose
-        token = base64.b64encode(f"{email}:{api_token}".encode("utf-8")).decode("ascii")
-        self.auth_header = f"Basic {token}"
+def label_changes(
+    labels: list[str], current: list[dict[str, Any]], *, prune: Iterable[str] = ()
+) -> tuple[list[str], list[str]]:
+    """Labels to add so a page carrying `current` has all of `labels`, and the global ones to remove.
 
-    def _request(
-        self,
-        method: str,
-        path: str,
-        *,
-        query: dict[str, Any] | None = None,
-        body: dict[str, Any] | list[Any] | None = None,
-    ) -> Any:
-        url = f"https://{self.site}{path}"
-        if query:
-            encoded = urlencode(query, doseq=True)
-            if encoded:
-                url = f"{url}?{encoded}"
+    Only labels in `prune` (those an earlier publish put on the page) are removed; labels added by hand stay.
+    """
+    present = {str(item.get("name", "")).lower() for item in current if item.get("prefix", "global") == "global"}
+    wanted = {label.lower() for label in labels}
+    added = [label for label in labels if label.lower() not in present]
+    prunable = {label.lower() for label in prune}
+    removed = sorted(name for name in present if name and name in prunable and name not in wanted)
+    return added, removed
 
-        data = None
-        headers = {
-            "Authorization": self.auth_header,
-            "Accept": "application/json",
-        }
 
-        if body is not None:
-            data = json.dumps(body).encode("utf-8")
-            headers["Content-Type"] = "application/json"
+class StreamedStorageBody:
+    """Storage markup produced piece by piece; every iteration starts over, so a request carrying it can be resent."""
 
-        req = Request(url, data=data, method=method, headers=headers)
-        try:
-            with urlopen(req, timeout=45) as resp:
-                payload = resp.read().decode("utf-8")
-        except HTTPError as exc:
-            err_payload = exc.read().decode("utf-8", errors="replace")
-            raise RuntimeError(
-                f"{method} {path} failed ({exc.code}): {err_payload[:800]}"
-            ) from exc
+    def __init__(self, pieces: Callable[[], Iterator[str]]) -> None:
+        self._pieces = pieces
 
-        if not payload.strip():
-            return {}
-        return json.loads(payload)
+    def __iter__(self) -> Iterator[str]:
+        return self._pieces()
 
-    def get_space_by_key(self, key: str) -> dict[str, Any]:
-        resp = self._request("GET", "/wiki/api/v2/spaces", query={"keys": [key], "limit": 1})
-        results = resp.get("results", [])
-        if not results:
-            raise RuntimeError(f"Space key not found or inaccessible: {key}")
-        return results[0]
 
-    def find_page_by_title(self, space_id: str, title: str) -> dict[str, Any] | None:
-        resp = self._request(
-            "GET",
-            "/wiki/api/v2/pages",
-            query={
-                "space-id": [space_id],
-                "status": ["current"],
-                "title": title,
-                "limit": 25,
-            },
-        )
-        results = resp.get("results", [])
-        for page in results:
-            if page.get("title") == title:
-                return page
-        return results[0] if results else None
+class StreamedJSONBody:
+    """UTF-8 JSON request body with one StreamedStorageBody string value, encoded in bounded chunks on each pass."""
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, prefix: str, value: StreamedStorageBody, suffix: str) -> None:
+        self.prefix = prefix
+        self.value = value
+        self.suffix = suffix
+        self.bytes_yielded = 0  # of the latest pass, for the trace and metrics
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.bytes_yielded = 0
+        buf = [self.prefix, '"']
+        size = 0
+        for piece in self.value:
+            # A JSON string escapes character by character, so escaping each piece equals escaping the whole.
+            escaped = json.dumps(piece)[1:-1]
+            buf.append(escaped)
+            size += len(escaped)
+            if size >= self.chunk_size:
+                chunk = "".join(buf).encode("utf-8")
+                self.bytes_yielded += len(chunk)
+                yield chunk
+                buf = []
+                size = 0
+        buf.extend(('"', self.suffix))
+        chunk = "".join(buf).encode("utf-8")
+        self.bytes_yielded += len(chunk)
+        yield chunk
+
+
+def encode_json_body(body: dict[str, Any] | list[Any]) -> bytes | StreamedJSONBody:
+    streamed: list[StreamedStorageBody] = []
+    placeholder = f"stream-{uuid.uuid4().hex}"
 
-    def get_page(self, page_id: str) -> dict[str, Any]:
-        return self._request("GET", f"/wiki/api/v2/pages/{page_id}", query={"body-format": "storage"})
+    def default(obj: Any) -> Any:
+        if isinstance(obj, StreamedStorageBody) and not streamed:
+            streamed.append(obj)
+            return placeholder
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
-    def create_page(
+    text = json.dumps(body, default=default)
+    if not streamed:
+        return text.encode("utf-8")
+    prefix, suffix = text.split(f'"{placeholder}"', 1)
+    return StreamedJSONBody(prefix, streamed[0], suffix)
+
+
+@dataclass
+class HTTPResponseData:
+    status: int
+    headers: http.client.HTTPMessage
+    body: bytes
+
+
+class _PooledHTTPConnection(http.client.HTTPConnection):
+    """Plain HTTP connection that reports new sockets to its pool."""
+
+    def __init__(self, host: str, *, pool: HTTPConnectionPool, **kwargs: Any) -> None:
+        super().__init__(host, **kwargs)
+        self._pool = pool
+
+    def connect(self) -> None:
+        super().connect()
+        self._pool.note_connect(self.sock)
+
+
+class _PooledHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection that resumes the pool's last TLS session on connect."""
+
+    def __init__(self, host: str, *, pool: HTTPConnectionPool, **kwargs: Any) -> None:
+        super().__init__(host, **kwargs)
+        self._pool = pool
+
+    def connect(self) -> None:
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=server_hostname,
+            session=self._pool.tls_session,
+        )
+        self._pool.note_connect(self.sock)
+
+
+# Methods a pool never replays on its own once the request has been sent, unless the caller vouches for them.
+NON_IDEMPOTENT_METHODS = frozenset({"POST", "PATCH"})
+
+
+class HTTPConnectionPool:
+    """Thread-safe pool of keep-alive connections to a single host."""
+
+    def __init__(self, host: str, *, scheme: str = "https", max_idle: int = 8, timeout: float = 45) -> None:
+        self.host = host
+        self.scheme = scheme
+        self.max_idle = max(1, max_idle)
+        self.timeout = timeout
+        self.tls_session: ssl.SSLSession | None = None
+        self.connections_opened = 0
+        self.tls_sessions_resumed = 0
+        self.requests_sent = 0
+        self._ssl_context = ssl.create_default_context() if scheme == "https" else None
+        self._idle: list[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        if self.scheme != "https":
+            return _PooledHTTPConnection(self.host, pool=self, timeout=self.timeout)
+
+        proxy = getproxies().get("https")
+        hostname = urlsplit(f"//{self.host}").hostname or self.host
+        if proxy and not proxy_bypass(hostname):
+            parts = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            conn = _PooledHTTPSConnection(
+                parts.netloc.rsplit("@", 1)[-1],
+                pool=self,
+                context=self._ssl_context,
+                timeout=self.timeout,
+            )
+            conn.set_tunnel(self.host)
+            return conn
+        return _PooledHTTPSConnection(self.host, pool=self, context=self._ssl_context, timeout=self.timeout)
+
+    def note_connect(self, sock: Any) -> None:
+        with self._lock:
+            self.connections_opened += 1
+            if isinstance(sock, ssl.SSLSocket):
+                if sock.session_reused:
+                    self.tls_sessions_resumed += 1
+                if sock.session is not None:
+                    self.tls_session = sock.session
+
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(), False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        sock = conn.sock
+        with self._lock:
+            # TLS 1.3 tickets arrive after the handshake, so refresh the resumable session here.
+            if isinstance(sock, ssl.SSLSocket) and sock.session is not None:
+                self.tls_session = sock.session
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(
         self,
+        method: str,
+        target: str,
         *,
-        space_id: str,
-        title: str,
-        body_html: str,
-        parent_id: str | None,
-    ) -> dict[str, Any]:
-        payload: dict[str, Any] = {
-            "spaceId": str(space_id),
-            "status": "current",
-            "title": title,
-            "body": {
-                "representation": "storage",
-                "value": body_html,
-            },
-        }
-        if parent_id:
-            payload["parentId"] = str(parent_id)
-        return self._request("POST", "/wiki/api/v2/pages", body=payload)
+        body: bytes | StreamedJSONBody | None = None,
+        headers: dict[str, str] | None = None,
+        timeout: float | None = None,
+        idempotent: bool | None = None,
+    ) -> HTTPResponseData:
+        replayable = method not in NON_IDEMPOTENT_METHODS if idempotent is None else idempotent
+        retried_stale = False
+        while True:
+            conn, reused = self._acquire()
+            sent = False
+            try:
+                conn.timeout = timeout or self.timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(conn.timeout)
+                with self._lock:
+                    self.requests_sent += 1
+                conn.request(method, target, body=body, headers=headers or {})
+                sent = True
+                resp = conn.getresponse()
+                payload = resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # The server may drop an idle keep-alive socket; retry once on a fresh connection. Once the whole
+                # request went out it may have been applied, so from then on only idempotent calls are replayed.
+                if reused and not retried_stale and (not sent or replayable):
+                    retried_stale = True
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return HTTPResponseData(status=resp.status, headers=resp.headers, body=payload)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class AsyncHTTPConnectionPool:
+    """Keep-alive HTTP/1.1 connections over asyncio streams to a single host.
+
+    Event-loop objects are created lazily, so instances can be built outside a
+    running loop and used from whichever loop first awaits them.
+    """
+
+    def __init__(self, host: str, *, scheme: str = "https", max_idle: int = 32, timeout: float = 45) -> None:
+        self.host = host
+        self.scheme = scheme
+        self.max_idle = max(1, max_idle)
+        self.timeout = timeout
+        self.connections_opened = 0
+        # asyncio cannot hand a saved TLS session to a new connection, so resumption is not tracked here.
+        self.tls_sessions_resumed: int | None = None
+        self.requests_sent = 0
+        self._ssl_context = ssl.create_default_context() if scheme == "https" else None
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    def _tunnel(self, proxy: str) -> socket.socket:
+        """Blocking CONNECT through an HTTPS proxy, done by http.client exactly as the sync pool does it."""
+        parts = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+        conn = http.client.HTTPConnection(parts.netloc.rsplit("@", 1)[-1], timeout=self.timeout)
+        conn.set_tunnel(self.host)
+        try:
+            conn.connect()
+        except BaseException:
+            conn.close()
+            raise
+        sock, conn.sock = conn.sock, None
+        return sock
+
+    async def _open(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        parts = urlsplit(f"//{self.host}")
+        hostname = parts.hostname or self.host
+        port = parts.port or (443 if self.scheme == "https" else 80)
+        proxy = getproxies().get("https") if self._ssl_context else None
+        if proxy and not proxy_bypass(hostname):
+            sock = await asyncio.to_thread(self._tunnel, proxy)
+            reader, writer = await asyncio.open_connection(
+                sock=sock, ssl=self._ssl_context, server_hostname=hostname
+            )
+        else:
+            reader, writer = await asyncio.open_connection(
+                hostname,
+                port,
+                ssl=self._ssl_context,
+                server_hostname=hostname if self._ssl_context else None,
+            )
+        self.connections_opened += 1
+        return reader, writer
 
-    def update_page(
+    async def _write_request(
         self,
-        *,
-        page_id: str,
-        title: str,
-        body_html: str,
-        next_version: int,
-        parent_id: str | None,
-    ) -> dict[str, Any]:
-        payload: dict[str, Any] = {
-            "id": str(page_id),
-            "status": "current",
-            "title": title,
-            "body": {
-                "representation": "storage",
-                "value": body_html,
-            },
-            "version": {
-                "number": next_version,
-                "message": "Updated by Codex publisher",
-            },
-        }
-        if parent_id:
-            payload["parentId"] = str(parent_id)
-        return self._request("PUT", f"/wiki/api/v2/pages/{page_id}", body=payload)
+        writer: asyncio.StreamWriter,
+        method: str,
+        target: str,
+        body: bytes | StreamedJSONBody | None,
+        headers: dict[str, str],
+    ) -> None:
+        head = [f"{method} {target} HTTP/1.1", f"Host: {self.host}", "Accept-Encoding: identity"]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        if isinstance(body, StreamedJSONBody):
+            head.append("Transfer-Encoding: chunked")
+        elif body is not None or method in {"POST", "PUT"}:
+            head.append(f"Content-Length: {len(body or b'')}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if isinstance(body, StreamedJSONBody):
+            # Conversion reads the source file, so produce each chunk in a worker thread.
+            chunks = iter(body)
+            while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                writer.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+        elif body:
+            writer.write(body)
+        await writer.drain()
+
+    async def _read_response(self, reader: asyncio.StreamReader, method: str) -> tuple[HTTPResponseData, bool]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed before response")
+        version, status_raw = status_line.decode("latin-1").split(None, 2)[:2]
+        status = int(status_raw)
+
+        header_lines: list[bytes] = []
+        while True:
+            line = await reader.readline()
+            if line in {b"\r\n", b"\n", b""}:
+                break
+            header_lines.append(line)
+        message = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(
+            b"".join(header_lines).decode("iso-8859-1")
+        )
 
-    def add_labels(self, page_id: str, labels: list[str]) -> None:
-        if not labels:
-            return
-        payload = [{"prefix": "global", "name": label} for label in labels]
-        self._request("POST", f"/wiki/rest/api/content/{page_id}/label", body=payload)
+        keep_alive = version == "HTTP/1.1" and message.get("Connection", "").lower() != "close"
+        if method == "HEAD" or status in {204, 304} or 100 <= status < 200:
+            payload = b""
+        elif message.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks: list[bytes] = []
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    while (await reader.readline()) not in {b"\r\n", b"\n", b""}:
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            payload = b"".join(chunks)
+        elif message.get("Content-Length") is not None:
+            payload = await reader.readexactly(int(message["Content-Length"]))
+        else:
+            payload = await reader.read()
+            keep_alive = False
+        return HTTPResponseData(status=status, headers=message, body=payload), keep_alive
 
-    def upload_attachment_bytes(
+    async def request(
         self,
+        method: str,
+        target: str,
         *,
-        page_id: str,
-        filename: str,
-        data: bytes,
-        content_type: str,
-    ) -> dict[str, Any]:
-        existing = self.find_attachment_by_filename(page_id=page_id, filename=filename)
-        safe_filename = filename.replace('"', "_")
-        boundary = f"----CodexBoundary{uuid.uuid4().hex}"
-        body = b"".join(
-            [
-                f"--{boundary}\r\n".encode("utf-8"),
-                (
-                    f'Content-Disposition: form-data; name="file"; filename="{safe_filename}"\r\n'
-                ).encode("utf-8"),
-                f"Content-Type: {content_type}\r\n\r\n".encode("utf-8"),
-                data,
-                b"\r\n",
-                f"--{boundary}--\r\n".encode("utf-8"),
-            ]
-        )
+        body: bytes | StreamedJSONBody | None = None,
+        headers: dict[str, str] | None = None,
+        timeout: float | None = None,
+        idempotent: bool | None = None,
+    ) -> HTTPResponseData:
+        replayable = method not in NON_IDEMPOTENT_METHODS if idempotent is None else idempotent
+        retried_stale = False
+        while True:
+            if self._idle:
+                reader, writer = self._idle.pop()
+                reused = True
+            else:
+                reader, writer = await self._open()
+                reused = False
+            self.requests_sent += 1
+            sent = False
+
+            async def exchange() -> tuple[HTTPResponseData, bool]:
+                nonlocal sent
+                await self._write_request(writer, method, target, body, headers or {})
+                sent = True
+                return await self._read_response(reader, method)
+
+            try:
+                if isinstance(body, StreamedJSONBody):
+                    # A streamed body may take far longer to send than any per-request timeout allows, so only
+                    # the wait for the response is bounded, as the sync pool's socket timeout bounds it.
+                    await self._write_request(writer, method, target, body, headers or {})
+                    sent = True
+                    resp, keep_alive = await asyncio.wait_for(
+                        self._read_response(reader, method), timeout or self.timeout
+                    )
+                else:
+                    resp, keep_alive = await asyncio.wait_for(exchange(), timeout or self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # The server may drop an idle keep-alive socket; retry once on a fresh connection. Once the whole
+                # request went out it may have been applied, so from then on only idempotent calls are replayed.
+                if reused and not retried_stale and (not sent or replayable):
+                    retried_stale = True
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+
+            if keep_alive and len(self._idle) < self.max_idle:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            return resp
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+
+RETRYABLE_STATUSES = frozenset({500, 502, 503, 504})
+TRANSIENT_NETWORK_ERRORS = (
+    socket.timeout,
+    TimeoutError,
+    asyncio.TimeoutError,
+    ConnectionError,
+    http.client.HTTPException,
+    asyncio.IncompleteReadError,
+)
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+# 409s on a page update are resolved by re-reading the version and re-sending, at most this many times.
+VERSION_CONFLICT_MAX_RETRIES = 5
+RATE_LIMIT_MAX_RETRIES = 6
+# Used when a 429 carries neither Retry-After nor X-RateLimit-Reset.
+RATE_LIMIT_DEFAULT_BACKOFF = 5.0
+RATE_LIMIT_MIN_RATE = 0.5
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After value given as delta-seconds or an HTTP-date."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, when.timestamp() - time.time())
+
+
+def parse_rate_limit_reset(value: str | None) -> float | None:
+    """Seconds until an ISO 8601 X-RateLimit-Reset timestamp."""
+    if not value:
+        return None
+    try:
+        when = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _resolve_future(future: asyncio.Future[None]) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimitScheduler:
+    """Token bucket plus an adaptive in-flight window shared by every request of one client.
+
+    429 responses and Atlassian's X-RateLimit-* headers pause the client and halve both the
+    request rate and the window; successful responses grow them back toward the configured caps.
+    """
+
+    def __init__(self, *, rate: float, max_in_flight: int) -> None:
+        self.max_rate = max(RATE_LIMIT_MIN_RATE, rate)
+        self.rate = self.max_rate
+        self.burst = max(1.0, self.max_rate)
+        self.tokens = self.burst
+        self.max_in_flight = max(1, max_in_flight)
+        self.window = float(self.max_in_flight)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.near_limit = 0
+        self.waited = 0.0
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        # Futures of acquire_async callers waiting for a free slot, each on its own event loop.
+        self._async_waiters: list[asyncio.Future[None]] = []
+
+    def _try_acquire(self) -> float:
+        """Take a slot and a token and return 0, or return how long to wait (inf: until a slot frees)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.window):
+            return float("inf")
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.in_flight += 1
+        return 0.0
+
+    def acquire(self) -> None:
+        started = time.monotonic()
+        with self._slot_freed:
+            while (delay := self._try_acquire()) > 0:
+                self._slot_freed.wait(None if delay == float("inf") else delay)
+            self.waited += time.monotonic() - started
+
+    async def acquire_async(self) -> None:
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        while True:
+            slot_freed: asyncio.Future[None] | None = None
+            with self._lock:
+                delay = self._try_acquire()
+                if delay == 0:
+                    self.waited += time.monotonic() - started
+                    return
+                if delay == float("inf"):
+                    slot_freed = loop.create_future()
+                    self._async_waiters.append(slot_freed)
+            if slot_freed is None:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await slot_freed
+            except asyncio.CancelledError:
+                with self._lock:
+                    if slot_freed in self._async_waiters:
+                        self._async_waiters.remove(slot_freed)
+                raise
+
+    def _wake_async_waiters(self) -> None:
+        """Resolve every parked acquire_async future; called with the lock held, from any thread."""
+        waiters, self._async_waiters = self._async_waiters, []
+        try:
+            running: asyncio.AbstractEventLoop | None = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for waiter in waiters:
+            loop = waiter.get_loop()
+            if loop is running:
+                _resolve_future(waiter)
+                continue
+            try:
+                loop.call_soon_threadsafe(_resolve_future, waiter)
+            except RuntimeError:
+                pass  # That loop has closed; nobody is waiting on it any more.
+
+    def release(self, status: int | None, headers: http.client.HTTPMessage | None) -> float | None:
+        """Free the request slot and adapt to the response; returns the pause imposed by a 429."""
+        with self._slot_freed:
+            self.in_flight -= 1
+            self._slot_freed.notify_all()
+            self._wake_async_waiters()
+            if status is None or headers is None:
+                return None
+
+            reset_in = parse_rate_limit_reset(headers.get("X-RateLimit-Reset"))
+            if status == 429:
+                self.throttled += 1
+                delay = parse_retry_after(headers.get("Retry-After") or headers.get("Beta-Retry-After"))
+                if delay is None:
+                    delay = reset_in if reset_in is not None else RATE_LIMIT_DEFAULT_BACKOFF
+                self.rate = max(RATE_LIMIT_MIN_RATE, self.rate / 2)
+                self.window = max(1.0, self.window / 2)
+                self.tokens = 0.0
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                return delay
+
+            if headers.get("X-RateLimit-Remaining", "").strip() == "0" and reset_in:
+                self.paused_until = max(self.paused_until, time.monotonic() + reset_in)
+            if headers.get("X-RateLimit-NearLimit", "").strip().lower() == "true":
+                self.near_limit += 1
+                self.rate = max(RATE_LIMIT_MIN_RATE, self.rate * 0.8)
+            elif status < 500:
+                self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+                self.window = min(float(self.max_in_flight), self.window + 1.0 / self.window)
+            return None
+
+    def summary(self) -> str:
+        return (
+            f"Rate limit: {self.throttled} throttled response(s), {self.near_limit} near-limit warning(s), "
+            f"{self.waited:.1f}s queued in total; now {self.rate:.1f} req/s, up to {int(self.window)} in flight"
+        )
+
+
+class ConfluenceHTTPError(RuntimeError):
+    """Non-2xx Confluence response, carrying the status and headers for retry decisions."""
+
+    def __init__(self, message: str, *, status: int, headers: http.client.HTTPMessage | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    if isinstance(exc, ConfluenceHTTPError):
+        return exc.status in RETRYABLE_STATUSES
+    return isinstance(exc, TRANSIENT_NETWORK_ERRORS)
+
+
+def pick_by_title(results: list[dict[str, Any]], title: str) -> dict[str, Any] | None:
+    for page in results:
+        if page.get("title") == title:
+            return page
+    return results[0] if results else None
+
+
+class AttachmentIndex:
+    """Filename -> attachment map for one page, built from a single paginated listing."""
+
+    def __init__(self) -> None:
+        self.by_filename: dict[str, dict[str, Any]] = {}
+        self.requests = 0
+
+    def add_batch(self, attachments: list[dict[str, Any]]) -> None:
+        self.requests += 1
+        for attachment in attachments:
+            title = attachment.get("title")
+            if title:
+                self.by_filename.setdefault(str(title), attachment)
+
+    def get(self, filename: str) -> dict[str, Any] | None:
+        return self.by_filename.get(filename)
+
+    def unreferenced(self, filenames: Iterable[str], *, prefix: str = "") -> list[str]:
+        referenced = set(filenames)
+        return sorted(name for name in self.by_filename if name.startswith(prefix) and name not in referenced)
+
+
+def split_site(site: str) -> tuple[str, str]:
+    """(scheme, host) for ATLASSIAN_SITE; a bare host means https, an explicit http:// is kept for local stand-ins."""
+    site = site.strip().rstrip("/")
+    for scheme in ("https", "http"):
+        prefix = f"{scheme}://"
+        if site.lower().startswith(prefix):
+            return scheme, site[len(prefix) :]
+    return "https", site
+
+
+T = TypeVar("T")
+# A request plan is a generator that yields I/O operations and is sent their results (or thrown their errors).
+# The decisions (retries, 409 rebase, attachment currency, label diff) live in plans written once; each engine
+# only performs the operations: ConfluenceClient with blocking calls, AsyncConfluenceClient with coroutines.
+Plan = Generator[Any, Any, T]
+
+
+@dataclass
+class _HttpOp:
+    method: str
+    target: str
+    body: bytes | StreamedJSONBody | None
+    headers: dict[str, str]
+    timeout: float
+    idempotent: bool
+
+
+@dataclass
+class _AcquireOp:
+    """Wait for a rate-limit slot."""
+
+
+@dataclass
+class _SleepOp:
+    seconds: float
+
+
+@dataclass
+class _OffloadOp:
+    """Blocking work: run inline by the sync engine and in a worker thread by the async one."""
+
+    func: Callable[..., Any]
+    args: tuple[Any, ...] = ()
+    kwargs: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class _GatherOp:
+    """Run sub-plans concurrently, at most `limit` at a time; the result is their results in order."""
+
+    plans: list[Plan[Any]]
+    limit: int
+
+
+@dataclass
+class _ExclusiveOp:
+    lock: EngineLock
+    plan: Plan[Any]
+
+
+class EngineLock:
+    """Mutual exclusion for a plan under either engine: a thread lock, or an asyncio lock made on first use."""
+
+    def __init__(self) -> None:
+        self.thread_lock = threading.Lock()
+        self._asyncio_lock: asyncio.Lock | None = None
+
+    def asyncio_lock(self) -> asyncio.Lock:
+        if self._asyncio_lock is None:
+            self._asyncio_lock = asyncio.Lock()
+        return self._asyncio_lock
+
+
+class _ConfluenceApi:
+    """Request building, response decoding and the request plans shared by the sync and async clients."""
+
+    def __init__(
+        self,
+        site: str,
+        email: str,
+        api_token: str,
+        *,
+        verbose: bool = False,
+        retries: int = 3,
+        trace: PublishTrace | None = None,
+        metrics: PublishMetrics | None = None,
+    ) -> None:
+        self.scheme, self.site = split_site(site)
+        self.verbose = verbose
+        self.trace = trace
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.attach(client=self)
+        self.max_retries = max(0, retries)
+        self.retries_made = 0
+        self.retry_seconds = 0.0
+        token = base64.b64encode(f"{email}:{api_token}".encode("utf-8")).decode("ascii")
+        self.auth_header = f"Basic {token}"
+        self.pool: HTTPConnectionPool | AsyncHTTPConnectionPool
+        self.scheduler: RateLimitScheduler
+        self.attachments_uploaded = 0
+        self.attachments_unchanged = 0
+        self.attachment_bytes_sent = 0
+        self.attachment_bytes_avoided = 0
+        self._stats_lock = threading.Lock()
+
+    def connection_summary(self) -> str:
+        pool = self.pool
+        resumed = "n/a" if pool.tls_sessions_resumed is None else pool.tls_sessions_resumed
+        return (
+            f"HTTP: {pool.requests_sent} request(s) over {pool.connections_opened} connection(s)"
+            f" (TLS resumed={resumed})"
+        )
+
+    def rate_limit_summary(self) -> str | None:
+        scheduler = self.scheduler
+        if not (scheduler.throttled or scheduler.near_limit):
+            return None
+        return scheduler.summary()
+
+    def _note_version_conflict(
+        self,
+        payload: dict[str, Any],
+        page_id: str,
+        remote_version: int,
+        conflicts: list[tuple[int, int]],
+    ) -> int:
+        """Record a 409 on an update and rebase the payload onto the remote version; returns the new version."""
+        attempted = payload["version"]["number"]
+        conflicts.append((attempted, remote_version))
+        if self.verbose:
+            print(
+                f"409 on PUT page {page_id}: version {attempted} taken, remote at {remote_version}; "
+                f"retry {len(conflicts)}/{VERSION_CONFLICT_MAX_RETRIES}",
+                file=sys.stderr,
+            )
+        payload["version"]["number"] = remote_version + 1
+        return remote_version + 1
+
+    def _note_http(
+        self,
+        method: str,
+        target: str,
+        body: bytes | StreamedJSONBody | None,
+        resp: HTTPResponseData | None,
+        latency: float,
+        error: BaseException | None = None,
+    ) -> None:
+        """Log one HTTP exchange with --verbose and record it in the --profile trace and the metrics."""
+        if not (self.verbose or self.trace is not None or self.metrics is not None):
+            return
+        if isinstance(body, StreamedJSONBody):
+            # Only what was written before a failure counts; the pool streams the body as it is generated.
+            sent = body.bytes_yielded
+        else:
+            sent = len(body) if body is not None else 0
+        received = len(resp.body) if resp is not None else 0
+        status = resp.status if resp is not None else None
+        if self.verbose:
+            outcome = str(status) if error is None else type(error).__name__
+            print(
+                f"{method} {target.split('?', 1)[0]} -> {outcome} in {latency * 1000:.0f} ms"
+                f" ({sent} B sent, {received} B received)",
+                file=sys.stderr,
+            )
+        if self.trace is not None:
+            self.trace.note_http(
+                method=method,
+                target=target,
+                status=status,
+                sent_bytes=sent,
+                received_bytes=received,
+                latency=latency,
+                error=type(error).__name__ if error is not None else None,
+            )
+        if self.metrics is not None:
+            self.metrics.observe_http(
+                method=method, target=target, status=status, sent_bytes=sent, received_bytes=received, latency=latency
+            )
+
+    def retry_summary(self) -> str:
+        return f"Retries: {self.retries_made} transient failure(s) retried, {self.retry_seconds:.1f}s spent backing off"
+
+    def _retry_delay(self, failures: int, headers: http.client.HTTPMessage | None = None) -> float:
+        """Full-jitter exponential backoff, stretched to a server-sent Retry-After."""
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**failures))
+        retry_after = parse_retry_after(headers.get("Retry-After")) if headers is not None else None
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+        with self._stats_lock:
+            self.retries_made += 1
+            self.retry_seconds += delay
+        return delay
+
+    def _log_retry(self, method: str, target: str, reason: str, delay: float, attempt: int, limit: int) -> None:
+        if self.verbose:
+            print(f"{reason} on {method} {target}; retry {attempt}/{limit} in {delay:.1f}s", file=sys.stderr)
+
+    def attachment_summary(self) -> str:
+        return (
+            f"Attachments: {self.attachments_uploaded} uploaded ({self.attachment_bytes_sent} bytes sent), "
+            f"{self.attachments_unchanged} unchanged ({self.attachment_bytes_avoided} bytes avoided)"
+        )
+
+    def _note_attachment(self, *, uploaded: bool, size: int) -> None:
+        with self._stats_lock:
+            if uploaded:
+                self.attachments_uploaded += 1
+                self.attachment_bytes_sent += size
+            else:
+                self.attachments_unchanged += 1
+                self.attachment_bytes_avoided += size
+
+    @staticmethod
+    def attachment_content_hash(data: bytes) -> str:
+        return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+    @staticmethod
+    def attachment_is_current(existing: dict[str, Any] | None, data: bytes) -> bool:
+        """True when the existing attachment already holds these bytes, judged by the hash we stored as its comment."""
+        if not existing:
+            return False
+        extensions = existing.get("extensions") or {}
+        file_size = extensions.get("fileSize")
+        if file_size is not None and int(file_size) != len(data):
+            return False
+        comment = extensions.get("comment") or (existing.get("metadata") or {}).get("comment") or ""
+        return comment == _ConfluenceApi.attachment_content_hash(data)
+
+    def _build_json_request(
+        self,
+        path: str,
+        query: dict[str, Any] | None,
+        body: dict[str, Any] | list[Any] | None,
+    ) -> tuple[str, bytes | StreamedJSONBody | None, dict[str, str]]:
+        target = path
+        if query:
+            encoded = urlencode(query, doseq=True)
+            if encoded:
+                target = f"{target}?{encoded}"
+
+        data = None
+        headers = {
+            "Authorization": self.auth_header,
+            "Accept": "application/json",
+        }
+
+        if body is not None:
+            data = encode_json_body(body)
+            headers["Content-Type"] = "application/json"
+        return target, data, headers
+
+    @staticmethod
+    def _decode_json_response(method: str, path: str, resp: HTTPResponseData) -> Any:
+        if not 200 <= resp.status < 300:
+            err_payload = resp.body.decode("utf-8", errors="replace")
+            raise ConfluenceHTTPError(
+                f"{method} {path} failed ({resp.status}): {err_payload[:800]}",
+                status=resp.status,
+                headers=resp.headers,
+            )
+
+        payload = resp.body.decode("utf-8")
+        if not payload.strip():
+            return {}
+        return json.loads(payload)
+
+    @staticmethod
+    def _space_query(key: str) -> dict[str, Any]:
+        return {"keys": [key], "limit": 1}
+
+    @staticmethod
+    def _first_space(key: str, resp: dict[str, Any]) -> dict[str, Any]:
+        results = resp.get("results", [])
+        if not results:
+            raise RuntimeError(f"Space key not found or inaccessible: {key}")
+        return results[0]
+
+    @staticmethod
+    def _title_query(space_id: str, title: str) -> dict[str, Any]:
+        return {
+            "space-id": [space_id],
+            "status": ["current"],
+            "title": title,
+            "limit": 25,
+        }
+
+    @staticmethod
+    def _space_pages_query(space_id: str) -> dict[str, Any]:
+        return {"space-id": [space_id], "status": ["current"], "limit": 250}
+
+    @staticmethod
+    def _next_link(resp: dict[str, Any]) -> str | None:
+        next_link = resp.get("_links", {}).get("next")
+        if not next_link:
+            return None
+        # v2 returns the next page relative to the site root, with or without the /wiki prefix.
+        return next_link if next_link.startswith("/wiki/") else f"/wiki{next_link}"
+
+    @staticmethod
+    def _create_page_payload(
+        *,
+        space_id: str,
+        title: str,
+        body_html: str | StreamedStorageBody,
+        parent_id: str | None,
+    ) -> dict[str, Any]:
+        payload: dict[str, Any] = {
+            "spaceId": str(space_id),
+            "status": "current",
+            "title": title,
+            "body": {
+                "representation": "storage",
+                "value": body_html,
+            },
+        }
+        if parent_id:
+            payload["parentId"] = str(parent_id)
+        return payload
+
+    @staticmethod
+    def _update_page_payload(
+        *,
+        page_id: str,
+        title: str,
+        body_html: str | StreamedStorageBody,
+        next_version: int,
+        parent_id: str | None,
+    ) -> dict[str, Any]:
+        payload: dict[str, Any] = {
+            "id": str(page_id),
+            "status": "current",
+            "title": title,
+            "body": {
+                "representation": "storage",
+                "value": body_html,
+            },
+            "version": {
+                "number": next_version,
+                # Unique per update, so a retried PUT can recognise its own earlier write (see _is_own_write).
+                "message": f"Updated by Codex publisher ({uuid.uuid4().hex[:12]})",
+            },
+        }
+        if parent_id:
+            payload["parentId"] = str(parent_id)
+        return payload
+
+    @staticmethod
+    def _is_own_write(remote_page: dict[str, Any], payload: dict[str, Any]) -> bool:
+        """Whether the page's current version is `payload`, applied by an attempt whose response was lost."""
+        return (remote_page.get("version") or {}).get("message") == payload["version"]["message"]
+
+    @staticmethod
+    def _labels_payload(labels: list[str]) -> list[dict[str, str]]:
+        return [{"prefix": "global", "name": label} for label in labels]
+
+    @staticmethod
+    def _page_query(*, with_body: bool, with_labels: bool) -> dict[str, Any] | None:
+        query: dict[str, Any] = {}
+        if with_body:
+            query["body-format"] = "storage"
+        if with_labels:
+            query["include-labels"] = "true"
+        return query or None
+
+    @staticmethod
+    def _included_labels(page: dict[str, Any]) -> list[dict[str, Any]] | None:
+        """Labels embedded by include-labels, or None when the page came without them or they were truncated."""
+        labels = page.get("labels")
+        if not isinstance(labels, dict) or (labels.get("meta") or {}).get("hasMore"):
+            return None
+        return list(labels.get("results") or [])
+
+    def _build_attachment_upload(
+        self,
+        *,
+        page_id: str,
+        filename: str,
+        data: bytes,
+        content_type: str,
+        existing: dict[str, Any] | None,
+    ) -> tuple[str, bytes, dict[str, str]]:
+        safe_filename = filename.replace('"', "_")
+        boundary = f"----CodexBoundary{uuid.uuid4().hex}"
+        body = b"".join(
+            [
+                f"--{boundary}\r\n".encode("utf-8"),
+                (
+                    f'Content-Disposition: form-data; name="file"; filename="{safe_filename}"\r\n'
+                ).encode("utf-8"),
+                f"Content-Type: {content_type}\r\n\r\n".encode("utf-8"),
+                data,
+                b"\r\n",
+                f"--{boundary}\r\n".encode("utf-8"),
+                b'Content-Disposition: form-data; name="comment"\r\n\r\n',
+                self.attachment_content_hash(data).encode("ascii"),
+                b"\r\n",
+                f"--{boundary}--\r\n".encode("utf-8"),
+            ]
+        )
 
         if existing:
             attachment_id = str(existing["id"])
-            url = (
-                f"https://{self.site}/wiki/rest/api/content/{page_id}/child/attachment/"
-                f"{attachment_id}/data"
-            )
+            target = f"/wiki/rest/api/content/{page_id}/child/attachment/{attachment_id}/data"
         else:
-            url = f"https://{self.site}/wiki/rest/api/content/{page_id}/child/attachment"
+            target = f"/wiki/rest/api/content/{page_id}/child/attachment"
         headers = {
             "Authorization": self.auth_header,
             "Accept": "application/json",
             "Content-Type": f"multipart/form-data; boundary={boundary}",
             "X-Atlassian-Token": "nocheck",
         }
-        req = Request(url, data=body, method="POST", headers=headers)
-        try:
-            with urlopen(req, timeout=60) as resp:
-                payload = resp.read().decode("utf-8")
-        except HTTPError as exc:
-            err_payload = exc.read().decode("utf-8", errors="replace")
-            raise RuntimeError(
-                f"POST attachment upload failed "
-                f"({exc.code}): {err_payload[:800]}"
-            ) from exc
-
-        obj = json.loads(payload)
+        return target, body, headers
+
+    @staticmethod
+    def _decode_attachment_upload(resp: HTTPResponseData) -> dict[str, Any]:
+        if not 200 <= resp.status < 300:
+            err_payload = resp.body.decode("utf-8", errors="replace")
+            raise ConfluenceHTTPError(
+                f"POST attachment upload failed ({resp.status}): {err_payload[:800]}",
+                status=resp.status,
+                headers=resp.headers,
+            )
+
+        obj = json.loads(resp.body.decode("utf-8"))
         if isinstance(obj, dict) and obj.get("id"):
             return obj
         results = obj.get("results", [])
@@ -649,166 +1837,2280 @@ class ConfluenceClient:
             raise RuntimeError("Attachment upload succeeded but no attachment result was returned.")
         return results[0]
 
-    def find_attachment_by_filename(self, *, page_id: str, filename: str) -> dict[str, Any] | None:
-        resp = self._request(
+    @staticmethod
+    def _attachment_query(filename: str) -> dict[str, Any]:
+        return {"filename": filename, "limit": 5}
+
+    @staticmethod
+    def _attachment_listing_query() -> dict[str, Any]:
+        return {"limit": 200}
+
+    # --- request plans -----------------------------------------------------------------------------
+    # Each *_plan method decides what to send and how to react; the engines below only perform its I/O.
+
+    def send_plan(
+        self,
+        method: str,
+        target: str,
+        *,
+        body: bytes | StreamedJSONBody | None,
+        headers: dict[str, str],
+        timeout: float,
+        idempotent: bool,
+    ) -> Plan[HTTPResponseData]:
+        throttled = 0
+        failures = 0
+        while True:
+            yield _AcquireOp()
+            started = time.perf_counter()
+            try:
+                resp = yield _HttpOp(method, target, body, headers, timeout, idempotent)
+            except TRANSIENT_NETWORK_ERRORS as exc:
+                self._note_http(method, target, body, None, time.perf_counter() - started, exc)
+                self.scheduler.release(None, None)
+                # Non-idempotent calls are replayed by their callers, which first check whether they landed.
+                if not idempotent or failures >= self.max_retries:
+                    raise
+                delay = self._retry_delay(failures)
+                failures += 1
+                self._log_retry(method, target, type(exc).__name__, delay, failures, self.max_retries)
+                yield _SleepOp(delay)
+                continue
+            except BaseException as exc:
+                self._note_http(method, target, body, None, time.perf_counter() - started, exc)
+                self.scheduler.release(None, None)
+                raise
+
+            self._note_http(method, target, body, resp, time.perf_counter() - started)
+            delay = self.scheduler.release(resp.status, resp.headers)
+            # A 429 means the request was not processed, so it is safe to replay once the pause has passed.
+            if delay is not None and throttled < RATE_LIMIT_MAX_RETRIES:
+                throttled += 1
+                self._log_retry(method, target, "429", delay, throttled, RATE_LIMIT_MAX_RETRIES)
+                continue
+            if idempotent and resp.status in RETRYABLE_STATUSES and failures < self.max_retries:
+                delay = self._retry_delay(failures, resp.headers)
+                failures += 1
+                self._log_retry(method, target, str(resp.status), delay, failures, self.max_retries)
+                yield _SleepOp(delay)
+                continue
+            return resp
+
+    def request_plan(
+        self,
+        method: str,
+        path: str,
+        *,
+        query: dict[str, Any] | None = None,
+        body: dict[str, Any] | list[Any] | None = None,
+        idempotent: bool | None = None,
+    ) -> Plan[Any]:
+        target, data, headers = self._build_json_request(path, query, body)
+        resp = yield from self.send_plan(
+            method,
+            target,
+            body=data,
+            headers=headers,
+            timeout=45,
+            idempotent=method != "POST" if idempotent is None else idempotent,
+        )
+        return self._decode_json_response(method, path, resp)
+
+    def _paged_plan(self, path: str, query: dict[str, Any]) -> Plan[list[list[dict[str, Any]]]]:
+        """Every page of results of a listing, following the cursor links."""
+        batches: list[list[dict[str, Any]]] = []
+        resp = yield from self.request_plan("GET", path, query=query)
+        while True:
+            batches.append(resp.get("results", []))
+            next_link = self._next_link(resp)
+            if not next_link:
+                return batches
+            resp = yield from self.request_plan("GET", next_link)
+
+    def get_space_by_key_plan(self, key: str) -> Plan[dict[str, Any]]:
+        resp = yield from self.request_plan("GET", "/wiki/api/v2/spaces", query=self._space_query(key))
+        return self._first_space(key, resp)
+
+    def find_page_by_title_plan(self, space_id: str, title: str) -> Plan[dict[str, Any] | None]:
+        resp = yield from self.request_plan("GET", "/wiki/api/v2/pages", query=self._title_query(space_id, title))
+        return pick_by_title(resp.get("results", []), title)
+
+    def get_page_plan(
+        self, page_id: str, *, with_body: bool = True, with_labels: bool = False
+    ) -> Plan[dict[str, Any]]:
+        query = self._page_query(with_body=with_body, with_labels=with_labels)
+        return (yield from self.request_plan("GET", f"/wiki/api/v2/pages/{page_id}", query=query))
+
+    def get_page_version_plan(self, page_id: str) -> Plan[int]:
+        return page_version((yield from self.request_plan("GET", f"/wiki/api/v2/pages/{page_id}")))
+
+    def space_page_batches_plan(self, space_id: str) -> Plan[list[list[dict[str, Any]]]]:
+        return (yield from self._paged_plan("/wiki/api/v2/pages", self._space_pages_query(space_id)))
+
+    def create_page_plan(
+        self,
+        *,
+        space_id: str,
+        title: str,
+        body_html: str | StreamedStorageBody,
+        parent_id: str | None,
+    ) -> Plan[dict[str, Any]]:
+        payload = self._create_page_payload(
+            space_id=space_id,
+            title=title,
+            body_html=body_html,
+            parent_id=parent_id,
+        )
+        failures = 0
+        while True:
+            try:
+                return (yield from self.request_plan("POST", "/wiki/api/v2/pages", body=payload))
+            except Exception as exc:
+                if not is_transient_error(exc) or failures >= self.max_retries:
+                    raise
+                delay = self._retry_delay(failures, getattr(exc, "headers", None))
+            failures += 1
+            self._log_retry("POST", "/wiki/api/v2/pages", "create failed", delay, failures, self.max_retries)
+            yield _SleepOp(delay)
+            # The create may have been applied before the failure; adopt that page instead of posting a duplicate.
+            existing = yield from self.find_page_by_title_plan(space_id, title)
+            if existing is not None and existing.get("title") == title:
+                return existing
+
+    def update_page_plan(
+        self,
+        *,
+        page_id: str,
+        title: str,
+        body_html: str | StreamedStorageBody,
+        next_version: int,
+        parent_id: str | None,
+        conflicts: list[tuple[int, int]] | None = None,
+    ) -> Plan[dict[str, Any]]:
+        payload = self._update_page_payload(
+            page_id=page_id,
+            title=title,
+            body_html=body_html,
+            next_version=next_version,
+            parent_id=parent_id,
+        )
+        if conflicts is None:
+            conflicts = []
+        while True:
+            try:
+                return (yield from self.request_plan("PUT", f"/wiki/api/v2/pages/{page_id}", body=payload))
+            except ConfluenceHTTPError as exc:
+                if exc.status != 409 or len(conflicts) >= VERSION_CONFLICT_MAX_RETRIES:
+                    raise
+                remote_page = yield from self.get_page_plan(page_id, with_body=False)
+                # A retried PUT whose first attempt landed (its response lost) conflicts with itself; that is success.
+                if self._is_own_write(remote_page, payload):
+                    if self.verbose:
+                        print(f"409 on PUT page {page_id}: version {next_version} is this update", file=sys.stderr)
+                    return remote_page
+                remote_version = page_version(remote_page)
+                # A 409 that a newer remote version does not explain (e.g. a title clash) will not resolve by retrying.
+                if remote_version < next_version:
+                    raise
+            next_version = self._note_version_conflict(payload, page_id, remote_version, conflicts)
+
+    def add_labels_plan(self, page_id: str, labels: list[str]) -> Plan[None]:
+        if not labels:
+            return
+        yield from self.request_plan(
+            "POST",
+            f"/wiki/rest/api/content/{page_id}/label",
+            body=self._labels_payload(labels),
+            idempotent=True,
+        )
+
+    def remove_label_plan(self, page_id: str, name: str) -> Plan[None]:
+        try:
+            yield from self.request_plan("DELETE", f"/wiki/rest/api/content/{page_id}/label", query={"name": name})
+        except ConfluenceHTTPError as exc:
+            # Already gone, e.g. removed by a retried attempt or another editor.
+            if exc.status != 404:
+                raise
+
+    def get_page_labels_plan(self, page_id: str) -> Plan[list[dict[str, Any]]]:
+        batches = yield from self._paged_plan(f"/wiki/api/v2/pages/{page_id}/labels", {"limit": 250})
+        return [label for batch in batches for label in batch]
+
+    def sync_labels_plan(
+        self, page: dict[str, Any], labels: list[str], *, prune: Iterable[str] = ()
+    ) -> Plan[tuple[list[str], list[str]]]:
+        """Add the labels `page` lacks and remove those in `prune` it no longer declares; returns both lists."""
+        page_id = str(page["id"])
+        current = self._included_labels(page)
+        if current is None:
+            current = yield from self.get_page_labels_plan(page_id)
+        added, removed = label_changes(labels, current, prune=prune)
+        yield from self.add_labels_plan(page_id, added)
+        for name in removed:
+            yield from self.remove_label_plan(page_id, name)
+        return added, removed
+
+    def upload_attachment_bytes_plan(
+        self,
+        *,
+        page_id: str,
+        filename: str,
+        data: bytes,
+        content_type: str,
+        attachment_index: AttachmentIndex | None = None,
+    ) -> Plan[dict[str, Any]]:
+        if attachment_index is not None:
+            existing = attachment_index.get(filename)
+        else:
+            existing = yield from self.find_attachment_by_filename_plan(page_id=page_id, filename=filename)
+        if existing and self.attachment_is_current(existing, data):
+            self._note_attachment(uploaded=False, size=len(data))
+            return existing
+        failures = 0
+        while True:
+            target, body, headers = self._build_attachment_upload(
+                page_id=page_id,
+                filename=filename,
+                data=data,
+                content_type=content_type,
+                existing=existing,
+            )
+            try:
+                resp = yield from self.send_plan(
+                    "POST", target, body=body, headers=headers, timeout=60, idempotent=False
+                )
+                uploaded = self._decode_attachment_upload(resp)
+                self._note_attachment(uploaded=True, size=len(data))
+                return uploaded
+            except Exception as exc:
+                if not is_transient_error(exc) or failures >= self.max_retries:
+                    raise
+                delay = self._retry_delay(failures, getattr(exc, "headers", None))
+            failures += 1
+            self._log_retry("POST", target, "upload failed", delay, failures, self.max_retries)
+            yield _SleepOp(delay)
+            # The upload may have landed before the failure; only resend when the page still lacks these bytes.
+            existing = yield from self.find_attachment_by_filename_plan(page_id=page_id, filename=filename)
+            if self.attachment_is_current(existing, data):
+                self._note_attachment(uploaded=True, size=len(data))
+                return existing
+
+    def list_attachments_plan(self, page_id: str) -> Plan[AttachmentIndex]:
+        index = AttachmentIndex()
+        batches = yield from self._paged_plan(
+            f"/wiki/rest/api/content/{page_id}/child/attachment", self._attachment_listing_query()
+        )
+        for batch in batches:
+            index.add_batch(batch)
+        return index
+
+    def find_attachment_by_filename_plan(self, *, page_id: str, filename: str) -> Plan[dict[str, Any] | None]:
+        resp = yield from self.request_plan(
             "GET",
             f"/wiki/rest/api/content/{page_id}/child/attachment",
-            query={"filename": filename, "limit": 5},
+            query=self._attachment_query(filename),
         )
-        results = resp.get("results", [])
-        for row in results:
-            if row.get("title") == filename:
-                return row
-        return results[0] if results else None
+        return pick_by_title(resp.get("results", []), filename)
+
+
+class ConfluenceClient(_ConfluenceApi):
+    """Blocking engine: performs the operations of request plans on a thread-safe connection pool."""
+
+    def __init__(
+        self,
+        site: str,
+        email: str,
+        api_token: str,
+        *,
+        verbose: bool = False,
+        pool_size: int = 8,
+        rate_limit: float = 20,
+        retries: int = 3,
+        trace: PublishTrace | None = None,
+        metrics: PublishMetrics | None = None,
+    ) -> None:
+        super().__init__(site, email, api_token, verbose=verbose, retries=retries, trace=trace, metrics=metrics)
+        self.pool = HTTPConnectionPool(self.site, scheme=self.scheme, max_idle=pool_size)
+        self.scheduler = RateLimitScheduler(rate=rate_limit, max_in_flight=pool_size)
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def run(self, plan: Plan[T]) -> T:
+        """Drive `plan` to completion, feeding it the result (or exception) of each operation it yields."""
+        result: Any = None
+        error: BaseException | None = None
+        while True:
+            try:
+                op = plan.send(result) if error is None else plan.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                result = self._perform(op)
+            except BaseException as exc:
+                error = exc
+
+    def _perform(self, op: Any) -> Any:
+        if isinstance(op, _HttpOp):
+            return self.pool.request(
+                op.method, op.target, body=op.body, headers=op.headers, timeout=op.timeout, idempotent=op.idempotent
+            )
+        if isinstance(op, _AcquireOp):
+            return self.scheduler.acquire()
+        if isinstance(op, _SleepOp):
+            return time.sleep(op.seconds)
+        if isinstance(op, _OffloadOp):
+            return op.func(*op.args, **op.kwargs)
+        if isinstance(op, _GatherOp):
+            workers = max(1, min(len(op.plans), op.limit))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plan") as executor:
+                # Each sub-plan runs in a copy of this context so --profile attributes its requests to the document.
+                futures = [executor.submit(contextvars.copy_context().run, self.run, plan) for plan in op.plans]
+                return [future.result() for future in futures]
+        if isinstance(op, _ExclusiveOp):
+            with op.lock.thread_lock:
+                return self.run(op.plan)
+        raise TypeError(f"unsupported plan operation: {op!r}")
+
+    def get_space_by_key(self, key: str) -> dict[str, Any]:
+        return self.run(self.get_space_by_key_plan(key))
+
+    def find_page_by_title(self, space_id: str, title: str) -> dict[str, Any] | None:
+        return self.run(self.find_page_by_title_plan(space_id, title))
+
+    def get_page(self, page_id: str, *, with_body: bool = True, with_labels: bool = False) -> dict[str, Any]:
+        return self.run(self.get_page_plan(page_id, with_body=with_body, with_labels=with_labels))
+
+    def get_page_version(self, page_id: str) -> int:
+        return self.run(self.get_page_version_plan(page_id))
+
+    def create_page(self, **kwargs: Any) -> dict[str, Any]:
+        return self.run(self.create_page_plan(**kwargs))
+
+    def update_page(self, **kwargs: Any) -> dict[str, Any]:
+        return self.run(self.update_page_plan(**kwargs))
+
+    def add_labels(self, page_id: str, labels: list[str]) -> None:
+        self.run(self.add_labels_plan(page_id, labels))
+
+    def remove_label(self, page_id: str, name: str) -> None:
+        self.run(self.remove_label_plan(page_id, name))
+
+    def get_page_labels(self, page_id: str) -> list[dict[str, Any]]:
+        return self.run(self.get_page_labels_plan(page_id))
+
+    def sync_labels(
+        self, page: dict[str, Any], labels: list[str], *, prune: Iterable[str] = ()
+    ) -> tuple[list[str], list[str]]:
+        return self.run(self.sync_labels_plan(page, labels, prune=prune))
+
+    def upload_attachment_bytes(self, **kwargs: Any) -> dict[str, Any]:
+        return self.run(self.upload_attachment_bytes_plan(**kwargs))
+
+    def list_attachments(self, page_id: str) -> AttachmentIndex:
+        return self.run(self.list_attachments_plan(page_id))
+
+    def find_attachment_by_filename(self, *, page_id: str, filename: str) -> dict[str, Any] | None:
+        return self.run(self.find_attachment_by_filename_plan(page_id=page_id, filename=filename))
+
+
+class AsyncConfluenceClient(_ConfluenceApi):
+    """asyncio engine: performs the same request plans as ConfluenceClient, with the methods as coroutines."""
+
+    def __init__(
+        self,
+        site: str,
+        email: str,
+        api_token: str,
+        *,
+        verbose: bool = False,
+        pool_size: int = 32,
+        rate_limit: float = 20,
+        retries: int = 3,
+        trace: PublishTrace | None = None,
+        metrics: PublishMetrics | None = None,
+    ) -> None:
+        super().__init__(site, email, api_token, verbose=verbose, retries=retries, trace=trace, metrics=metrics)
+        self.pool = AsyncHTTPConnectionPool(self.site, scheme=self.scheme, max_idle=pool_size)
+        self.scheduler = RateLimitScheduler(rate=rate_limit, max_in_flight=pool_size)
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    async def run(self, plan: Plan[T]) -> T:
+        """Drive `plan` to completion, feeding it the result (or exception) of each operation it yields."""
+        result: Any = None
+        error: BaseException | None = None
+        while True:
+            try:
+                op = plan.send(result) if error is None else plan.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                result = await self._perform(op)
+            except BaseException as exc:
+                error = exc
+
+    async def _perform(self, op: Any) -> Any:
+        if isinstance(op, _HttpOp):
+            return await self.pool.request(
+                op.method, op.target, body=op.body, headers=op.headers, timeout=op.timeout, idempotent=op.idempotent
+            )
+        if isinstance(op, _AcquireOp):
+            return await self.scheduler.acquire_async()
+        if isinstance(op, _SleepOp):
+            return await asyncio.sleep(op.seconds)
+        if isinstance(op, _OffloadOp):
+            # Conversion may run pandoc and rendering shells out to mmdc; keep both off the event loop.
+            return await asyncio.to_thread(op.func, *op.args, **op.kwargs)
+        if isinstance(op, _GatherOp):
+            semaphore = asyncio.Semaphore(op.limit)
+
+            async def run_limited(plan: Plan[Any]) -> Any:
+                async with semaphore:
+                    return await self.run(plan)
+
+            return list(await asyncio.gather(*(run_limited(plan) for plan in op.plans)))
+        if isinstance(op, _ExclusiveOp):
+            async with op.lock.asyncio_lock():
+                return await self.run(op.plan)
+        raise TypeError(f"unsupported plan operation: {op!r}")
+
+    async def get_space_by_key(self, key: str) -> dict[str, Any]:
+        return await self.run(self.get_space_by_key_plan(key))
+
+    async def find_page_by_title(self, space_id: str, title: str) -> dict[str, Any] | None:
+        return await self.run(self.find_page_by_title_plan(space_id, title))
+
+    async def get_page(self, page_id: str, *, with_body: bool = True, with_labels: bool = False) -> dict[str, Any]:
+        return await self.run(self.get_page_plan(page_id, with_body=with_body, with_labels=with_labels))
+
+    async def get_page_version(self, page_id: str) -> int:
+        return await self.run(self.get_page_version_plan(page_id))
+
+    async def create_page(self, **kwargs: Any) -> dict[str, Any]:
+        return await self.run(self.create_page_plan(**kwargs))
+
+    async def update_page(self, **kwargs: Any) -> dict[str, Any]:
+        return await self.run(self.update_page_plan(**kwargs))
+
+    async def add_labels(self, page_id: str, labels: list[str]) -> None:
+        await self.run(self.add_labels_plan(page_id, labels))
+
+    async def remove_label(self, page_id: str, name: str) -> None:
+        await self.run(self.remove_label_plan(page_id, name))
+
+    async def get_page_labels(self, page_id: str) -> list[dict[str, Any]]:
+        return await self.run(self.get_page_labels_plan(page_id))
+
+    async def sync_labels(
+        self, page: dict[str, Any], labels: list[str], *, prune: Iterable[str] = ()
+    ) -> tuple[list[str], list[str]]:
+        return await self.run(self.sync_labels_plan(page, labels, prune=prune))
+
+    async def upload_attachment_bytes(self, **kwargs: Any) -> dict[str, Any]:
+        return await self.run(self.upload_attachment_bytes_plan(**kwargs))
+
+    async def list_attachments(self, page_id: str) -> AttachmentIndex:
+        return await self.run(self.list_attachments_plan(page_id))
+
+    async def find_attachment_by_filename(self, *, page_id: str, filename: str) -> dict[str, Any] | None:
+        return await self.run(self.find_attachment_by_filename_plan(page_id=page_id, filename=filename))
+
+
+def default_cache_dir() -> Path:
+    base = os.getenv("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "codex-confluence-publisher"
+
+
+class DiskCache:
+    """Content-addressed file cache capped at max_bytes; file mtime is the LRU clock."""
+
+    def __init__(self, directory: Path, *, max_bytes: int, suffix: str = "") -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.evictions = 0
+        self._size: int | None = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}{self.suffix}"
+
+    def contains(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        try:
+            replaced = path.stat().st_size
+        except OSError:
+            replaced = 0
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> list[tuple[Path, int, float]]:
+        entries: list[tuple[Path, int, float]] = []
+        for path in self.directory.glob(f"*/*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        # Trim to 90% of the cap so a full cache does not rescan on every put.
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._size = total
+
+
+@functools.lru_cache(maxsize=None)
+def mmdc_renderer_id() -> str | None:
+    mmdc = shutil.which("mmdc")
+    if not mmdc:
+        return None
+    try:
+        proc = subprocess.run([mmdc, "--version"], capture_output=True, text=True, timeout=30)
+        version = proc.stdout.strip() or "unknown"
+    except Exception:
+        version = "unknown"
+    return f"mmdc:{version}"
+
+
+MERMAID_INK_RENDERER_ID = "mermaid.ink"
+# A diagram no renderer could draw is remembered this long, so each publish (or --watch save) does not wait on
+# mmdc and mermaid.ink again; short enough that installing mmdc or regaining network is picked up soon.
+MERMAID_FAILURE_TTL = 600.0
+_MERMAID_FAILURE_MARKER = b"mermaid-render-failed "
+
+
+def normalize_mermaid_source(mermaid_source: str) -> str:
+    lines = [line.rstrip() for line in mermaid_source.replace("\r\n", "\n").split("\n")]
+    return "\n".join(lines).strip("\n")
+
+
+class MermaidSvgCache:
+    """Rendered SVGs keyed by normalized Mermaid source plus the renderer that produced them."""
+
+    def __init__(self, directory: Path, *, max_bytes: int) -> None:
+        self.store = DiskCache(directory, max_bytes=max_bytes, suffix=".svg")
+        self.hits = 0
+        self.failed_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(mermaid_source: str, renderer_id: str) -> str:
+        material = f"{renderer_id}\0{normalize_mermaid_source(mermaid_source)}"
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _renderer_ids() -> list[str]:
+        # Renderers in the order render_mermaid_svg_uncached tries them.
+        return [rid for rid in (mmdc_renderer_id(), MERMAID_INK_RENDERER_ID) if rid]
+
+    def lookup(self, mermaid_source: str) -> bytes | None:
+        """Cached SVG, the placeholder for a recent failed render, or None when the diagram must be rendered."""
+        for renderer_id in self._renderer_ids():
+            data = self.store.get(self.key(mermaid_source, renderer_id))
+            if data and data.startswith(_MERMAID_FAILURE_MARKER):
+                try:
+                    failed_at = float(data[len(_MERMAID_FAILURE_MARKER) :])
+                except ValueError:
+                    failed_at = 0.0
+                if time.time() - failed_at < MERMAID_FAILURE_TTL:
+                    with self._lock:
+                        self.hits += 1
+                        self.failed_hits += 1
+                    return mermaid_placeholder_svg(mermaid_source)
+            elif data:
+                with self._lock:
+                    self.hits += 1
+                return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def save(self, mermaid_source: str, data: bytes, *, renderer_id: str) -> None:
+        self.store.put(self.key(mermaid_source, renderer_id), data)
+
+    def save_failure(self, mermaid_source: str) -> None:
+        """Remember that no renderer could draw this diagram, under the key a successful render would use first."""
+        renderer_id = self._renderer_ids()[0]
+        self.store.put(self.key(mermaid_source, renderer_id), _MERMAID_FAILURE_MARKER + str(time.time()).encode())
+
+    def summary(self) -> str:
+        failed = f" ({self.failed_hits} failed render(s))" if self.failed_hits else ""
+        return (
+            f"Mermaid cache: {self.hits} hit(s){failed}, {self.misses} miss(es), {self.store.evictions} eviction(s)"
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def python_markdown_version() -> str | None:
+    try:
+        import markdown as markdown_lib  # type: ignore
+    except Exception:
+        return None
+    return str(getattr(markdown_lib, "__version__", "unknown"))
+
+
+def conversion_backend_id(mermaid_mode: str) -> str:
+    """Converter (and its version) that markdown_to_html() will use for this mode."""
+    if uses_pandoc(mermaid_mode):
+        if _PANDOC.available:
+            return f"pandoc:{_PANDOC.version}"
+        md_version = python_markdown_version()
+        if md_version:
+            return f"python-markdown:{md_version}"
+    return f"builtin:{engine_fingerprint()}"
+
+
+class ConversionCache:
+    """Storage HTML and Mermaid image plans keyed by the Markdown body, render options and converter."""
+
+    def __init__(self, directory: Path, *, max_bytes: int) -> None:
+        self.store = DiskCache(directory, max_bytes=max_bytes, suffix=".json")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(markdown_text: str, *, mermaid_mode: str, image_prefix: str, image_width: int) -> str:
+        mermaid_mode = mermaid_mode.lower().strip() or "code"
+        body_hash = hashlib.sha256(markdown_text.encode("utf-8")).hexdigest()
+        material = "\0".join(
+            [conversion_backend_id(mermaid_mode), mermaid_mode, image_prefix, str(image_width), body_hash]
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def contains(self, key: str) -> bool:
+        return self.store.contains(key)
+
+    def lookup(self, key: str) -> tuple[str, list[MermaidImagePlan]] | None:
+        data = self.store.get(key)
+        entry = None
+        if data:
+            try:
+                entry = json.loads(data.decode("utf-8"))
+            except ValueError:
+                entry = None
+        if not isinstance(entry, dict) or not isinstance(entry.get("html"), str):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        plans = [MermaidImagePlan(filename=name, mermaid_source=source) for name, source in entry.get("plans", [])]
+        return entry["html"], plans
+
+    def save(self, key: str, body_html: str, plans: list[MermaidImagePlan]) -> None:
+        entry = {"html": body_html, "plans": [[plan.filename, plan.mermaid_source] for plan in plans]}
+        self.store.put(key, json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+
+    def summary(self) -> str:
+        return f"Conversion cache: {self.hits} hit(s), {self.misses} miss(es), {self.store.evictions} eviction(s)"
+
+
+def render_mermaid_svg_uncached(mermaid_source: str) -> tuple[bytes, str] | None:
+    local = render_mermaid_svg_local(mermaid_source)
+    if local:
+        return local, mmdc_renderer_id() or "mmdc"
+    remote = render_mermaid_svg(mermaid_source)
+    if remote:
+        return remote.encode("utf-8"), MERMAID_INK_RENDERER_ID
+    return None
+
+
+def render_mermaid_svg_bytes(mermaid_source: str, *, cache: MermaidSvgCache | None = None) -> bytes | None:
+    if cache is not None:
+        cached = cache.lookup(mermaid_source)
+        if cached:
+            return cached
+    rendered = render_mermaid_svg_uncached(mermaid_source)
+    if rendered is None:
+        if cache is not None:
+            cache.save_failure(mermaid_source)
+        return None
+    data, renderer_id = rendered
+    if cache is not None:
+        cache.save(mermaid_source, data, renderer_id=renderer_id)
+    return data
+
+
+def render_mermaid_svgs_local_batch(mermaid_sources: list[str]) -> list[bytes | None]:
+    """Render many diagrams with a single mmdc (one headless browser) launch via its Markdown input mode."""
+    results: list[bytes | None] = [None] * len(mermaid_sources)
+    mmdc = shutil.which("mmdc")
+    if not mmdc or not mermaid_sources:
+        return results
+    try:
+        with tempfile.TemporaryDirectory(prefix="codex-mermaid-") as td:
+            in_path = Path(td) / "diagrams.md"
+            out_path = Path(td) / "rendered.md"
+            in_path.write_text(
+                "\n\n".join(f"```mermaid\n{source}\n```" for source in mermaid_sources) + "\n",
+                encoding="utf-8",
+            )
+            with _MERMAID_LOCAL_SLOTS:
+                subprocess.run(
+                    [mmdc, "-i", str(in_path), "-o", str(out_path), "-e", "svg"],
+                    capture_output=True,
+                    text=True,
+                    timeout=45 + 15 * len(mermaid_sources),
+                )
+            # mmdc writes rendered-<n>.svg per block; a bad diagram only leaves its own slot empty
+            # (or aborts the rest), and those fall back to per-diagram rendering.
+            for idx in range(len(mermaid_sources)):
+                svg_path = Path(td) / f"rendered-{idx + 1}.svg"
+                if svg_path.exists():
+                    results[idx] = svg_path.read_bytes()
+    except Exception:
+        pass
+    return results
+
+
+def mermaid_placeholder_svg(mermaid_source: str) -> bytes:
+    return (
+        "<svg xmlns='http://www.w3.org/2000/svg' width='960' height='180'>"
+        "<rect width='100%' height='100%' fill='#f5f5f5' stroke='#999'/>"
+        "<text x='20' y='40' font-family='monospace' font-size='18'>"
+        "Mermaid render failed. Showing source below."
+        "</text>"
+        "<text x='20' y='80' font-family='monospace' font-size='14'>"
+        + html.escape(mermaid_source[:300])
+        + "</text></svg>"
+    ).encode("utf-8")
+
+
+def render_mermaid_plans(plans: list[MermaidImagePlan], *, cache: MermaidSvgCache | None = None) -> list[bytes]:
+    svgs: list[bytes | None] = [
+        cache.lookup(plan.mermaid_source) if cache is not None else None for plan in plans
+    ]
+    pending = [idx for idx, svg in enumerate(svgs) if svg is None]
+
+    renderer_id = mmdc_renderer_id()
+    if renderer_id and len(pending) > 1:
+        batch = render_mermaid_svgs_local_batch([plans[idx].mermaid_source for idx in pending])
+        for idx, data in zip(pending, batch):
+            if data:
+                svgs[idx] = data
+                if cache is not None:
+                    cache.save(plans[idx].mermaid_source, data, renderer_id=renderer_id)
+
+    leftovers = [idx for idx in pending if svgs[idx] is None]
+    if leftovers:
+        # Per-diagram renders run in parallel; the local/remote slots bound each renderer separately.
+        with ThreadPoolExecutor(max_workers=min(len(leftovers), 8), thread_name_prefix="mermaid") as executor:
+            rendered_list = list(
+                executor.map(render_mermaid_svg_uncached, [plans[idx].mermaid_source for idx in leftovers])
+            )
+        for idx, rendered in zip(leftovers, rendered_list):
+            if rendered is None:
+                if cache is not None:
+                    cache.save_failure(plans[idx].mermaid_source)
+                continue
+            svgs[idx] = rendered[0]
+            if cache is not None:
+                cache.save(plans[idx].mermaid_source, rendered[0], renderer_id=rendered[1])
+
+    return [svg or mermaid_placeholder_svg(plan.mermaid_source) for plan, svg in zip(plans, svgs)]
+
+
+def stale_mermaid_attachments(attachment_index: AttachmentIndex, plans: list[MermaidImagePlan]) -> list[str]:
+    """Mermaid images from earlier publishes of this page that the current body no longer references."""
+    if not plans:
+        return []
+    prefix = re.sub(r"\d+\.svg$", "", plans[0].filename)
+    return [
+        name
+        for name in attachment_index.unreferenced([plan.filename for plan in plans], prefix=prefix)
+        if re.fullmatch(r"\d+\.svg", name[len(prefix) :])
+    ]
+
+
+def upload_mermaid_image_attachments_plan(
+    client: _ConfluenceApi,
+    *,
+    page_id: str,
+    plans: list[MermaidImagePlan],
+    cache: MermaidSvgCache | None = None,
+    new_page: bool = False,
+) -> Plan[list[str]]:
+    """Upload rendered diagrams and return stale Mermaid attachment names left on the page."""
+    with trace_phase("attachment_upload"):
+        attachment_index = AttachmentIndex() if new_page else (yield from client.list_attachments_plan(page_id))
+    with trace_phase("mermaid_render"):
+        svgs = yield _OffloadOp(render_mermaid_plans, (plans,), {"cache": cache})
+    uploads = [
+        client.upload_attachment_bytes_plan(
+            page_id=page_id,
+            filename=plan.filename,
+            data=svg_bytes,
+            content_type="image/svg+xml",
+            attachment_index=attachment_index,
+        )
+        for plan, svg_bytes in zip(plans, svgs)
+    ]
+    # Every upload finishes (or raises) before this returns, so update_page never references a missing file.
+    with trace_phase("attachment_upload"):
+        yield _GatherOp(uploads, ATTACHMENT_UPLOAD_CONCURRENCY)
+    return stale_mermaid_attachments(attachment_index, plans)
+
+
+def iter_markdown_lines(path: Path, *, start: int = 0) -> Iterator[str]:
+    """Lines of a file from physical line `start`, read lazily and split the way str.splitlines() splits them."""
+    with path.open(encoding="utf-8") as fh:
+        for physical in itertools.islice(fh, start, None):
+            yield from physical.splitlines()
+
+
+def parse_document_streamed(path: Path) -> Document:
+    """parse_document() for files too large to read whole: only the front matter is kept in memory."""
+    metadata: dict[str, str] = {}
+    body_start_line = 0
+    with path.open(encoding="utf-8") as fh:
+        if fh.readline() == "---\n":
+            end_idx = next((idx for idx, line in enumerate(fh, start=1) if line.strip() == "---"), None)
+            if end_idx is not None:
+                fh.seek(0)
+                metadata = parse_front_matter_fields("".join(itertools.islice(fh, 1, end_idx)))
+                body_start_line = end_idx + 1
+        fh.seek(0)
+        title = derive_title(path, itertools.islice(fh, body_start_line, None), metadata)
+
+    return Document(
+        path=path,
+        title=title,
+        body_markdown="",
+        parent_id=metadata.get("parent_id") or metadata.get("parentId"),
+        page_id=metadata.get("confluence_id") or metadata.get("page_id"),
+        labels=parse_labels(metadata.get("labels")),
+        streamed=True,
+        body_start_line=body_start_line,
+    )
+
+
+def parse_document(path: Path) -> Document:
+    if STREAM_MIN_BYTES and path.stat().st_size >= STREAM_MIN_BYTES:
+        return parse_document_streamed(path)
+    text = path.read_text(encoding="utf-8")
+    metadata, body = parse_front_matter(text)
+
+    title = derive_title(path, body, metadata)
+    parent_id = metadata.get("parent_id") or metadata.get("parentId")
+    page_id = metadata.get("confluence_id") or metadata.get("page_id")
+    labels = parse_labels(metadata.get("labels"))
+
+    return Document(
+        path=path,
+        title=title,
+        body_markdown=body,
+        parent_id=parent_id,
+        page_id=page_id,
+        labels=labels,
+    )
+
+
+@dataclass
+class PreparedDocument:
+    body_html: str | StreamedStorageBody
+    mermaid_image_plans: list[MermaidImagePlan]
+    target_parent: str | None
+    labels: list[str]
+    mermaid_image_msg: str
+    conversion_msg: str = ""
+
+
+def iter_document_html(
+    doc: Document,
+    *,
+    mermaid_mode: str,
+    mermaid_image_width: int,
+    mermaid_image_plans: list[MermaidImagePlan] | None = None,
+) -> Iterator[str]:
+    """Storage markup of a streamed document, converted with the built-in converter while its file is read."""
+    empty = True
+    for piece in iter_simple_markdown_html(
+        iter_markdown_lines(doc.path, start=doc.body_start_line),
+        mermaid_mode=mermaid_mode.lower().strip() or "code",
+        mermaid_image_prefix=doc.title,
+        mermaid_image_width=mermaid_image_width,
+        mermaid_image_plans=mermaid_image_plans,
+    ):
+        empty = False
+        yield piece
+    if empty:
+        yield "<p></p>"
+
+
+def streamed_storage_body(doc: Document, *, mermaid_mode: str, mermaid_image_width: int) -> StreamedStorageBody:
+    return StreamedStorageBody(
+        functools.partial(
+            iter_document_html,
+            doc,
+            mermaid_mode=mermaid_mode,
+            mermaid_image_width=mermaid_image_width,
+        )
+    )
+
+
+def prepare_document(
+    doc: Document,
+    *,
+    default_parent_id: str | None,
+    default_labels: list[str],
+    mermaid_mode: str,
+    mermaid_image_width: int,
+    conversion_cache: ConversionCache | None = None,
+) -> PreparedDocument:
+    with trace_phase("convert"):
+        body_html, mermaid_image_plans = convert_document(
+            doc,
+            mermaid_mode=mermaid_mode,
+            mermaid_image_width=mermaid_image_width,
+            conversion_cache=conversion_cache,
+        )
+    mermaid_image_msg = (
+        f"; mermaid images={len(mermaid_image_plans)}"
+        if mermaid_mode == "attachment" and mermaid_image_plans
+        else ""
+    )
+    conversion_msg = ""
+    backend = conversion_backend_id(mermaid_mode).split(":", 1)[0]
+    if doc.streamed and backend != "builtin":
+        # pandoc and python-markdown need the whole body in memory, which streaming exists to avoid.
+        conversion_msg = f"; streamed with the built-in converter instead of {backend}"
+    return PreparedDocument(
+        body_html=body_html,
+        mermaid_image_plans=mermaid_image_plans if mermaid_mode == "attachment" else [],
+        target_parent=doc.parent_id or default_parent_id,
+        labels=merge_labels(default_labels, doc.labels),
+        mermaid_image_msg=mermaid_image_msg,
+        conversion_msg=conversion_msg,
+    )
+
+
+def convert_document(
+    doc: Document,
+    *,
+    mermaid_mode: str,
+    mermaid_image_width: int,
+    conversion_cache: ConversionCache | None = None,
+) -> tuple[str | StreamedStorageBody, list[MermaidImagePlan]]:
+    mermaid_image_plans: list[MermaidImagePlan] = []
+    body_html: str | StreamedStorageBody
+    if doc.streamed:
+        body_html = streamed_storage_body(doc, mermaid_mode=mermaid_mode, mermaid_image_width=mermaid_image_width)
+        if mermaid_mode == "attachment":
+            # Diagrams are uploaded before the page body is sent, so collect them in a conversion pass of their own.
+            for _ in iter_document_html(
+                doc,
+                mermaid_mode=mermaid_mode,
+                mermaid_image_width=mermaid_image_width,
+                mermaid_image_plans=mermaid_image_plans,
+            ):
+                pass
+    else:
+        cache_key = ""
+        cached = None
+        expected_backend = ""
+        if conversion_cache is not None:
+            expected_backend = conversion_backend_id(mermaid_mode)
+            cache_key = conversion_cache.key(
+                doc.body_markdown,
+                mermaid_mode=mermaid_mode,
+                image_prefix=doc.title,
+                image_width=mermaid_image_width,
+            )
+            cached = conversion_cache.lookup(cache_key)
+        if cached is not None:
+            body_html, mermaid_image_plans = cached
+        else:
+            body_html, backend = convert_markdown(
+                doc.body_markdown,
+                mermaid_mode=mermaid_mode,
+                mermaid_image_prefix=doc.title,
+                mermaid_image_width=mermaid_image_width,
+                mermaid_image_plans=mermaid_image_plans,
+            )
+            # The key names the converter expected for this mode; a fallback's output (pandoc failed on this
+            # document) must not be served later as if pandoc had produced it.
+            if conversion_cache is not None and backend == expected_backend:
+                conversion_cache.save(cache_key, body_html, mermaid_image_plans)
+    return body_html, mermaid_image_plans
+
+
+class PageTitleIndex:
+    """Title -> page map for one space, fetched once with cursor pagination on first use."""
+
+    def __init__(self, space_id: str) -> None:
+        self.space_id = space_id
+        self.pages_fetched = 0
+        self.requests = 0
+        self.elapsed = 0.0
+        self._pages: dict[str, dict[str, Any]] | None = None
+        self._load_lock = EngineLock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._pages is not None
+
+    def _add_batch(self, pages: dict[str, dict[str, Any]], batch: list[dict[str, Any]]) -> None:
+        self.requests += 1
+        self.pages_fetched += len(batch)
+        for page in batch:
+            title = page.get("title")
+            if title and title not in pages:
+                pages[title] = page
+
+    def load_plan(self, client: _ConfluenceApi) -> Plan[None]:
+        """Fetch the index on first use; documents published concurrently share the one fetch."""
+        if self._pages is None:
+            yield _ExclusiveOp(self._load_lock, self._fetch_plan(client))
+
+    def _fetch_plan(self, client: _ConfluenceApi) -> Plan[None]:
+        if self._pages is not None:
+            return
+        started = time.monotonic()
+        pages: dict[str, dict[str, Any]] = {}
+        for batch in (yield from client.space_page_batches_plan(self.space_id)):
+            self._add_batch(pages, batch)
+        self.elapsed = time.monotonic() - started
+        self._pages = pages
+
+    def get(self, title: str) -> dict[str, Any] | None:
+        return (self._pages or {}).get(title)
+
+    def add(self, page: dict[str, Any]) -> None:
+        with self._load_lock.thread_lock:
+            if self._pages is not None and page.get("title"):
+                self._pages.setdefault(str(page["title"]), page)
+
+    def summary(self) -> str:
+        return f"Title index: {self.pages_fetched} page(s) in {self.requests} request(s) ({self.elapsed:.2f}s)"
+
+
+def stale_attachments_msg(stale: list[str]) -> str:
+    return f"; stale mermaid attachments={len(stale)}" if stale else ""
+
+
+def label_changes_msg(added: list[str], removed: list[str]) -> str:
+    parts = [f"+{len(added)}" if added else "", f"-{len(removed)}" if removed else ""]
+    return f"; labels {' '.join(part for part in parts if part)}" if added or removed else ""
+
+
+def version_conflicts_msg(conflicts: list[tuple[int, int]]) -> str:
+    if not conflicts:
+        return ""
+    steps = ", ".join(f"v{attempted}->v{remote + 1}" for attempted, remote in conflicts)
+    return f"; version conflicts={len(conflicts)} ({steps})"
+
+
+def page_version(page: dict[str, Any]) -> int:
+    return int(page.get("version", {}).get("number", 1))
+
+
+_CDATA_RE = re.compile(r"(<!\[CDATA\[.*?\]\]>)", re.DOTALL)
+_INTER_TAG_SPACE_RE = re.compile(r">\s+<")
+_SELF_CLOSE_RE = re.compile(r"\s*/>")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_storage_body(body_html: str) -> str:
+    """Canonicalize storage markup so cosmetic differences from Confluence's re-serialization compare equal."""
+    parts = _CDATA_RE.split(body_html.replace("\r\n", "\n").strip())
+    for i in range(0, len(parts), 2):
+        # Even slices are markup; odd slices are CDATA (code) and must keep their whitespace.
+        chunk = _INTER_TAG_SPACE_RE.sub("><", parts[i])
+        chunk = _SELF_CLOSE_RE.sub("/>", chunk)
+        chunk = chunk.replace("&quot;", '"').replace("&#39;", "'").replace("&#x27;", "'")
+        parts[i] = _WHITESPACE_RE.sub(" ", chunk)
+    return "".join(parts).strip()
+
+
+def remote_page_matches(current_page: dict[str, Any], *, title: str, prepared: PreparedDocument) -> bool:
+    if current_page.get("title") != title:
+        return False
+    if prepared.target_parent and str(current_page.get("parentId") or "") != str(prepared.target_parent):
+        return False
+    storage = current_page.get("body", {}).get("storage", {})
+    remote_body = storage.get("value")
+    if remote_body is None or isinstance(prepared.body_html, StreamedStorageBody):
+        return False
+    return normalize_storage_body(remote_body) == normalize_storage_body(prepared.body_html)
+
+
+def publish_document_plan(
+    client: _ConfluenceApi,
+    *,
+    doc: Document,
+    space_id: str,
+    default_parent_id: str | None,
+    default_labels: list[str],
+    create_if_missing: bool,
+    update_if_title_match: bool,
+    dry_run: bool,
+    mermaid_mode: str,
+    mermaid_image_width: int,
+    title_index: PageTitleIndex | None = None,
+    mermaid_cache: MermaidSvgCache | None = None,
+    conversion_cache: ConversionCache | None = None,
+    prune_labels: bool = False,
+    published_labels: list[str] | None = None,
+) -> Plan[PublishResult]:
+    """Decide and perform one document's publish; either engine runs it via client.run().
+
+    `published_labels` are the labels the last publish of this file applied (from the ledger); with
+    `prune_labels` those no longer declared are removed.
+    """
+    prepared = yield _OffloadOp(
+        prepare_document,
+        (doc,),
+        dict(
+            default_parent_id=default_parent_id,
+            default_labels=default_labels,
+            mermaid_mode=mermaid_mode,
+            mermaid_image_width=mermaid_image_width,
+            conversion_cache=conversion_cache,
+        ),
+    )
+
+    prune = (published_labels or []) if prune_labels else []
+    # Without pruning, earlier labels stay on the page and remain ours to prune later.
+    applied_labels = merge_labels(prepared.labels, [] if prune_labels else published_labels or [])
+
+    existing: dict[str, Any] | None = None
+    with trace_phase("lookup"):
+        if doc.page_id:
+            # A streamed body is never compared, so skip downloading the remote one.
+            existing = yield from client.get_page_plan(doc.page_id, with_body=not doc.streamed, with_labels=True)
+        elif update_if_title_match and title_index is not None:
+            yield from title_index.load_plan(client)
+            existing = title_index.get(doc.title)
+        elif update_if_title_match:
+            existing = yield from client.find_page_by_title_plan(space_id, doc.title)
+
+    if existing:
+        page_id = str(existing["id"])
+        if not update_if_title_match and not doc.page_id:
+            return PublishResult("skipped", page_id, doc.title, doc.path, "exists and update disabled")
+
+        with trace_phase("lookup"):
+            current_page = (
+                existing
+                if doc.page_id
+                else (yield from client.get_page_plan(page_id, with_body=not doc.streamed, with_labels=True))
+            )
+        current_version = page_version(current_page)
+        next_version = current_version + 1
+
+        if remote_page_matches(current_page, title=doc.title, prepared=prepared):
+            # Diagram bytes are not part of the body, so attachments may still need refreshing.
+            stale: list[str] = []
+            if prepared.mermaid_image_plans and not dry_run:
+                stale = yield from upload_mermaid_image_attachments_plan(
+                    client, page_id=page_id, plans=prepared.mermaid_image_plans, cache=mermaid_cache
+                )
+            added: list[str] = []
+            removed: list[str] = []
+            if (prepared.labels or prune) and not dry_run:
+                with trace_phase("labels"):
+                    added, removed = yield from client.sync_labels_plan(current_page, prepared.labels, prune=prune)
+            return PublishResult(
+                "unchanged",
+                page_id,
+                doc.title,
+                doc.path,
+                f"remote body matches; version {current_version} kept{prepared.mermaid_image_msg}"
+                f"{stale_attachments_msg(stale)}{label_changes_msg(added, removed)}",
+                version=current_version,
+                labels=applied_labels,
+            )
+
+        if dry_run:
+            return PublishResult(
+                "dry-update",
+                page_id,
+                doc.title,
+                doc.path,
+                f"would update version {current_version} -> {next_version}{prepared.mermaid_image_msg}"
+                f"{prepared.conversion_msg}",
+            )
+
+        stale = []
+        if prepared.mermaid_image_plans:
+            stale = yield from upload_mermaid_image_attachments_plan(
+                client, page_id=page_id, plans=prepared.mermaid_image_plans, cache=mermaid_cache
+            )
+
+        conflicts: list[tuple[int, int]] = []
+        with trace_phase("page_write"):
+            updated = yield from client.update_page_plan(
+                page_id=page_id,
+                title=doc.title,
+                body_html=prepared.body_html,
+                next_version=next_version,
+                parent_id=prepared.target_parent,
+                conflicts=conflicts,
+            )
+        if conflicts:
+            next_version = conflicts[-1][1] + 1
+        added, removed = [], []
+        if prepared.labels or prune:
+            # Only the difference against the labels read with the page is sent; none on a stable tree.
+            with trace_phase("labels"):
+                added, removed = yield from client.sync_labels_plan(current_page, prepared.labels, prune=prune)
+        return PublishResult(
+            "updated",
+            str(updated["id"]),
+            doc.title,
+            doc.path,
+            f"{prepared.conversion_msg}{stale_attachments_msg(stale)}{version_conflicts_msg(conflicts)}"
+            f"{label_changes_msg(added, removed)}".lstrip("; "),
+            version=next_version,
+            labels=applied_labels,
+        )
+
+    if not create_if_missing:
+        return PublishResult("skipped", None, doc.title, doc.path, "not found and create disabled")
+
+    if dry_run:
+        return PublishResult(
+            "dry-create",
+            None,
+            doc.title,
+            doc.path,
+            f"would create new page{prepared.mermaid_image_msg}{prepared.conversion_msg}",
+        )
+
+    with trace_phase("page_write"):
+        created = yield from client.create_page_plan(
+            space_id=space_id,
+            title=doc.title,
+            body_html=prepared.body_html,
+            parent_id=prepared.target_parent,
+        )
+    page_id = str(created["id"])
+    if title_index is not None:
+        title_index.add(created)
+    if prepared.mermaid_image_plans:
+        yield from upload_mermaid_image_attachments_plan(
+            client,
+            page_id=page_id,
+            plans=prepared.mermaid_image_plans,
+            cache=mermaid_cache,
+            new_page=True,
+        )
+    if prepared.labels:
+        with trace_phase("labels"):
+            yield from client.add_labels_plan(page_id, prepared.labels)
+    return PublishResult(
+        "created",
+        page_id,
+        doc.title,
+        doc.path,
+        prepared.conversion_msg.lstrip("; "),
+        version=page_version(created),
+        labels=prepared.labels,
+    )
+
+
+def publish_document(client: ConfluenceClient, **kwargs: Any) -> PublishResult:
+    return client.run(publish_document_plan(client, **kwargs))
+
+
+async def publish_document_async(client: AsyncConfluenceClient, **kwargs: Any) -> PublishResult:
+    return await client.run(publish_document_plan(client, **kwargs))
+
+
+LEDGER_FORMAT_VERSION = 1
+DEFAULT_LEDGER_PATH = ".confluence_publish_ledger.json"
+LEDGER_OPTION_KEYS = (
+    "space_id",
+    "default_parent_id",
+    "default_labels",
+    "mermaid_mode",
+    "mermaid_image_width",
+    "prune_labels",
+)
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def engine_fingerprint() -> str:
+    # Converter changes alter the generated storage body, so they must invalidate cached state.
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:16]
+
+
+def publish_options_hash(publish_kwargs: dict[str, Any]) -> str:
+    options = {key: publish_kwargs.get(key) for key in LEDGER_OPTION_KEYS}
+    options["engine"] = engine_fingerprint()
+    canonical = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class PublishLedger:
+    """Local JSON record of the source and options each file was last published with."""
+
+    def __init__(self, path: Path, *, force: bool = False) -> None:
+        self.path = path
+        self.force = force
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[str, dict[str, Any]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path.exists():
+            try:
+                raw = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                raw = {}
+            if isinstance(raw, dict) and raw.get("format") == LEDGER_FORMAT_VERSION:
+                self._entries = dict(raw.get("entries", {}))
+
+    def _key(self, source: Path) -> str:
+        resolved = source.resolve()
+        try:
+            return resolved.relative_to(self.path.resolve().parent).as_posix()
+        except ValueError:
+            return resolved.as_posix()
+
+    def lookup(self, source: Path, *, content_hash: str, options_hash: str) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._entries.get(self._key(source))
+            if (
+                not self.force
+                and entry
+                and entry.get("page_id")
+                and entry.get("content_hash") == content_hash
+                and entry.get("options_hash") == options_hash
+            ):
+                self.hits += 1
+                return dict(entry)
+            self.misses += 1
+            return None
+
+    def entry(self, source: Path) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._entries.get(self._key(source))
+            return dict(entry) if entry else None
+
+    def published_labels(self, source: Path) -> list[str]:
+        """Labels the last recorded publish of `source` put on its page."""
+        entry = self.entry(source)
+        return [str(label) for label in (entry or {}).get("labels") or []]
+
+    def rename(self, old: Path, new: Path) -> str | None:
+        """Move `old`'s entry to `new` and return its page id; the content hash is dropped so `new` is republished."""
+        with self._lock:
+            entry = self._entries.pop(self._key(old), None)
+            if not entry or not entry.get("page_id"):
+                return None
+            self._entries[self._key(new)] = {**entry, "content_hash": "", "renamed_from": self._key(old)}
+            self._dirty = True
+            return str(entry["page_id"])
+
+    def record(self, source: Path, *, content_hash: str, options_hash: str, result: PublishResult) -> None:
+        if result.action not in {"created", "updated", "unchanged"} or not result.page_id:
+            return
+        with self._lock:
+            self._entries[self._key(source)] = {
+                "content_hash": content_hash,
+                "options_hash": options_hash,
+                "page_id": result.page_id,
+                "version": result.version,
+                "title": result.title,
+                "labels": result.labels or [],
+                "published_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = {"format": LEDGER_FORMAT_VERSION, "entries": dict(sorted(self._entries.items()))}
+            self._dirty = False
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # The previous file is still whole; keep the entries pending so the next save() writes them.
+            with self._lock:
+                self._dirty = True
+            raise
+
+    def summary(self) -> str:
+        summary = f"Ledger: {self.hits} hit(s), {self.misses} miss(es)"
+        if self.hits:
+            summary += f"; {self.hits} file(s) skipped as unchanged since their last publish (--force republishes)"
+        return summary
+
+
+DEFAULT_PROFILE_PATH = ".confluence_publish_profile.json"
+PROFILE_PHASES = ("parse", "convert", "mermaid_render", "lookup", "attachment_upload", "page_write", "labels")
+# Phases that run Python code rather than wait on the network or a subprocess; --cprofile samples only these.
+PROFILE_CPU_PHASES = frozenset({"parse", "convert"})
+_ENDPOINT_ID_RE = re.compile(r"/(?:\d+|att\d+)(?=/|$)")
+
+
+def endpoint_template(target: str) -> str:
+    """Request path without the query, page and attachment ids replaced by {id}, so calls group per endpoint."""
+    return _ENDPOINT_ID_RE.sub("/{id}", target.split("?", 1)[0])
+
+
+# (trace, document record) for the document the current thread or task is publishing.
+_TRACE_DOCUMENT: contextvars.ContextVar[tuple[PublishTrace, dict[str, Any]] | None] = contextvars.ContextVar(
+    "publish_trace_document", default=None
+)
+
+
+class PublishTrace:
+    """Wall time per document and phase plus every HTTP exchange of one run, written as JSON by --profile."""
+
+    def __init__(self, path: Path, *, cprofile_path: Path | None = None) -> None:
+        self.path = path
+        self.cprofile_path = cprofile_path
+        self.started_at = datetime.now(timezone.utc)
+        # Keyed by path and batch: with --watch a file published again gets a record of its own.
+        self.documents: dict[tuple[str, int], dict[str, Any]] = {}
+        self.batches = 0
+        self.run_phases: dict[str, float] = {}
+        self.http: list[dict[str, Any]] = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        # One profiler for the whole run; CPU phases take turns on it because a profiler follows a single thread.
+        self._profiler = cProfile.Profile() if cprofile_path is not None else None
+        self._profiler_lock = threading.RLock()
+
+    def _offset(self) -> float:
+        return time.perf_counter() - self._origin
+
+    def start_batch(self) -> None:
+        """Begin publishing a new batch of files; their document() blocks get new records."""
+        with self._lock:
+            self.batches += 1
+
+    @contextlib.contextmanager
+    def document(self, path: Path) -> Iterator[dict[str, Any]]:
+        """Attribute phases and HTTP calls made inside the block (and its worker threads) to `path` in this batch."""
+        with self._lock:
+            record = self.documents.setdefault(
+                (str(path), self.batches),
+                {
+                    "path": str(path),
+                    "batch": self.batches,
+                    "start_s": self._offset(),
+                    "wall_s": 0.0,
+                    "phases": {},
+                    "http_calls": 0,
+                },
+            )
+        token = _TRACE_DOCUMENT.set((self, record))
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception as exc:
+            record["error"] = f"{type(exc).__name__}: {exc}"[:500]
+            raise
+        finally:
+            _TRACE_DOCUMENT.reset(token)
+            with self._lock:
+                record["wall_s"] += time.perf_counter() - started
+                record["end_s"] = self._offset()
+
+    @contextlib.contextmanager
+    def phase(self, name: str, record: dict[str, Any] | None = None) -> Iterator[None]:
+        """Add the block's wall time to phase `name` of `record`, or of the run when no document is given."""
+        profile = self._profiler is not None and name in PROFILE_CPU_PHASES
+        if profile:
+            self._profiler_lock.acquire()
+            self._profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile:
+                self._profiler.disable()
+                self._profiler_lock.release()
+            with self._lock:
+                phases = record["phases"] if record is not None else self.run_phases
+                phases[name] = phases.get(name, 0.0) + elapsed
+
+    def note_http(
+        self,
+        *,
+        method: str,
+        target: str,
+        status: int | None,
+        sent_bytes: int,
+        received_bytes: int,
+        latency: float,
+        error: str | None = None,
+    ) -> None:
+        current = _TRACE_DOCUMENT.get()
+        entry: dict[str, Any] = {
+            "start_s": round(self._offset() - latency, 6),
+            "method": method,
+            "endpoint": endpoint_template(target),
+            "status": status,
+            "sent_bytes": sent_bytes,
+            "received_bytes": received_bytes,
+            "latency_s": round(latency, 6),
+            "document": current[1]["path"] if current is not None else None,
+        }
+        if error:
+            entry["error"] = error
+        with self._lock:
+            self.http.append(entry)
+            if current is not None:
+                current[1]["http_calls"] += 1
+
+    def _http_summary(self) -> dict[str, dict[str, Any]]:
+        summary: dict[str, dict[str, Any]] = {}
+        for entry in self.http:
+            stats = summary.setdefault(
+                f"{entry['method']} {entry['endpoint']}",
+                {"calls": 0, "errors": 0, "latency_s": 0.0, "sent_bytes": 0, "received_bytes": 0},
+            )
+            stats["calls"] += 1
+            stats["errors"] += entry["status"] is None or entry["status"] >= 400
+            stats["latency_s"] += entry["latency_s"]
+            stats["sent_bytes"] += entry["sent_bytes"]
+            stats["received_bytes"] += entry["received_bytes"]
+        return dict(sorted(summary.items()))
+
+    def write(self) -> None:
+        with self._lock:
+            documents = sorted(self.documents.values(), key=lambda record: record["start_s"])
+            phase_totals = {name: 0.0 for name in PROFILE_PHASES}
+            for record in documents:
+                for name, seconds in record["phases"].items():
+                    phase_totals[name] = phase_totals.get(name, 0.0) + seconds
+            payload = {
+                "format": 1,
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "elapsed_s": self._offset(),
+                "engine": engine_fingerprint(),
+                "run_phases": dict(self.run_phases),
+                "phase_totals": phase_totals,
+                "http_summary": self._http_summary(),
+                "documents": documents,
+                "http": list(self.http),
+            }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(payload, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        if self._profiler is not None and self.cprofile_path is not None:
+            self.cprofile_path.parent.mkdir(parents=True, exist_ok=True)
+            self._profiler.dump_stats(str(self.cprofile_path))
+
+    def summary(self) -> str:
+        cpu = f"; cProfile stats in {self.cprofile_path}" if self._profiler is not None else ""
+        return f"Profile: {len(self.documents)} document(s), {len(self.http)} HTTP call(s) traced to {self.path}{cpu}"
+
+
+@contextlib.contextmanager
+def trace_phase(name: str) -> Iterator[None]:
+    """Time the block as phase `name` of the document being traced; a no-op unless --profile is on."""
+    current = _TRACE_DOCUMENT.get()
+    if current is None:
+        yield
+        return
+    trace, record = current
+    with trace.phase(name, record):
+        yield
+
+
+METRICS_PREFIX = "confluence_publish"
+METRICS_LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _metric_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _metric_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PublishMetrics:
+    """Run counters and HTTP latency histograms, rendered in the OpenMetrics text format."""
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self._origin = time.perf_counter()
+        self.requests: dict[tuple[str, str, str], int] = {}
+        self.sent_bytes: dict[tuple[str, str], int] = {}
+        self.received_bytes: dict[tuple[str, str], int] = {}
+        # (method, endpoint) -> per-bucket counts (not cumulative), sum of seconds
+        self.latency: dict[tuple[str, str], tuple[list[int], list[float]]] = {}
+        self.documents: dict[str, int] = {}
+        self.finished: float | None = None
+        self._sources: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, **sources: Any) -> None:
+        """Objects whose own counters are read at render time: client, mermaid_cache, conversion_cache, ledger."""
+        with self._lock:
+            self._sources.update({name: source for name, source in sources.items() if source is not None})
+
+    def observe_http(
+        self,
+        *,
+        method: str,
+        target: str,
+        status: int | None,
+        sent_bytes: int,
+        received_bytes: int,
+        latency: float,
+    ) -> None:
+        endpoint = endpoint_template(target)
+        key = (method, endpoint)
+        with self._lock:
+            request_key = (method, endpoint, str(status) if status is not None else "error")
+            self.requests[request_key] = self.requests.get(request_key, 0) + 1
+            self.sent_bytes[key] = self.sent_bytes.get(key, 0) + sent_bytes
+            self.received_bytes[key] = self.received_bytes.get(key, 0) + received_bytes
+            buckets, total = self.latency.setdefault(key, ([0] * (len(METRICS_LATENCY_BUCKETS) + 1), [0.0]))
+            buckets[bisect.bisect_left(METRICS_LATENCY_BUCKETS, latency)] += 1
+            total[0] += latency
+
+    def observe_document(self, action: str) -> None:
+        with self._lock:
+            self.documents[action] = self.documents.get(action, 0) + 1
+
+    def finish(self) -> None:
+        self.finished = time.perf_counter() - self._origin
+
+    def render(self) -> str:
+        lines: list[str] = []
+
+        def family(name: str, kind: str, help_text: str, unit: str = "") -> None:
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+            if unit:
+                lines.append(f"# UNIT {METRICS_PREFIX}_{name} {unit}")
+            lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+
+        def sample(name: str, value: float, **labels: str) -> None:
+            lines.append(f"{METRICS_PREFIX}_{name}{_metric_labels(labels)} {_metric_value(value)}")
+
+        with self._lock:
+            sources = dict(self._sources)
+            requests = sorted(self.requests.items())
+            sent = sorted(self.sent_bytes.items())
+            received = sorted(self.received_bytes.items())
+            latency = sorted((key, (list(buckets), total[0])) for key, (buckets, total) in self.latency.items())
+            documents = sorted(self.documents.items())
+
+        family("http_requests", "counter", "HTTP requests sent, by endpoint and response status.")
+        for (method, endpoint, status), count in requests:
+            sample("http_requests_total", count, method=method, endpoint=endpoint, status=status)
+
+        family("http_sent_bytes", "counter", "Request body bytes sent.", "bytes")
+        for (method, endpoint), count in sent:
+            sample("http_sent_bytes_total", count, method=method, endpoint=endpoint)
+        family("http_received_bytes", "counter", "Response body bytes received.", "bytes")
+        for (method, endpoint), count in received:
+            sample("http_received_bytes_total", count, method=method, endpoint=endpoint)
+
+        family("http_request_duration_seconds", "histogram", "HTTP request latency.", "seconds")
+        for (method, endpoint), (buckets, total) in latency:
+            cumulative = 0
+            for bound, count in zip([*map(str, METRICS_LATENCY_BUCKETS), "+Inf"], buckets):
+                cumulative += count
+                sample("http_request_duration_seconds_bucket", cumulative, method=method, endpoint=endpoint, le=bound)
+            sample("http_request_duration_seconds_count", cumulative, method=method, endpoint=endpoint)
+            sample("http_request_duration_seconds_sum", total, method=method, endpoint=endpoint)
+
+        client = sources.get("client")
+        if client is not None:
+            family("retries", "counter", "Requests replayed after a transient failure or a 429.")
+            sample("retries_total", client.retries_made, reason="transient")
+            sample("retries_total", client.scheduler.throttled, reason="rate_limited")
+            family("retry_wait_seconds", "counter", "Time spent backing off before retries.", "seconds")
+            sample("retry_wait_seconds_total", client.retry_seconds)
+            family("attachments", "counter", "Mermaid image attachments, by outcome.")
+            sample("attachments_total", client.attachments_uploaded, outcome="uploaded")
+            sample("attachments_total", client.attachments_unchanged, outcome="unchanged")
+
+        for name, help_text in (
+            ("mermaid_cache", "Mermaid SVG cache lookups, by result."),
+            ("conversion_cache", "Converted storage HTML cache lookups, by result."),
+            ("ledger", "Publish ledger lookups, by result."),
+        ):
+            source = sources.get(name)
+            if source is not None:
+                family(f"{name}_lookups", "counter", help_text)
+                sample(f"{name}_lookups_total", source.hits, result="hit")
+                sample(f"{name}_lookups_total", source.misses, result="miss")
+
+        family("documents", "counter", "Files processed, by result (created, updated, unchanged, skipped, error, ...).")
+        for action, count in documents:
+            sample("documents_total", count, action=action)
+
+        family("run_start_timestamp_seconds", "gauge", "Unix time the run started.", "seconds")
+        sample("run_start_timestamp_seconds", self.started)
+        if self.finished is not None:
+            family("run_duration_seconds", "gauge", "Wall time of the finished run.", "seconds")
+            sample("run_duration_seconds", self.finished)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path) -> None:
+        # Written beside the target and renamed, so a textfile collector never reads half a file.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(self.render(), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server: _MetricsServer
+
+    def do_GET(self) -> None:
+        if urlsplit(self.path).path not in {"/", "/metrics"}:
+            self.send_error(404)
+            return
+        data = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class _MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], metrics: PublishMetrics) -> None:
+        super().__init__(address, _MetricsHandler)
+        self.metrics = metrics
+
+
+def serve_metrics(metrics: PublishMetrics, *, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread until the returned server is shut down."""
+    server = _MetricsServer((host, port), metrics)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def ledger_hit_result(path: Path, entry: dict[str, Any]) -> PublishResult:
+    version = entry.get("version")
+    return PublishResult(
+        "unchanged",
+        str(entry["page_id"]),
+        str(entry.get("title") or path.stem),
+        path,
+        f"ledger hit; version {version}" if version else "ledger hit",
+        version=version,
+    )
+
+
+def stage_document(
+    path: Path, *, ledger: PublishLedger | None, options_hash: str, page_id: str | None = None
+) -> tuple[str, PublishResult | Document]:
+    """Return the file's content hash and either its ledger-hit result or the parsed document to publish.
+
+    `page_id` is used when the front matter names none, e.g. the page a renamed file was published to.
+    """
+    content_hash = ""
+    if ledger is not None:
+        content_hash = file_sha256(path)
+        entry = ledger.lookup(path, content_hash=content_hash, options_hash=options_hash)
+        if entry:
+            return content_hash, ledger_hit_result(path, entry)
+    with trace_phase("parse"):
+        doc = parse_document(path)
+    if page_id and not doc.page_id:
+        doc.page_id = page_id
+    return content_hash, doc
+
+
+def stage_documents(
+    paths: list[Path],
+    *,
+    ledger: PublishLedger | None,
+    options_hash: str,
+    publish_kwargs: dict[str, Any],
+    trace: PublishTrace | None = None,
+    page_ids: dict[Path, str] | None = None,
+) -> dict[Path, tuple[str, PublishResult | Document | Exception]]:
+    """Stage every path up front so the documents that need converting go through one pandoc launch."""
+    staged: dict[Path, tuple[str, PublishResult | Document | Exception]] = {}
+    for path in paths:
+        try:
+            with trace.document(path) if trace is not None else contextlib.nullcontext():
+                staged[path] = stage_document(
+                    path, ledger=ledger, options_hash=options_hash, page_id=(page_ids or {}).get(path)
+                )
+        except Exception as exc:
+            staged[path] = ("", exc)
+
+    conversion_cache: ConversionCache | None = publish_kwargs.get("conversion_cache")
+    to_convert: list[str] = []
+    for _, item in staged.values():
+        if not isinstance(item, Document) or item.streamed:
+            continue
+        if conversion_cache is not None and conversion_cache.contains(
+            conversion_cache.key(
+                item.body_markdown,
+                mermaid_mode=publish_kwargs.get("mermaid_mode", "code"),
+                image_prefix=item.title,
+                image_width=publish_kwargs.get("mermaid_image_width", 1000),
+            )
+        ):
+            continue
+        to_convert.append(item.body_markdown)
+    with trace.phase("convert_batch") if trace is not None else contextlib.nullcontext():
+        _PANDOC.prime(to_convert)
+    return staged
+
+
+def publish_paths(
+    client: ConfluenceClient,
+    paths: list[Path],
+    *,
+    concurrency: int = 1,
+    ledger: PublishLedger | None = None,
+    trace: PublishTrace | None = None,
+    page_ids: dict[Path, str] | None = None,
+    **publish_kwargs: Any,
+) -> Iterator[tuple[Path, PublishResult | None, Exception | None]]:
+    """Publish each path, yielding (path, result, error) in input order.
+
+    `page_ids` maps paths to the page to update when their front matter names none.
+    """
+    options_hash = publish_options_hash(publish_kwargs)
+    page_ids = page_ids or {}
+    if trace is not None:
+        trace.start_batch()
+    staged: dict[Path, tuple[str, PublishResult | Document | Exception]] = {}
+    if len(paths) > 1 and uses_pandoc(publish_kwargs.get("mermaid_mode", "code")) and _PANDOC.batch_available:
+        staged = stage_documents(
+            paths,
+            ledger=ledger,
+            options_hash=options_hash,
+            publish_kwargs=publish_kwargs,
+            trace=trace,
+            page_ids=page_ids,
+        )
+
+    def publish_one(path: Path) -> PublishResult:
+        content_hash, item = staged.pop(path, None) or stage_document(
+            path, ledger=ledger, options_hash=options_hash, page_id=page_ids.get(path)
+        )
+        if isinstance(item, Exception):
+            raise item
+        if isinstance(item, PublishResult):
+            return item
+        published_labels = ledger.published_labels(path) if ledger is not None else None
+        result = publish_document(client, doc=item, published_labels=published_labels, **publish_kwargs)
+        if ledger is not None and not publish_kwargs.get("dry_run"):
+            ledger.record(path, content_hash=content_hash, options_hash=options_hash, result=result)
+        return result
+
+    def run(path: Path) -> PublishResult:
+        if trace is None:
+            return publish_one(path)
+        with trace.document(path) as record:
+            result = publish_one(path)
+            record["action"] = result.action
+            return result
+
+    if concurrency <= 1:
+        for path in paths:
+            try:
+                yield path, run(path), None
+            except Exception as exc:
+                yield path, None, exc
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="publish") as executor:
+        futures = [executor.submit(run, path) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                yield path, future.result(), None
+            except Exception as exc:
+                yield path, None, exc
+
+
+async def publish_paths_async(
+    client: AsyncConfluenceClient,
+    paths: list[Path],
+    *,
+    concurrency: int = 1,
+    ledger: PublishLedger | None = None,
+    trace: PublishTrace | None = None,
+    page_ids: dict[Path, str] | None = None,
+    **publish_kwargs: Any,
+) -> list[tuple[Path, PublishResult | None, Exception | None]]:
+    """Publish paths on the running event loop, returning (path, result, error) in input order."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    options_hash = publish_options_hash(publish_kwargs)
+    page_ids = page_ids or {}
+    if trace is not None:
+        trace.start_batch()
+    staged: dict[Path, tuple[str, PublishResult | Document | Exception]] = {}
+    if len(paths) > 1 and uses_pandoc(publish_kwargs.get("mermaid_mode", "code")):
+        if await asyncio.to_thread(lambda: _PANDOC.batch_available):
+            staged = await asyncio.to_thread(
+                stage_documents,
+                paths,
+                ledger=ledger,
+                options_hash=options_hash,
+                publish_kwargs=publish_kwargs,
+                trace=trace,
+                page_ids=page_ids,
+            )
+
+    async def publish_one(path: Path) -> PublishResult:
+        content_hash, item = staged.pop(path, None) or await asyncio.to_thread(
+            stage_document, path, ledger=ledger, options_hash=options_hash, page_id=page_ids.get(path)
+        )
+        if isinstance(item, Exception):
+            raise item
+        if isinstance(item, PublishResult):
+            return item
+        published_labels = ledger.published_labels(path) if ledger is not None else None
+        result = await publish_document_async(client, doc=item, published_labels=published_labels, **publish_kwargs)
+        if ledger is not None and not publish_kwargs.get("dry_run"):
+            ledger.record(path, content_hash=content_hash, options_hash=options_hash, result=result)
+        return result
+
+    async def traced(path: Path) -> PublishResult:
+        if trace is None:
+            return await publish_one(path)
+        with trace.document(path) as record:
+            result = await publish_one(path)
+            record["action"] = result.action
+            return result
+
+    async def run(path: Path) -> tuple[Path, PublishResult | None, Exception | None]:
+        async with semaphore:
+            try:
+                return path, await traced(path), None
+            except Exception as exc:
+                return path, None, exc
+
+    return list(await asyncio.gather(*(run(path) for path in paths)))
+
+
+WATCH_POLL_INTERVAL = 1.0
+_GLOB_MAGIC_RE = re.compile(r"[*?[]")
+
+# inotify(7) event bits and flags
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def glob_signatures(pattern: str) -> dict[Path, tuple[int, int]]:
+    """(mtime_ns, size) of every regular file the glob matches."""
+    signatures: dict[Path, tuple[int, int]] = {}
+    for raw in glob.glob(pattern, recursive=True):
+        try:
+            st = os.stat(raw)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            signatures[Path(raw)] = (st.st_mtime_ns, st.st_size)
+    return signatures
+
+
+def glob_watch_root(pattern: str) -> tuple[Path, bool]:
+    """Deepest directory of the glob without wildcards, and whether files below its subdirectories can match."""
+    parts = Path(pattern).parts
+    static: list[str] = []
+    for part in parts[:-1]:
+        if _GLOB_MAGIC_RE.search(part):
+            break
+        static.append(part)
+    return (Path(*static) if static else Path(".")), len(static) < len(parts) - 1
+
+
+class InotifyWatcher:
+    """Change notifications for the directories a glob can match, from Linux inotify through libc."""
 
+    kind = "inotify"
 
-def render_mermaid_svg_bytes(mermaid_source: str) -> bytes | None:
-    local = render_mermaid_svg_local(mermaid_source)
-    if local:
-        return local
-    remote = render_mermaid_svg(mermaid_source)
-    if remote:
-        return remote.encode("utf-8")
-    return None
+    def __init__(self, root: Path, *, recursive: bool) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+        self.recursive = recursive
+        self._watches: dict[int, Path] = {}
+        try:
+            self._add_tree(root)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def _add(self, directory: Path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _INOTIFY_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            # ENOSPC here means fs.inotify.max_user_watches is exhausted.
+            raise OSError(errno, f"inotify_add_watch {directory}: {os.strerror(errno)}")
+        self._watches[wd] = directory
+
+    def _add_tree(self, root: Path) -> None:
+        self._add(root)
+        if not self.recursive:
+            return
+        for dirpath, dirnames, _ in os.walk(root):
+            # glob's ** does not descend into hidden directories either.
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            for name in dirnames:
+                self._add(Path(dirpath, name))
+
+    def wait(self, timeout: float | None) -> bool:
+        """Block up to `timeout` seconds (None: until something happens); True when a watched directory changed."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                name = data[offset + _INOTIFY_EVENT.size : offset + _INOTIFY_EVENT.size + length].rstrip(b"\0")
+                offset += _INOTIFY_EVENT.size + length
+                changed = True
+                if self.recursive and mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO) and wd in self._watches:
+                    # inotify is not recursive, so a new subdirectory needs watches of its own.
+                    with contextlib.suppress(OSError):
+                        self._add_tree(self._watches[wd] / os.fsdecode(name))
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Fallback that re-globs every second, for systems and mounts without inotify (e.g. /mnt/c under WSL)."""
+
+    kind = "polling"
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self._snapshot = glob_signatures(pattern)
+
+    def wait(self, timeout: float | None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = WATCH_POLL_INTERVAL if deadline is None else max(0.0, deadline - time.monotonic())
+            time.sleep(min(WATCH_POLL_INTERVAL, remaining))
+            current = glob_signatures(self.pattern)
+            if current != self._snapshot:
+                self._snapshot = current
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def close(self) -> None:
+        pass
 
 
-def upload_mermaid_image_attachments(
-    client: ConfluenceClient,
+def open_watcher(pattern: str, *, poll: bool = False) -> InotifyWatcher | PollingWatcher:
+    if not poll and sys.platform.startswith("linux"):
+        root, recursive = glob_watch_root(pattern)
+        try:
+            return InotifyWatcher(root, recursive=recursive)
+        except (OSError, AttributeError) as exc:
+            print(f"inotify unavailable ({exc}); polling every {WATCH_POLL_INTERVAL:g}s instead", file=sys.stderr)
+    return PollingWatcher(pattern)
+
+
+def watch_changed_files(
+    pattern: str,
+    watcher: InotifyWatcher | PollingWatcher,
     *,
-    page_id: str,
-    plans: list[MermaidImagePlan],
-) -> None:
-    for plan in plans:
-        svg_bytes = render_mermaid_svg_bytes(plan.mermaid_source)
-        if not svg_bytes:
-            svg_bytes = (
-                "<svg xmlns='http://www.w3.org/2000/svg' width='960' height='180'>"
-                "<rect width='100%' height='100%' fill='#f5f5f5' stroke='#999'/>"
-                "<text x='20' y='40' font-family='monospace' font-size='18'>"
-                "Mermaid render failed. Showing source below."
-                "</text>"
-                "<text x='20' y='80' font-family='monospace' font-size='14'>"
-                + html.escape(plan.mermaid_source[:300])
-                + "</text></svg>"
-            ).encode("utf-8")
-        client.upload_attachment_bytes(
-            page_id=page_id,
-            filename=plan.filename,
-            data=svg_bytes,
-            content_type="image/svg+xml",
-        )
+    debounce: float,
+    baseline: dict[Path, tuple[int, int]],
+) -> Iterator[list[Path]]:
+    """Yield the files matching `pattern` that are new or modified since the previous batch, once saves settle."""
+    snapshot = baseline
+    while True:
+        if not watcher.wait(None):
+            continue
+        # An editor save is often several writes and a rename; wait until the directory has been quiet for a while.
+        while watcher.wait(debounce):
+            pass
+        current = glob_signatures(pattern)
+        changed = sorted(path for path, signature in current.items() if snapshot.get(path) != signature)
+        snapshot = current
+        if changed:
+            yield changed
 
 
-def parse_document(path: Path) -> Document:
-    text = path.read_text(encoding="utf-8")
-    metadata, body = parse_front_matter(text)
+def glob_matches(pattern: str, path: Path) -> bool:
+    """Whether `path` is one the glob would match, without it having to exist (`**` spans any number of directories)."""
 
-    title = derive_title(path, body, metadata)
-    parent_id = metadata.get("parent_id") or metadata.get("parentId")
-    page_id = metadata.get("confluence_id") or metadata.get("page_id")
-    labels = parse_labels(metadata.get("labels"))
+    def match(pattern_parts: tuple[str, ...], path_parts: tuple[str, ...]) -> bool:
+        if not pattern_parts:
+            return not path_parts
+        head, rest = pattern_parts[0], pattern_parts[1:]
+        if head == "**":
+            return any(match(rest, path_parts[index:]) for index in range(len(path_parts) + 1))
+        return bool(path_parts) and fnmatch.fnmatchcase(path_parts[0], head) and match(rest, path_parts[1:])
 
-    return Document(
-        path=path,
-        title=title,
-        body_markdown=body,
-        parent_id=parent_id,
-        page_id=page_id,
-        labels=labels,
-    )
+    if os.path.isabs(pattern):
+        path = path.absolute()
+    return match(Path(os.path.normpath(pattern)).parts, Path(os.path.normpath(path)).parts)
 
 
-def publish_document(
-    client: ConfluenceClient,
-    *,
-    doc: Document,
-    space_id: str,
-    default_parent_id: str | None,
-    default_labels: list[str],
-    create_if_missing: bool,
-    update_if_title_match: bool,
-    dry_run: bool,
-    mermaid_mode: str,
-    mermaid_image_width: int,
-) -> PublishResult:
-    mermaid_image_plans: list[MermaidImagePlan] = []
-    body_html = markdown_to_html(
-        doc.body_markdown,
-        mermaid_mode=mermaid_mode,
-        mermaid_image_prefix=doc.title,
-        mermaid_image_width=mermaid_image_width,
-        mermaid_image_plans=mermaid_image_plans,
-    )
-    target_parent = doc.parent_id or default_parent_id
-    labels = merge_labels(default_labels, doc.labels)
-    mermaid_image_msg = (
-        f"; mermaid images={len(mermaid_image_plans)}"
-        if mermaid_mode == "attachment" and mermaid_image_plans
-        else ""
-    )
+@dataclass
+class GitChanges:
+    """Files that differ between a git ref and the working tree, as paths relative to the working directory."""
 
-    existing: dict[str, Any] | None = None
-    if doc.page_id:
-        existing = client.get_page(doc.page_id)
-    elif update_if_title_match:
-        existing = client.find_page_by_title(space_id, doc.title)
+    changed: list[Path]
+    renamed: dict[Path, Path]  # new path -> path at the ref
+    deleted: list[Path]
 
-    if existing:
-        page_id = str(existing["id"])
-        if not update_if_title_match and not doc.page_id:
-            return PublishResult("skipped", page_id, doc.title, doc.path, "exists and update disabled")
 
-        current_page = existing if doc.page_id else client.get_page(page_id)
-        current_version = int(current_page.get("version", {}).get("number", 1))
-        next_version = current_version + 1
+def _git(*args: str) -> str:
+    try:
+        proc = subprocess.run(["git", *args], capture_output=True, text=True, timeout=120)
+    except OSError as exc:
+        raise RuntimeError(f"git is not available: {exc}") from None
+    if proc.returncode != 0:
+        detail = proc.stderr.strip().splitlines()
+        raise RuntimeError(f"git {args[0]} failed: {detail[-1] if detail else f'exit status {proc.returncode}'}")
+    return proc.stdout
+
+
+def parse_name_status(output: str, local: Callable[[str], Path] = Path) -> GitChanges:
+    """Parse `git diff --name-status -z` output; `local` turns each repository path into a GitChanges path."""
+    fields = output.split("\0")
+    changes = GitChanges(changed=[], renamed={}, deleted=[])
+    index = 0
+    while index < len(fields) and fields[index]:
+        status = fields[index][0]
+        if status in "RC":
+            old, new = local(fields[index + 1]), local(fields[index + 2])
+            index += 3
+            changes.changed.append(new)
+            if status == "R":
+                changes.renamed[new] = old
+            continue
+        path = local(fields[index + 1])
+        index += 2
+        (changes.deleted if status == "D" else changes.changed).append(path)
+    return changes
 
-        if dry_run:
-            return PublishResult(
-                "dry-update",
-                page_id,
-                doc.title,
-                doc.path,
-                f"would update version {current_version} -> {next_version}{mermaid_image_msg}",
-            )
 
-        if mermaid_mode == "attachment" and mermaid_image_plans:
-            upload_mermaid_image_attachments(client, page_id=page_id, plans=mermaid_image_plans)
+def git_changes_since(ref: str) -> GitChanges:
+    """`git diff --name-status` from the merge base of `ref` and HEAD to the working tree, renames detected.
 
-        updated = client.update_page(
-            page_id=page_id,
-            title=doc.title,
-            body_html=body_html,
-            next_version=next_version,
-            parent_id=target_parent,
-        )
-        if labels:
-            client.add_labels(str(updated["id"]), labels)
-        return PublishResult("updated", str(updated["id"]), doc.title, doc.path)
+    Untracked files that .gitignore does not exclude count as changed too: a new page is usually written
+    (and published) before it is committed.
+    """
+    top = Path(_git("rev-parse", "--show-toplevel").strip())
+    # Diffing from the merge base leaves out commits that landed on `ref` after the branch was cut.
+    base = _git("merge-base", ref, "HEAD").strip()
 
-    if not create_if_missing:
-        return PublishResult("skipped", None, doc.title, doc.path, "not found and create disabled")
+    def local(raw: str) -> Path:
+        return Path(os.path.relpath(top / raw))
 
-    if dry_run:
-        return PublishResult(
-            "dry-create",
-            None,
-            doc.title,
-            doc.path,
-            f"would create new page{mermaid_image_msg}",
-        )
+    changes = parse_name_status(_git("diff", "--name-status", "-z", "--find-renames", base, "--"), local)
+    untracked = _git("ls-files", "--others", "--exclude-standard", "--full-name", "-z", "--", ":/")
+    changes.changed.extend(local(raw) for raw in untracked.split("\0") if raw)
+    return changes
 
-    created = client.create_page(
-        space_id=space_id,
-        title=doc.title,
-        body_html=body_html,
-        parent_id=target_parent,
-    )
-    page_id = str(created["id"])
-    if mermaid_mode == "attachment" and mermaid_image_plans:
-        upload_mermaid_image_attachments(client, page_id=page_id, plans=mermaid_image_plans)
-    if labels:
-        client.add_labels(page_id, labels)
-    return PublishResult("created", page_id, doc.title, doc.path)
+
+def deleted_file_result(path: Path, ledger: PublishLedger | None) -> PublishResult:
+    entry = ledger.entry(path) if ledger is not None else None
+    page_id = str(entry["page_id"]) if entry and entry.get("page_id") else None
+    title = str(entry.get("title") or path.stem) if entry else path.stem
+    return PublishResult("deleted", page_id, title, path, "source removed; the page is left in Confluence")
+
+
+def report_outcomes(
+    outcomes: Iterable[tuple[Path, PublishResult | None, Exception | None]],
+    *,
+    metrics: PublishMetrics | None = None,
+) -> int:
+    failures = 0
+    for path, result, error in outcomes:
+        if metrics is not None:
+            metrics.observe_document(result.action if error is None and result is not None else "error")
+        if error is not None or result is None:
+            failures += 1
+            print(f"[error] {path}: {error}", file=sys.stderr)
+            continue
+        suffix = f" ({result.message})" if result.message else ""
+        page_part = f" page_id={result.page_id}" if result.page_id else ""
+        print(f"[{result.action}] {result.path} -> \"{result.title}\"{page_part}{suffix}")
+    return failures
 
 
 def parse_args() -> argparse.Namespace:
@@ -832,6 +4134,69 @@ def parse_args() -> argparse.Namespace:
         default=None,
         help="Image width(px) when --mermaid-mode attachment (default: env CONFLUENCE_MERMAID_IMAGE_WIDTH or 1000)",
     )
+    parser.add_argument(
+        "--mermaid-cache-dir",
+        default=None,
+        help="Rendered Mermaid SVG cache directory "
+        "(default: env CONFLUENCE_MERMAID_CACHE_DIR or ~/.cache/codex-confluence-publisher/mermaid; 'off' disables)",
+    )
+    parser.add_argument(
+        "--conversion-cache-dir",
+        default=None,
+        help="Directory for converted storage HTML "
+        "(default: env CONFLUENCE_CONVERSION_CACHE_DIR or ~/.cache/codex-confluence-publisher/conversion; "
+        "'off' disables)",
+    )
+    parser.add_argument(
+        "--conversion-cache-max-mb",
+        type=int,
+        default=None,
+        help="Conversion cache size cap in MB (default: env CONFLUENCE_CONVERSION_CACHE_MAX_MB or 256)",
+    )
+    parser.add_argument(
+        "--mermaid-cache-max-mb",
+        type=int,
+        default=None,
+        help="Mermaid SVG cache size cap in MB (default: env CONFLUENCE_MERMAID_CACHE_MAX_MB or 256)",
+    )
+    parser.add_argument(
+        "--mermaid-local-concurrency",
+        type=int,
+        default=None,
+        help="Max concurrent local mmdc renders (default: env CONFLUENCE_MERMAID_LOCAL_CONCURRENCY or 2)",
+    )
+    parser.add_argument(
+        "--mermaid-remote-concurrency",
+        type=int,
+        default=None,
+        help="Max concurrent mermaid.ink renders (default: env CONFLUENCE_MERMAID_REMOTE_CONCURRENCY or 4)",
+    )
+    parser.add_argument(
+        "--upload-concurrency",
+        type=int,
+        default=None,
+        help="Max concurrent attachment uploads per page (default: env CONFLUENCE_UPLOAD_CONCURRENCY or 4)",
+    )
+    parser.add_argument(
+        "--stream-threshold-mb",
+        type=int,
+        default=None,
+        help="Convert and send files of at least this many MB as a stream; 0 disables "
+        "(default: env PUBLISH_STREAM_THRESHOLD_MB or 32)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=None,
+        help="Max Confluence requests per second; lowered automatically on 429 "
+        "(default: env CONFLUENCE_RATE_LIMIT or 20)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=None,
+        help="Retries for timeouts, dropped connections and 5xx responses (default: env CONFLUENCE_RETRIES or 3)",
+    )
     parser.add_argument(
         "--create-if-missing",
         choices=["true", "false"],
@@ -844,6 +4209,86 @@ def parse_args() -> argparse.Namespace:
         default=None,
         help="Update page when title already exists",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="Number of documents published in parallel (default: env PUBLISH_CONCURRENCY or 1)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["sync", "async"],
+        default=None,
+        help="Publish engine: thread-based sync client or asyncio client (default: env PUBLISH_ENGINE or sync)",
+    )
+    parser.add_argument(
+        "--ledger",
+        nargs="?",
+        const=DEFAULT_LEDGER_PATH,
+        default=None,
+        help="Keep a publish ledger and skip files unchanged since their last publish; off unless this flag or "
+        f"env PUBLISH_LEDGER is set (default path: {DEFAULT_LEDGER_PATH})",
+    )
+    parser.add_argument(
+        "--prefetch-titles",
+        choices=["true", "false"],
+        default=None,
+        help="Resolve existing pages from one paginated space listing instead of a title search per file",
+    )
+    parser.add_argument(
+        "--prune-labels",
+        choices=["true", "false"],
+        default=None,
+        help="Remove labels from updated pages that the front matter and default labels no longer declare",
+    )
+    parser.add_argument("--no-ledger", action="store_true", help="Do not read or write the publish ledger")
+    parser.add_argument("--force", action="store_true", help="Republish files even when the ledger says unchanged")
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=DEFAULT_PROFILE_PATH,
+        default=None,
+        help=f"Write per-document phase timings and every HTTP call as a JSON trace (default: {DEFAULT_PROFILE_PATH})",
+    )
+    parser.add_argument(
+        "--cprofile",
+        default=None,
+        help="Also dump cProfile stats of the parse and convert phases to this file (implies --profile)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Write run counters and HTTP latency histograms to this OpenMetrics text file at the end of the run",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve the same metrics at http://127.0.0.1:PORT/metrics while the run is in progress",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="After publishing, keep running and republish files matching the glob whenever they change",
+    )
+    parser.add_argument(
+        "--watch-debounce-ms",
+        type=int,
+        default=None,
+        help="With --watch, wait until files have been quiet this long before publishing (default: 500)",
+    )
+    parser.add_argument(
+        "--watch-poll",
+        choices=["true", "false"],
+        default=None,
+        help="With --watch, poll the glob every second instead of using inotify (default: false)",
+    )
+    parser.add_argument(
+        "--since",
+        default=None,
+        metavar="GIT_REF",
+        help="Publish only files matching the glob that changed since this git ref; report deleted ones",
+    )
     return parser.parse_args()
 
 
@@ -863,91 +4308,453 @@ def parse_positive_int(raw: str, *, setting_name: str, min_value: int, max_value
     return parsed
 
 
-def main() -> int:
-    args = parse_args()
-    load_dotenv(Path(args.dotenv))
+def int_setting(value: int | None, setting_name: str, default: str, *, min_value: int, max_value: int) -> int:
+    """The flag's value, else the environment variable named `setting_name`, else `default`, within the bounds."""
+    raw = str(value) if value is not None else os.getenv(setting_name, default).strip()
+    return parse_positive_int(raw, setting_name=setting_name, min_value=min_value, max_value=max_value)
 
-    site = os.getenv("ATLASSIAN_SITE", "").strip()
-    email = os.getenv("ATLASSIAN_EMAIL", "").strip()
-    token = os.getenv("ATLASSIAN_API_TOKEN", "").strip()
 
-    space_key = (args.space_key or os.getenv("CONFLUENCE_SPACE_KEY", "")).strip()
-    parent_id = (args.parent_id or os.getenv("CONFLUENCE_PARENT_ID", "")).strip() or None
-    glob_pattern = (args.glob_pattern or os.getenv("MARKDOWN_GLOB", "docs/**/*.md")).strip()
-    default_labels = parse_labels(args.default_labels or os.getenv("PUBLISH_DEFAULT_LABELS", ""))
+def cache_dir_setting(value: str | None, setting_name: str, default: Path) -> Path | None:
+    raw = (value or os.getenv(setting_name, "") or str(default)).strip()
+    return None if raw.lower() in {"off", "false", "none"} else Path(raw).expanduser()
+
+
+@dataclass
+class PublishSettings:
+    """Everything a run needs, resolved from the flags, the environment and the defaults."""
+
+    site: str
+    email: str
+    token: str
+    space_key: str
+    glob_pattern: str
+    since: str
+    engine: str
+    concurrency: int
+    rate_limit: int
+    retries: int
+    verbose: bool
+    dry_run: bool
+    watch: bool
+    watch_debounce_ms: int
+    watch_poll: bool
+    prefetch_titles: bool
+    ledger: PublishLedger | None
+    trace: PublishTrace | None
+    metrics: PublishMetrics | None
+    metrics_file: str
+    metrics_port: int | None
+    mermaid_cache: MermaidSvgCache | None
+    conversion_cache: ConversionCache | None
+    publish_kwargs: dict[str, Any]
+
+
+def resolve_settings(args: argparse.Namespace) -> PublishSettings:
+    """Resolve and validate every setting, configuring the module-wide limits; raises ValueError on a bad one."""
     mermaid_mode = (args.mermaid_mode or os.getenv("CONFLUENCE_MERMAID_MODE", "attachment")).strip().lower()
     if mermaid_mode not in {"code", "macro", "attachment"}:
-        print("CONFLUENCE_MERMAID_MODE must be 'code', 'macro', or 'attachment'", file=sys.stderr)
-        return 2
-    mermaid_image_width_raw = (
-        str(args.mermaid_image_width)
-        if args.mermaid_image_width is not None
-        else os.getenv("CONFLUENCE_MERMAID_IMAGE_WIDTH", "1000").strip()
+        raise ValueError("CONFLUENCE_MERMAID_MODE must be 'code', 'macro', or 'attachment'")
+    mermaid_image_width = int_setting(
+        args.mermaid_image_width, "CONFLUENCE_MERMAID_IMAGE_WIDTH", "1000", min_value=240, max_value=4000
     )
-    try:
-        mermaid_image_width = parse_positive_int(
-            mermaid_image_width_raw,
-            setting_name="CONFLUENCE_MERMAID_IMAGE_WIDTH",
-            min_value=240,
-            max_value=4000,
+
+    mermaid_cache_max_mb = int_setting(
+        args.mermaid_cache_max_mb, "CONFLUENCE_MERMAID_CACHE_MAX_MB", "256", min_value=1, max_value=102400
+    )
+    mermaid_cache_dir = cache_dir_setting(
+        args.mermaid_cache_dir, "CONFLUENCE_MERMAID_CACHE_DIR", default_cache_dir() / "mermaid"
+    )
+    mermaid_cache: MermaidSvgCache | None = None
+    if mermaid_mode == "attachment" and mermaid_cache_dir is not None:
+        mermaid_cache = MermaidSvgCache(mermaid_cache_dir, max_bytes=mermaid_cache_max_mb * 1024 * 1024)
+
+    conversion_cache_max_mb = int_setting(
+        args.conversion_cache_max_mb, "CONFLUENCE_CONVERSION_CACHE_MAX_MB", "256", min_value=1, max_value=102400
+    )
+    conversion_cache_dir = cache_dir_setting(
+        args.conversion_cache_dir, "CONFLUENCE_CONVERSION_CACHE_DIR", default_cache_dir() / "conversion"
+    )
+    conversion_cache: ConversionCache | None = None
+    if conversion_cache_dir is not None:
+        conversion_cache = ConversionCache(conversion_cache_dir, max_bytes=conversion_cache_max_mb * 1024 * 1024)
+
+    configure_mermaid_concurrency(
+        local_renders=int_setting(
+            args.mermaid_local_concurrency, "CONFLUENCE_MERMAID_LOCAL_CONCURRENCY", "2", min_value=1, max_value=32
+        ),
+        remote_renders=int_setting(
+            args.mermaid_remote_concurrency, "CONFLUENCE_MERMAID_REMOTE_CONCURRENCY", "4", min_value=1, max_value=32
+        ),
+        uploads=int_setting(args.upload_concurrency, "CONFLUENCE_UPLOAD_CONCURRENCY", "4", min_value=1, max_value=32),
+    )
+    stream_threshold_mb = int_setting(
+        args.stream_threshold_mb, "PUBLISH_STREAM_THRESHOLD_MB", "32", min_value=0, max_value=1 << 20
+    )
+    configure_streaming(min_bytes=stream_threshold_mb * 1024 * 1024)
+
+    concurrency = int_setting(args.concurrency, "PUBLISH_CONCURRENCY", "1", min_value=1, max_value=64)
+    rate_limit = int_setting(args.rate_limit, "CONFLUENCE_RATE_LIMIT", "20", min_value=1, max_value=1000)
+    retries = int_setting(args.retries, "CONFLUENCE_RETRIES", "3", min_value=0, max_value=10)
+
+    engine = (args.engine or os.getenv("PUBLISH_ENGINE", "sync")).strip().lower()
+    if engine not in {"sync", "async"}:
+        raise ValueError("PUBLISH_ENGINE must be 'sync' or 'async'")
+
+    ledger_raw = (args.ledger or os.getenv("PUBLISH_LEDGER", "")).strip()
+    ledger: PublishLedger | None = None
+    if not args.no_ledger and ledger_raw.lower() not in {"", "off", "false", "none"}:
+        ledger = PublishLedger(Path(ledger_raw).expanduser(), force=args.force)
+
+    profile_raw = (args.profile or os.getenv("PUBLISH_PROFILE", "")).strip()
+    cprofile_raw = (args.cprofile or os.getenv("PUBLISH_CPROFILE", "")).strip()
+    trace: PublishTrace | None = None
+    if profile_raw.lower() in {"off", "false", "none"}:
+        profile_raw = ""
+    if profile_raw or cprofile_raw:
+        trace = PublishTrace(
+            Path(profile_raw or DEFAULT_PROFILE_PATH).expanduser(),
+            cprofile_path=Path(cprofile_raw).expanduser() if cprofile_raw else None,
         )
-    except ValueError as exc:
-        print(str(exc), file=sys.stderr)
-        return 2
 
-    create_if_missing = bool_arg(args.create_if_missing, "PUBLISH_CREATE_IF_MISSING", True)
-    update_if_title_match = bool_arg(args.update_if_title_match, "PUBLISH_UPDATE_IF_TITLE_MATCH", True)
+    metrics_file = (args.metrics_file or os.getenv("PUBLISH_METRICS_FILE", "")).strip()
+    metrics_port: int | None = None
+    if args.metrics_port is not None or os.getenv("PUBLISH_METRICS_PORT", "").strip():
+        metrics_port = int_setting(args.metrics_port, "PUBLISH_METRICS_PORT", "", min_value=1, max_value=65535)
+    metrics = PublishMetrics() if metrics_file or metrics_port is not None else None
+
+    watch_debounce_ms = int_setting(
+        args.watch_debounce_ms, "PUBLISH_WATCH_DEBOUNCE_MS", "500", min_value=0, max_value=60000
+    )
+    if args.watch and engine != "sync":
+        raise ValueError("--watch runs on the sync engine, which keeps one client warm; drop --engine async")
+
+    prune_labels = bool_arg(args.prune_labels, "PUBLISH_PRUNE_LABELS", False)
+    if prune_labels and ledger is None:
+        print(
+            "Warning: --prune-labels only removes labels the --ledger recorded from earlier publishes; "
+            "without a ledger no label is removed",
+            file=sys.stderr,
+        )
+
+    settings = PublishSettings(
+        site=os.getenv("ATLASSIAN_SITE", "").strip(),
+        email=os.getenv("ATLASSIAN_EMAIL", "").strip(),
+        token=os.getenv("ATLASSIAN_API_TOKEN", "").strip(),
+        space_key=(args.space_key or os.getenv("CONFLUENCE_SPACE_KEY", "")).strip(),
+        glob_pattern=(args.glob_pattern or os.getenv("MARKDOWN_GLOB", "docs/**/*.md")).strip(),
+        since=(args.since or os.getenv("PUBLISH_SINCE", "")).strip(),
+        engine=engine,
+        concurrency=concurrency,
+        rate_limit=rate_limit,
+        retries=retries,
+        verbose=args.verbose,
+        dry_run=args.dry_run,
+        watch=args.watch,
+        watch_debounce_ms=watch_debounce_ms,
+        watch_poll=bool_arg(args.watch_poll, "PUBLISH_WATCH_POLL", False),
+        prefetch_titles=bool_arg(args.prefetch_titles, "PUBLISH_PREFETCH_TITLES", False),
+        ledger=ledger,
+        trace=trace,
+        metrics=metrics,
+        metrics_file=metrics_file,
+        metrics_port=metrics_port,
+        mermaid_cache=mermaid_cache,
+        conversion_cache=conversion_cache,
+        publish_kwargs={
+            "default_parent_id": (args.parent_id or os.getenv("CONFLUENCE_PARENT_ID", "")).strip() or None,
+            "default_labels": parse_labels(args.default_labels or os.getenv("PUBLISH_DEFAULT_LABELS", "")),
+            "create_if_missing": bool_arg(args.create_if_missing, "PUBLISH_CREATE_IF_MISSING", True),
+            "update_if_title_match": bool_arg(args.update_if_title_match, "PUBLISH_UPDATE_IF_TITLE_MATCH", True),
+            "dry_run": args.dry_run,
+            "mermaid_mode": mermaid_mode,
+            "mermaid_image_width": mermaid_image_width,
+            "ledger": ledger,
+            "trace": trace,
+            "mermaid_cache": mermaid_cache,
+            "conversion_cache": conversion_cache,
+            "prune_labels": prune_labels,
+        },
+    )
 
     missing = [
         name
         for name, value in [
-            ("ATLASSIAN_SITE", site),
-            ("ATLASSIAN_EMAIL", email),
-            ("ATLASSIAN_API_TOKEN", token),
-            ("CONFLUENCE_SPACE_KEY", space_key),
+            ("ATLASSIAN_SITE", settings.site),
+            ("ATLASSIAN_EMAIL", settings.email),
+            ("ATLASSIAN_API_TOKEN", settings.token),
+            ("CONFLUENCE_SPACE_KEY", settings.space_key),
         ]
         if not value
     ]
     if missing:
-        print(f"Missing required settings: {', '.join(missing)}", file=sys.stderr)
-        return 2
+        raise ValueError(f"Missing required settings: {', '.join(missing)}")
+    return settings
+
+
+@dataclass
+class PublishSelection:
+    """The files a run publishes, and what --since found about the others."""
+
+    paths: list[Path]
+    matched_count: int
+    page_ids: dict[Path, str] = field(default_factory=dict)
+    deleted_outcomes: list[tuple[Path, PublishResult | None, Exception | None]] = field(default_factory=list)
 
+
+def select_paths(settings: PublishSettings) -> PublishSelection:
+    """Expand the glob and, with --since, keep only the changed files; raises RuntimeError when git fails."""
+    glob_pattern, ledger = settings.glob_pattern, settings.ledger
     paths = sorted(Path(p) for p in glob.glob(glob_pattern, recursive=True) if Path(p).is_file())
-    if not paths:
-        print(f"No markdown files matched: {glob_pattern}")
-        return 0
+    selection = PublishSelection(paths, matched_count=len(paths))
+    if not settings.since:
+        return selection
+
+    changes = git_changes_since(settings.since)
+    changed = {path.resolve() for path in changes.changed}
+    selection.paths = [path for path in paths if path.resolve() in changed]
+    selected = {path.resolve(): path for path in selection.paths}
+    # A file renamed out of the glob is gone as far as this run is concerned.
+    gone = changes.deleted + [old for new, old in changes.renamed.items() if new.resolve() not in selected]
+    for new, old in changes.renamed.items():
+        path = selected.get(new.resolve())
+        if path is None:
+            continue
+        if ledger is None:
+            print(
+                f"Warning: {old} was renamed to {path}; without --ledger its page is found by title, "
+                "so a changed title creates a new page",
+                file=sys.stderr,
+            )
+            continue
+        # Keep updating the page the old path was published to instead of matching by the (new) title.
+        page_id = (ledger.entry(old) or {}).get("page_id") if settings.dry_run else ledger.rename(old, path)
+        if page_id:
+            selection.page_ids[path] = str(page_id)
+    selection.deleted_outcomes = [
+        (path, deleted_file_result(path, ledger), None) for path in gone if glob_matches(glob_pattern, path)
+    ]
+    return selection
 
-    client = ConfluenceClient(site, email, token, verbose=args.verbose)
-    space = client.get_space_by_key(space_key)
-    space_id = str(space["id"])
 
-    print(f"Space: {space_key} (id={space_id})")
-    print(f"Files: {len(paths)}")
-    if args.dry_run:
+def print_run_header(settings: PublishSettings, selection: PublishSelection, space_id: str) -> None:
+    print(f"Space: {settings.space_key} (id={space_id})")
+    print(f"Files: {len(selection.paths)}")
+    if settings.since:
+        print(
+            f"Since: {settings.since} ({len(selection.paths)} of {selection.matched_count} matched file(s) changed, "
+            f"{len(selection.deleted_outcomes)} deleted)"
+        )
+    if settings.dry_run:
         print("Mode: dry-run")
+    if settings.engine != "sync":
+        print(f"Engine: {settings.engine}")
+    if settings.concurrency > 1:
+        print(f"Concurrency: {settings.concurrency}")
+
+
+def print_run_summary(
+    settings: PublishSettings, client: _ConfluenceApi, title_index: PageTitleIndex | None
+) -> None:
+    if title_index is not None and title_index.loaded:
+        print(title_index.summary())
+    mermaid_cache, conversion_cache = settings.mermaid_cache, settings.conversion_cache
+    if mermaid_cache is not None and mermaid_cache.hits + mermaid_cache.misses:
+        print(mermaid_cache.summary())
+    if conversion_cache is not None and conversion_cache.hits + conversion_cache.misses:
+        print(conversion_cache.summary())
+    if _PANDOC.batched:
+        print(_PANDOC.summary())
+    if client.attachments_uploaded or client.attachments_unchanged:
+        print(client.attachment_summary())
+    rate_limit_summary = client.rate_limit_summary()
+    if rate_limit_summary:
+        print(rate_limit_summary)
+    if client.retries_made:
+        print(client.retry_summary())
+    print(client.connection_summary())
+
+
+async def publish_async(settings: PublishSettings, selection: PublishSelection) -> int:
+    """Publish the selection on the async engine; returns the number of failed files."""
+    client = AsyncConfluenceClient(
+        settings.site,
+        settings.email,
+        settings.token,
+        verbose=settings.verbose,
+        pool_size=max(32, settings.concurrency * ATTACHMENT_UPLOAD_CONCURRENCY),
+        rate_limit=settings.rate_limit,
+        retries=settings.retries,
+        trace=settings.trace,
+        metrics=settings.metrics,
+    )
+    try:
+        space = await client.get_space_by_key(settings.space_key)
+        space_id = str(space["id"])
+        print_run_header(settings, selection, space_id)
+        title_index = PageTitleIndex(space_id) if settings.prefetch_titles else None
+        outcomes = await publish_paths_async(
+            client,
+            selection.paths,
+            concurrency=settings.concurrency,
+            space_id=space_id,
+            title_index=title_index,
+            page_ids=selection.page_ids,
+            **settings.publish_kwargs,
+        )
+    finally:
+        await client.close()
+    failures = report_outcomes(outcomes + selection.deleted_outcomes, metrics=settings.metrics)
+    print_run_summary(settings, client, title_index)
+    return failures
+
+
+def publish_sync(settings: PublishSettings, selection: PublishSelection) -> int:
+    """Publish the selection on the sync engine, then keep watching with --watch; returns the failed file count."""
+    client = ConfluenceClient(
+        settings.site,
+        settings.email,
+        settings.token,
+        verbose=settings.verbose,
+        pool_size=max(8, settings.concurrency * ATTACHMENT_UPLOAD_CONCURRENCY),
+        rate_limit=settings.rate_limit,
+        retries=settings.retries,
+        trace=settings.trace,
+        metrics=settings.metrics,
+    )
+    watcher: InotifyWatcher | PollingWatcher | None = None
+    try:
+        space = client.get_space_by_key(settings.space_key)
+        space_id = str(space["id"])
+        print_run_header(settings, selection, space_id)
+        title_index = PageTitleIndex(space_id) if settings.prefetch_titles else None
+        # Watch from before the first pass so saves made while it runs are picked up afterwards.
+        watcher = open_watcher(settings.glob_pattern, poll=settings.watch_poll) if settings.watch else None
+        baseline = glob_signatures(settings.glob_pattern) if watcher is not None else {}
+        failures = report_outcomes(
+            itertools.chain(
+                publish_paths(
+                    client,
+                    selection.paths,
+                    concurrency=settings.concurrency,
+                    space_id=space_id,
+                    title_index=title_index,
+                    page_ids=selection.page_ids,
+                    **settings.publish_kwargs,
+                ),
+                selection.deleted_outcomes,
+            ),
+            metrics=settings.metrics,
+        )
+        print_run_summary(settings, client, title_index)
+        if watcher is not None:
+            failures += watch_and_publish(
+                settings, client, watcher, space_id=space_id, title_index=title_index, baseline=baseline
+            )
+    finally:
+        if watcher is not None:
+            watcher.close()
+        client.close()
+    return failures
+
 
+def watch_and_publish(
+    settings: PublishSettings,
+    client: ConfluenceClient,
+    watcher: InotifyWatcher | PollingWatcher,
+    *,
+    space_id: str,
+    title_index: PageTitleIndex | None,
+    baseline: dict[Path, tuple[int, int]],
+) -> int:
+    """Republish each batch of changed files until Ctrl+C or SIGTERM; returns the failed file count.
+
+    The caller owns `watcher` and closes it.
+    """
+    # Service managers stop with SIGTERM; end the watch the same way Ctrl+C does.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"Watching {settings.glob_pattern} ({watcher.kind}); press Ctrl+C to stop", flush=True)
     failures = 0
-    for path in paths:
-        try:
-            doc = parse_document(path)
-            result = publish_document(
-                client,
-                doc=doc,
-                space_id=space_id,
-                default_parent_id=parent_id,
-                default_labels=default_labels,
-                create_if_missing=create_if_missing,
-                update_if_title_match=update_if_title_match,
-                dry_run=args.dry_run,
-                mermaid_mode=mermaid_mode,
-                mermaid_image_width=mermaid_image_width,
+    try:
+        for changed in watch_changed_files(
+            settings.glob_pattern, watcher, debounce=settings.watch_debounce_ms / 1000, baseline=baseline
+        ):
+            print(f"Changed: {len(changed)} file(s)")
+            failures += report_outcomes(
+                publish_paths(
+                    client,
+                    changed,
+                    concurrency=settings.concurrency,
+                    space_id=space_id,
+                    title_index=title_index,
+                    **settings.publish_kwargs,
+                ),
+                metrics=settings.metrics,
             )
-            suffix = f" ({result.message})" if result.message else ""
-            page_part = f" page_id={result.page_id}" if result.page_id else ""
-            print(f"[{result.action}] {result.path} -> \"{result.title}\"{page_part}{suffix}")
-        except Exception as exc:
-            failures += 1
-            print(f"[error] {path}: {exc}", file=sys.stderr)
+            if settings.ledger is not None:
+                settings.ledger.save()
+            if settings.metrics is not None and settings.metrics_file:
+                settings.metrics.write(Path(settings.metrics_file).expanduser())
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        print("Watch stopped.")
+        print_run_summary(settings, client, title_index)
+    return failures
+
+
+def main() -> int:
+    args = parse_args()
+    load_dotenv(Path(args.dotenv))
+    try:
+        settings = resolve_settings(args)
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        return 2
+
+    try:
+        selection = select_paths(settings)
+    except RuntimeError as exc:
+        print(f"--since {settings.since}: {exc}", file=sys.stderr)
+        return 2
+    if not selection.paths and not settings.watch:
+        if settings.since:
+            report_outcomes(selection.deleted_outcomes)
+            print(f"No markdown files changed since {settings.since}: {settings.glob_pattern}")
+        else:
+            print(f"No markdown files matched: {settings.glob_pattern}")
+        return 0
+
+    ledger, trace, metrics = settings.ledger, settings.trace, settings.metrics
+    metrics_server: ThreadingHTTPServer | None = None
+    if metrics is not None:
+        metrics.attach(mermaid_cache=settings.mermaid_cache, conversion_cache=settings.conversion_cache, ledger=ledger)
+        if settings.metrics_port is not None:
+            try:
+                metrics_server = serve_metrics(metrics, port=settings.metrics_port)
+            except OSError as exc:
+                print(f"Cannot serve metrics on port {settings.metrics_port}: {exc}", file=sys.stderr)
+                return 2
+
+    try:
+        if settings.engine == "async":
+            failures = asyncio.run(publish_async(settings, selection))
+        else:
+            failures = publish_sync(settings, selection)
+    finally:
+        if ledger is not None:
+            ledger.save()
+        if trace is not None:
+            trace.write()
+        if metrics is not None:
+            metrics.finish()
+            if settings.metrics_file:
+                metrics.write(Path(settings.metrics_file).expanduser())
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+    if ledger is not None:
+        print(ledger.summary())
+    if trace is not None:
+        print(trace.summary())
 
     if failures:
         print(f"Completed with {failures} failed file(s).", file=sys.stderr)
@@ -0,0 +1,88 @@
+"""Shared fixtures for the tests: the scripts/ import path and an in-process Confluence stand-in.
+
+Run the suite from the repository root with: python -m unittest discover -s tests
+"""
+
+from __future__ import annotations
+
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1] / "scripts"
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+import confluence_publish as cp  # noqa: E402
+from confluence_standin import Faults, HTTPFailure, StandinServer  # noqa: E402
+
+
+class StandinTestCase(unittest.TestCase):
+    """A stand-in server on a free port, a sync client pointed at it and a scratch directory for documents."""
+
+    def setUp(self) -> None:
+        self.server = StandinServer(("127.0.0.1", 0), Faults())
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.state = self.server.state
+
+        patcher = mock.patch.object(cp, "RETRY_BASE_DELAY", 0.001)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client = cp.ConfluenceClient(self.server.url, "user@example.com", "token", rate_limit=1000, retries=3)
+        self.addCleanup(self.client.close)
+        self.space_id = str(self.client.get_space_by_key("DOCS")["id"])
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp_dir = Path(tmp.name)
+        self.doc_path = self.tmp_dir / "guide.md"
+
+    def fail_next(self, *failures: HTTPFailure) -> None:
+        """Answer the next requests with these failures, in order, before serving normally again."""
+        queue = list(failures)
+        check_faults = self.state.check_faults
+
+        def scripted() -> None:
+            if queue:
+                raise queue.pop(0)
+            check_faults()
+
+        patcher = mock.patch.object(self.state, "check_faults", scripted)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_doc(self, body: str, path: Path | None = None) -> Path:
+        path = path or self.doc_path
+        path.write_text(f"---\nlabels: guide\n---\n# {path.stem.title()}\n\n{body}\n", encoding="utf-8")
+        return path
+
+    def publish_options(self, **overrides: Any) -> dict[str, Any]:
+        options: dict[str, Any] = dict(
+            space_id=self.space_id,
+            default_parent_id=None,
+            default_labels=[],
+            create_if_missing=True,
+            update_if_title_match=True,
+            dry_run=False,
+            mermaid_mode="code",
+            mermaid_image_width=1000,
+        )
+        options.update(overrides)
+        return options
+
+    def publish(self, body: str, **overrides: Any) -> cp.PublishResult:
+        doc = cp.parse_document(self.write_doc(body))
+        return cp.publish_document(self.client, doc=doc, **self.publish_options(**overrides))
+
+    def page(self, page_id: str) -> dict[str, Any]:
+        return self.state.pages[page_id]
+
+    def request_count(self) -> int:
+        return int(self.state.stats()["requests"])
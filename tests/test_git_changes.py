@@ -0,0 +1,88 @@
+"""Tests for --since: parsing git's name-status output and collecting the files changed since a ref."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from support import cp
+
+
+class ParseNameStatusTest(unittest.TestCase):
+    def test_modified_added_and_deleted(self) -> None:
+        changes = cp.parse_name_status("M\0docs/a.md\0A\0docs/b.md\0D\0docs/c.md\0")
+        self.assertEqual(changes.changed, [Path("docs/a.md"), Path("docs/b.md")])
+        self.assertEqual(changes.deleted, [Path("docs/c.md")])
+        self.assertEqual(changes.renamed, {})
+
+    def test_rename_maps_new_path_to_old(self) -> None:
+        changes = cp.parse_name_status("R097\0docs/old name.md\0docs/sub/new.md\0")
+        self.assertEqual(changes.changed, [Path("docs/sub/new.md")])
+        self.assertEqual(changes.renamed, {Path("docs/sub/new.md"): Path("docs/old name.md")})
+        self.assertEqual(changes.deleted, [])
+
+    def test_copy_is_a_change_not_a_rename(self) -> None:
+        changes = cp.parse_name_status("C100\0docs/a.md\0docs/b.md\0")
+        self.assertEqual(changes.changed, [Path("docs/b.md")])
+        self.assertEqual(changes.renamed, {})
+
+    def test_paths_go_through_local(self) -> None:
+        changes = cp.parse_name_status("M\0a.md\0", lambda raw: Path("top") / raw)
+        self.assertEqual(changes.changed, [Path("top/a.md")])
+
+    def test_empty_output(self) -> None:
+        changes = cp.parse_name_status("")
+        self.assertEqual((changes.changed, changes.renamed, changes.deleted), ([], {}, []))
+
+
+@unittest.skipUnless(shutil.which("git"), "git is not installed")
+class GitChangesSinceTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.repo = Path(tmp.name)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.repo)
+        self.git("init", "-q")
+        (self.repo / ".gitignore").write_text("docs/ignored.md\n", encoding="utf-8")
+        (self.repo / "docs").mkdir()
+        for name in ("kept.md", "edited.md", "old.md", "gone.md"):
+            (self.repo / "docs" / name).write_text(f"# {name}\n\nbody of {name}\n", encoding="utf-8")
+        self.git("add", ".")
+        self.git("commit", "-qm", "base")
+
+    def git(self, *args: str) -> None:
+        env = dict(os.environ, GIT_AUTHOR_NAME="t", GIT_AUTHOR_EMAIL="t@example.com")
+        env.update(GIT_COMMITTER_NAME="t", GIT_COMMITTER_EMAIL="t@example.com")
+        subprocess.run(["git", *args], cwd=self.repo, env=env, check=True, capture_output=True)
+
+    def test_changes_renames_deletions_and_untracked_files(self) -> None:
+        self.git("mv", "docs/old.md", "docs/new.md")
+        self.git("rm", "-q", "docs/gone.md")
+        (self.repo / "docs" / "edited.md").write_text("# edited\n\nchanged\n", encoding="utf-8")
+        (self.repo / "docs" / "draft.md").write_text("# draft\n", encoding="utf-8")
+        (self.repo / "docs" / "ignored.md").write_text("# ignored\n", encoding="utf-8")
+
+        changes = cp.git_changes_since("HEAD")
+        self.assertEqual(
+            sorted(changes.changed), [Path("docs/draft.md"), Path("docs/edited.md"), Path("docs/new.md")]
+        )
+        self.assertEqual(changes.renamed, {Path("docs/new.md"): Path("docs/old.md")})
+        self.assertEqual(changes.deleted, [Path("docs/gone.md")])
+
+    def test_paths_are_relative_to_the_working_directory(self) -> None:
+        (self.repo / "docs" / "draft.md").write_text("# draft\n", encoding="utf-8")
+        os.chdir(self.repo / "docs")
+        self.assertEqual(cp.git_changes_since("HEAD").changed, [Path("draft.md")])
+
+    def test_unknown_ref_raises(self) -> None:
+        with self.assertRaises(RuntimeError):
+            cp.git_changes_since("no-such-ref")
+
+
+if __name__ == "__main__":
+    unittest.main()
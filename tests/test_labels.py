@@ -0,0 +1,31 @@
+"""Tests for label diffing: which labels a publish adds and, with --prune-labels, removes."""
+
+from __future__ import annotations
+
+import unittest
+
+from support import cp
+
+
+class LabelChangesTest(unittest.TestCase):
+    def test_adds_only_missing_labels_case_insensitively(self) -> None:
+        current = [{"prefix": "global", "name": "Docs"}]
+        self.assertEqual(cp.label_changes(["docs", "api"], current), (["api"], []))
+
+    def test_ignores_labels_with_other_prefixes(self) -> None:
+        current = [{"prefix": "my", "name": "api"}]
+        self.assertEqual(cp.label_changes(["api"], current, prune=["api"]), (["api"], []))
+
+    def test_prunes_only_labels_an_earlier_publish_applied(self) -> None:
+        current = [{"prefix": "global", "name": name} for name in ("keep", "old", "manual")]
+        added, removed = cp.label_changes(["keep", "new"], current, prune=["keep", "old"])
+        self.assertEqual(added, ["new"])
+        self.assertEqual(removed, ["old"])
+
+    def test_nothing_is_removed_without_prune(self) -> None:
+        current = [{"prefix": "global", "name": "old"}]
+        self.assertEqual(cp.label_changes([], current), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""Tests for the publish ledger: skipping unchanged files, what gets recorded, renames and saving."""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+from support import StandinTestCase, cp
+from confluence_standin import HTTPFailure
+
+
+class PublishLedgerTest(StandinTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.ledger_path = self.tmp_dir / "ledger.json"
+        self.ledger = cp.PublishLedger(self.ledger_path)
+
+    def run_paths(self, paths: list[Path], ledger: cp.PublishLedger | None = None, **overrides: Any) -> list[Any]:
+        options = self.publish_options(**overrides)
+        return list(cp.publish_paths(self.client, paths, ledger=ledger or self.ledger, **options))
+
+    def result(self, action: str, page_id: str | None = "42") -> cp.PublishResult:
+        return cp.PublishResult(action, page_id, "Guide", self.doc_path, version=3)
+
+    def test_hit_skips_the_file_without_a_request(self) -> None:
+        path = self.write_doc("body")
+        [(_, first, error)] = self.run_paths([path])
+        self.assertIsNone(error)
+        self.assertEqual(first.action, "created")
+
+        before = self.request_count()
+        [(_, second, error)] = self.run_paths([path])
+        self.assertIsNone(error)
+        self.assertEqual((second.action, second.page_id, second.version), ("unchanged", first.page_id, 1))
+        self.assertIn("ledger hit", second.message)
+        self.assertEqual(self.request_count(), before)
+        self.assertEqual((self.ledger.hits, self.ledger.misses), (1, 1))
+
+    def test_content_or_options_change_is_a_miss(self) -> None:
+        self.ledger.record(self.doc_path, content_hash="a", options_hash="o", result=self.result("created"))
+        self.assertIsNotNone(self.ledger.lookup(self.doc_path, content_hash="a", options_hash="o"))
+        self.assertIsNone(self.ledger.lookup(self.doc_path, content_hash="b", options_hash="o"))
+        self.assertIsNone(self.ledger.lookup(self.doc_path, content_hash="a", options_hash="p"))
+        self.assertEqual((self.ledger.hits, self.ledger.misses), (1, 2))
+
+    def test_options_hash_follows_publish_settings(self) -> None:
+        options = self.publish_options()
+        self.assertEqual(cp.publish_options_hash(options), cp.publish_options_hash(dict(options)))
+        baseline = cp.publish_options_hash(options)
+        self.assertNotEqual(baseline, cp.publish_options_hash({**options, "mermaid_mode": "macro"}))
+        self.assertNotEqual(baseline, cp.publish_options_hash({**options, "prune_labels": True}))
+
+    def test_force_bypasses_the_lookup(self) -> None:
+        path = self.write_doc("body")
+        self.run_paths([path])
+        self.ledger.save()
+
+        forced = cp.PublishLedger(self.ledger_path, force=True)
+        before = self.request_count()
+        [(_, result, error)] = self.run_paths([path], ledger=forced)
+        self.assertIsNone(error)
+        self.assertEqual(result.action, "unchanged")
+        self.assertNotIn("ledger hit", result.message)
+        self.assertGreater(self.request_count(), before)
+        self.assertEqual((forced.hits, forced.misses), (0, 1))
+
+    def test_record_ignores_dry_run_and_failed_results(self) -> None:
+        for action in ("dry-create", "dry-update", "skipped", "deleted"):
+            self.ledger.record(self.doc_path, content_hash="a", options_hash="o", result=self.result(action))
+        self.ledger.record(self.doc_path, content_hash="a", options_hash="o", result=self.result("updated", None))
+        self.assertIsNone(self.ledger.entry(self.doc_path))
+
+    def test_dry_run_and_errors_leave_the_ledger_empty(self) -> None:
+        path = self.write_doc("body")
+        [(_, result, _)] = self.run_paths([path], dry_run=True)
+        self.assertEqual(result.action, "dry-create")
+
+        self.fail_next(*[HTTPFailure(500, "Injected server error")] * 8)
+        [(_, result, error)] = self.run_paths([path])
+        self.assertIsNone(result)
+        self.assertIsInstance(error, cp.ConfluenceHTTPError)
+        self.assertIsNone(self.ledger.entry(path))
+
+    def test_record_keeps_page_version_and_labels(self) -> None:
+        path = self.write_doc("body")
+        [(_, result, _)] = self.run_paths([path])
+        entry = self.ledger.entry(path)
+        self.assertEqual(entry["page_id"], result.page_id)
+        self.assertEqual(entry["version"], 1)
+        self.assertEqual(entry["labels"], ["guide"])
+        self.assertEqual(entry["content_hash"], cp.file_sha256(path))
+
+    def test_rename_moves_the_entry_and_clears_the_hash(self) -> None:
+        old, new = self.tmp_dir / "old.md", self.tmp_dir / "sub" / "new.md"
+        self.ledger.record(old, content_hash="a", options_hash="o", result=self.result("created"))
+        self.assertEqual(self.ledger.rename(old, new), "42")
+        self.assertIsNone(self.ledger.entry(old))
+        entry = self.ledger.entry(new)
+        self.assertEqual((entry["page_id"], entry["content_hash"], entry["renamed_from"]), ("42", "", "old.md"))
+        self.assertIsNone(self.ledger.lookup(new, content_hash="a", options_hash="o"))
+        self.assertIsNone(self.ledger.rename(old, new))
+
+    def test_save_round_trips(self) -> None:
+        self.ledger.record(self.doc_path, content_hash="a", options_hash="o", result=self.result("created"))
+        self.ledger.save()
+        raw = json.loads(self.ledger_path.read_text(encoding="utf-8"))
+        self.assertEqual(raw["format"], cp.LEDGER_FORMAT_VERSION)
+        self.assertEqual(list(raw["entries"]), ["guide.md"])
+        self.assertEqual(cp.PublishLedger(self.ledger_path).entry(self.doc_path)["page_id"], "42")
+
+    def test_save_replaces_the_file_atomically(self) -> None:
+        self.ledger.record(self.doc_path, content_hash="a", options_hash="o", result=self.result("created"))
+        self.ledger.save()
+        saved = self.ledger_path.read_bytes()
+
+        self.ledger.record(self.doc_path, content_hash="b", options_hash="o", result=self.result("updated"))
+        with mock.patch.object(cp.os, "replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.ledger.save()
+        # The failed save left the previous ledger whole and keeps the entry pending for the next save.
+        self.assertEqual(self.ledger_path.read_bytes(), saved)
+
+        self.ledger.save()
+        self.assertEqual(sorted(p.name for p in self.tmp_dir.iterdir()), ["ledger.json"])
+        self.assertEqual(cp.PublishLedger(self.ledger_path).entry(self.doc_path)["content_hash"], "b")
+
+    def test_unreadable_ledger_starts_empty(self) -> None:
+        self.ledger_path.write_text("{not json", encoding="utf-8")
+        self.assertIsNone(cp.PublishLedger(self.ledger_path).entry(self.doc_path))
@@ -0,0 +1,85 @@
+"""Tests for the command-line entry point: settings resolution and cleanup when a run fails."""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from support import cp
+
+ENV = {
+    "ATLASSIAN_SITE": "http://127.0.0.1:9",
+    "ATLASSIAN_EMAIL": "user@example.com",
+    "ATLASSIAN_API_TOKEN": "token",
+    "CONFLUENCE_SPACE_KEY": "DOCS",
+}
+
+
+def resolve(*argv: str, env: dict[str, str] | None = None) -> cp.PublishSettings:
+    args = ["confluence_publish.py", "--dotenv", os.devnull, "--conversion-cache-dir", "off", *argv]
+    with mock.patch.object(sys, "argv", args), mock.patch.dict(os.environ, env if env is not None else ENV):
+        return cp.resolve_settings(cp.parse_args())
+
+
+class ResolveSettingsTest(unittest.TestCase):
+    def test_flags_override_the_environment(self) -> None:
+        settings = resolve("--concurrency", "4", env={**ENV, "PUBLISH_CONCURRENCY": "2"})
+        self.assertEqual(settings.concurrency, 4)
+        self.assertEqual(settings.space_key, "DOCS")
+        self.assertIsNone(settings.ledger)
+        self.assertIsNone(settings.conversion_cache)
+        self.assertEqual(settings.publish_kwargs["mermaid_mode"], "attachment")
+
+    def test_environment_fallbacks(self) -> None:
+        settings = resolve(env={**ENV, "PUBLISH_CONCURRENCY": "3", "PUBLISH_LEDGER": "ledger.json"})
+        self.assertEqual(settings.concurrency, 3)
+        self.assertEqual(settings.ledger.path, Path("ledger.json"))
+
+    def test_invalid_settings_raise_value_error(self) -> None:
+        for argv, env, message in [
+            (("--concurrency", "0"), ENV, "PUBLISH_CONCURRENCY must be between 1 and 64"),
+            ((), {**ENV, "CONFLUENCE_MERMAID_MODE": "svg"}, "CONFLUENCE_MERMAID_MODE must be"),
+            (("--watch", "--engine", "async"), ENV, "--watch runs on the sync engine"),
+            ((), {"ATLASSIAN_SITE": "http://x"}, "Missing required settings: ATLASSIAN_EMAIL"),
+        ]:
+            with self.subTest(argv=argv), self.assertRaisesRegex(ValueError, message):
+                resolve(*argv, env=env)
+
+
+class PublishSyncCleanupTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = mock.Mock(spec=cp.ConfluenceClient)
+        self.client.get_space_by_key.return_value = {"id": "1"}
+        patcher = mock.patch.object(cp, "ConfluenceClient", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.selection = cp.PublishSelection(paths=[Path("doc.md")], matched_count=1)
+
+    def publish(self, settings: cp.PublishSettings) -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cp.publish_sync(settings, self.selection)
+
+    def test_client_is_closed_when_the_space_lookup_fails(self) -> None:
+        self.client.get_space_by_key.side_effect = cp.ConfluenceHTTPError("space not found", status=404)
+        with self.assertRaises(cp.ConfluenceHTTPError):
+            self.publish(resolve())
+        self.client.close.assert_called_once_with()
+
+    def test_client_and_watcher_are_closed_when_the_first_pass_fails(self) -> None:
+        watcher = mock.Mock(spec=cp.PollingWatcher)
+        with mock.patch.object(cp, "open_watcher", return_value=watcher), mock.patch.object(
+            cp, "glob_signatures", return_value={}
+        ), mock.patch.object(cp, "publish_paths", side_effect=OSError("disk gone")):
+            with self.assertRaises(OSError):
+                self.publish(resolve("--watch"))
+        watcher.close.assert_called_once_with()
+        self.client.close.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Tests for publishing one document: create, update, and keeping the version when the remote body matches."""
+
+from __future__ import annotations
+
+import unittest
+
+from support import StandinTestCase, cp
+
+
+class PublishDocumentTest(StandinTestCase):
+    def test_create_update_and_unchanged(self) -> None:
+        created = self.publish("first")
+        self.assertEqual(created.action, "created")
+        self.assertEqual(created.version, 1)
+        self.assertEqual(sorted(self.state.labels[created.page_id]), ["guide"])
+
+        updated = self.publish("second")
+        self.assertEqual((updated.action, updated.page_id, updated.version), ("updated", created.page_id, 2))
+        self.assertIn("second", self.page(created.page_id)["body"])
+
+        unchanged = self.publish("second")
+        self.assertEqual((unchanged.action, unchanged.version), ("unchanged", 2))
+        self.assertEqual(self.page(created.page_id)["version"]["number"], 2)
+        self.assertEqual(self.state.requests["PUT /wiki/api/v2/pages/{id}"], 1)
+
+    def test_reserialized_remote_body_is_unchanged(self) -> None:
+        page_id = self.publish("first\n\n- a\n- b").page_id
+        # Confluence stores the body with its own line breaks and indentation.
+        page = self.page(page_id)
+        reserialized = page["body"].replace("\n", "\r\n  ")
+        self.assertNotEqual(reserialized, page["body"])
+        page["body"] = reserialized
+        result = self.publish("first\n\n- a\n- b")
+        self.assertEqual((result.action, result.version), ("unchanged", 1))
+
+    def test_title_change_is_an_update(self) -> None:
+        page_id = self.publish("first").page_id
+        self.page(page_id)["title"] = "Renamed in Confluence"
+        self.doc_path.write_text(f"---\nconfluence_id: {page_id}\n---\n# Guide\n\nfirst\n", encoding="utf-8")
+        result = cp.publish_document(self.client, doc=cp.parse_document(self.doc_path), **self.publish_options())
+        self.assertEqual((result.action, result.version), ("updated", 2))
+        self.assertEqual(self.page(page_id)["title"], "Guide")
+
+    def test_dry_run_writes_nothing(self) -> None:
+        result = self.publish("first", dry_run=True)
+        self.assertEqual(result.action, "dry-create")
+        self.assertEqual(self.state.pages, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
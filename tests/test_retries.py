@@ -0,0 +1,50 @@
+"""Tests for retrying throttled and failed requests against the stand-in."""
+
+from __future__ import annotations
+
+import unittest
+
+from support import StandinTestCase, cp
+from confluence_standin import HTTPFailure
+
+
+class RateLimitRetryTest(StandinTestCase):
+    def test_throttled_request_is_retried(self) -> None:
+        self.fail_next(HTTPFailure(429, "Rate limit exceeded", {"Retry-After": "0"}))
+        result = self.publish("first")
+        self.assertEqual(result.action, "created")
+        self.assertEqual(self.client.scheduler.throttled, 1)
+
+    def test_throttling_beyond_the_retry_budget_fails(self) -> None:
+        throttled = HTTPFailure(429, "Rate limit exceeded", {"Retry-After": "0"})
+        self.fail_next(*[throttled] * (cp.RATE_LIMIT_MAX_RETRIES + 1))
+        with self.assertRaises(cp.ConfluenceHTTPError) as caught:
+            self.publish("first")
+        self.assertEqual(caught.exception.status, 429)
+        self.assertEqual(self.state.pages, {})
+
+
+class TransientErrorRetryTest(StandinTestCase):
+    def test_server_errors_are_retried(self) -> None:
+        self.fail_next(HTTPFailure(503, "Injected server error"), HTTPFailure(502, "Injected server error"))
+        result = self.publish("first")
+        self.assertEqual(result.action, "created")
+        self.assertEqual(self.client.retries_made, 2)
+
+    def test_server_errors_beyond_the_retry_budget_fail(self) -> None:
+        self.fail_next(*[HTTPFailure(500, "Injected server error")] * 4)
+        with self.assertRaises(cp.ConfluenceHTTPError) as caught:
+            self.publish("first")
+        self.assertEqual(caught.exception.status, 500)
+        self.assertEqual(self.state.pages, {})
+
+    def test_client_errors_are_not_retried(self) -> None:
+        self.fail_next(HTTPFailure(400, "Bad request"))
+        with self.assertRaises(cp.ConfluenceHTTPError) as caught:
+            self.publish("first")
+        self.assertEqual(caught.exception.status, 400)
+        self.assertEqual(self.client.retries_made, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
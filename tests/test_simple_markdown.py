@@ -0,0 +1,59 @@
+"""Tests for the built-in Markdown converter (simple_markdown_to_html)."""
+
+from __future__ import annotations
+
+import unittest
+
+from support import cp
+
+
+class SimpleMarkdownTest(unittest.TestCase):
+    def test_blocks_and_inline_markup(self) -> None:
+        html_out = cp.simple_markdown_to_html("# Title\n\nSome **bold** and `code` <x>\n\n- one\n* *two*\n")
+        self.assertEqual(
+            html_out,
+            "<h1>Title</h1>\n"
+            "<p>Some <strong>bold</strong> and <code>code</code> &lt;x&gt;</p>\n"
+            "<ul>\n<li>one</li>\n<li><em>two</em></li>\n</ul>",
+        )
+
+    def test_fenced_code_becomes_a_code_macro(self) -> None:
+        html_out = cp.simple_markdown_to_html("```python\nif a < b:\n    pass\n```\n")
+        self.assertEqual(
+            html_out,
+            '<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">python</ac:parameter>'
+            "<ac:plain-text-body><![CDATA[if a < b:\n    pass]]></ac:plain-text-body></ac:structured-macro>",
+        )
+
+    def test_unclosed_fence_runs_to_the_end(self) -> None:
+        self.assertIn("<![CDATA[tail]]>", cp.simple_markdown_to_html("```\ntail"))
+
+    def test_pipe_table_with_alignment_and_escaped_pipe(self) -> None:
+        html_out = cp.simple_markdown_to_html("| a | b |\n|:---|---:|\n| x \\| y | z |\nafter\n")
+        self.assertEqual(
+            html_out,
+            '<table><thead><tr><th style="text-align:left;">a</th><th style="text-align:right;">b</th></tr></thead>'
+            '<tbody><tr><td style="text-align:left;">x | y</td><td style="text-align:right;">z</td></tr></tbody>'
+            "</table>\n<p>after</p>",
+        )
+
+    def test_short_separator_is_not_a_table(self) -> None:
+        self.assertNotIn("<table>", cp.simple_markdown_to_html("| a | b |\n|:--|--:|\n"))
+
+    def test_mermaid_attachment_mode_collects_plans(self) -> None:
+        plans: list[cp.MermaidImagePlan] = []
+        html_out = cp.simple_markdown_to_html(
+            "```mermaid\ngraph TD\n```",
+            mermaid_mode="attachment",
+            mermaid_image_prefix="Doc",
+            mermaid_image_plans=plans,
+        )
+        self.assertIn('ri:filename="Doc Mermaid 01.svg"', html_out)
+        self.assertEqual(plans, [cp.MermaidImagePlan(filename="Doc Mermaid 01.svg", mermaid_source="graph TD")])
+
+    def test_empty_document(self) -> None:
+        self.assertEqual(cp.simple_markdown_to_html(""), "<p></p>")
+
+
+if __name__ == "__main__":
+    unittest.main()
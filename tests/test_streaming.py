@@ -0,0 +1,149 @@
+"""Tests for publishing files above --stream-threshold-mb: same output as the whole-file path, flat memory."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import tempfile
+import time
+import tracemalloc
+import unittest
+from pathlib import Path
+
+from support import cp
+
+# A block of everything the built-in converter handles; files are written by repeating it.
+CORPUS_BLOCK = """## Section
+
+Some **bold**, *emphasis* and `code` with <angle> & ampersands.
+
+- first item
+- second item
+
+| name | value |
+|:-----|------:|
+| a \\| b | 1 |
+
+```python
+print("hello")
+```
+
+"""
+# Eight times the input may peak at most this much higher; both sizes are far above the 256 KiB body chunks.
+STREAM_SIZES = (512 * 1024, 4 * 1024 * 1024)
+MAX_PEAK_GROWTH = 0.25
+
+
+def write_corpus(path: Path, size: int) -> None:
+    with path.open("w", encoding="utf-8") as fh:
+        fh.write("---\nlabels: big\n---\n# Large document\n\n")
+        for _ in range(size // len(CORPUS_BLOCK) + 1):
+            fh.write(CORPUS_BLOCK)
+
+
+class StreamingTestCase(unittest.TestCase):
+    """Streams every file above 64 KiB, so small generated files take the large-file path."""
+
+    def setUp(self) -> None:
+        self.addCleanup(cp.configure_streaming, min_bytes=cp.STREAM_MIN_BYTES)
+        cp.configure_streaming(min_bytes=64 * 1024)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp_dir = Path(tmp.name)
+
+    def streamed_update_body(self, path: Path) -> cp.StreamedJSONBody:
+        """The page update request body for `path`, built the way a publish builds it for a streamed file."""
+        doc = cp.parse_document(path)
+        self.assertTrue(doc.streamed)
+        self.assertEqual(doc.body_markdown, "")
+        payload = cp._ConfluenceApi._update_page_payload(
+            page_id="1",
+            title=doc.title,
+            body_html=cp.streamed_storage_body(doc, mermaid_mode="code", mermaid_image_width=1000),
+            next_version=2,
+            parent_id=None,
+        )
+        body = cp.encode_json_body(payload)
+        self.assertIsInstance(body, cp.StreamedJSONBody)
+        return body
+
+
+class StreamedBodyTest(StreamingTestCase):
+    def test_streamed_pieces_match_the_whole_conversion(self) -> None:
+        text = "# T\n\n- a\n\n```sh\nls\n```\n\n| a | b |\n|---|---|\n| 1 | 2 |\n\nend\n"
+        pieces = "".join(cp.iter_simple_markdown_html(iter(text.splitlines())))
+        self.assertEqual(pieces, cp.simple_markdown_to_html(text))
+
+    def test_streamed_request_body_matches_the_whole_file_conversion(self) -> None:
+        path = self.tmp_dir / "doc.md"
+        write_corpus(path, 128 * 1024)
+        body = self.streamed_update_body(path)
+        sent = json.loads(b"".join(body))
+        self.assertEqual(sent["title"], "Large document")
+        _, markdown = cp.parse_front_matter(path.read_text(encoding="utf-8"))
+        self.assertEqual(sent["body"]["value"], cp.simple_markdown_to_html(markdown))
+        # Every pass re-reads the file, so a retried request sends the same bytes.
+        self.assertEqual(b"".join(body), b"".join(body))
+
+
+
+class AsyncStreamedRequestTest(StreamingTestCase):
+    def test_response_wait_is_bounded_after_a_streamed_body(self) -> None:
+        path = self.tmp_dir / "doc.md"
+        write_corpus(path, 128 * 1024)
+        body = self.streamed_update_body(path)
+        received = asyncio.Event()
+
+        async def swallow(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            # Take the whole chunked request, then never answer.
+            tail = b""
+            while not tail.endswith(b"\r\n0\r\n\r\n"):
+                tail = (tail + await reader.read(65536))[-16:]
+            received.set()
+            await asyncio.sleep(60)
+
+        async def run() -> None:
+            server = await asyncio.start_server(swallow, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            pool = cp.AsyncHTTPConnectionPool(f"127.0.0.1:{port}", scheme="http", timeout=0.3)
+            started = time.monotonic()
+            try:
+                with self.assertRaises(asyncio.TimeoutError):
+                    # The outer limit only keeps a regression from hanging the suite.
+                    await asyncio.wait_for(pool.request("PUT", "/wiki/api/v2/pages/1", body=body), 5)
+                self.assertTrue(received.is_set())
+                self.assertLess(time.monotonic() - started, 3)
+            finally:
+                await pool.close()
+                server.close()
+
+        asyncio.run(run())
+
+
+class StreamingMemoryTest(StreamingTestCase):
+    def test_peak_memory_stays_flat_as_the_file_grows(self) -> None:
+        peaks: list[int] = []
+        for size in STREAM_SIZES:
+            path = self.tmp_dir / f"stream-{size}.md"
+            write_corpus(path, size)
+            tracemalloc.start()
+            try:
+                body = self.streamed_update_body(path)
+                sent = sum(len(chunk) for chunk in body)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.assertGreater(sent, size)
+            peaks.append(peak)
+            path.unlink()
+        small, large = peaks
+        self.assertLessEqual(
+            large,
+            small * (1 + MAX_PEAK_GROWTH),
+            f"tracemalloc peak grew from {small / 1024:.0f} KiB to {large / 1024:.0f} KiB "
+            f"as the file grew from {STREAM_SIZES[0] // 1024} KiB to {STREAM_SIZES[1] // 1024} KiB",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+"""Tests for resolving 409 version conflicts on page updates."""
+
+from __future__ import annotations
+
+import unittest
+
+from support import StandinTestCase
+
+
+class VersionConflictTest(StandinTestCase):
+    def test_version_conflict_retries_on_the_newer_version(self) -> None:
+        page_id = self.publish("first").page_id
+        # Someone else saved version 2 after our read.
+        self.page(page_id)["version"] = {"number": 2, "message": "edited in the browser"}
+        conflicts: list[tuple[int, int]] = []
+        self.client.update_page(
+            page_id=page_id,
+            title="Guide",
+            body_html="<p>ours</p>",
+            next_version=2,
+            parent_id=None,
+            conflicts=conflicts,
+        )
+        self.assertEqual(len(conflicts), 1)
+        self.assertEqual(self.page(page_id)["version"]["number"], 3)
+        self.assertEqual(self.page(page_id)["body"], "<p>ours</p>")
+
+    def test_conflict_from_own_lost_response_is_success(self) -> None:
+        page_id = self.publish("first").page_id
+        self.state.faults.lost_response_rate = 1.0
+        result = self.publish("second")
+        self.assertEqual((result.action, result.version), ("updated", 2))
+        self.assertEqual(self.page(page_id)["version"]["number"], 2)
+        self.assertEqual(self.state.injected["504 after write"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()